@@ -1,12 +1,40 @@
 import logging
-from flask import Flask, render_template, request
+import os
+from concurrent.futures import ThreadPoolExecutor
 
-from src.simple import SimpleChatBot, get_base_prompt, extend_prompt_with_errors
+from flask import (
+    Flask,
+    Response,
+    abort,
+    jsonify,
+    render_template,
+    request,
+    stream_template,
+)
+
+from src.backends import create_backend
+from src.batching import BatchScheduler
+from src.candidates import select_candidate
+from src.databases import UnknownDatabaseError
+from src.flows import simple_events
+from src.loader import LazyLoader
+from src.model_server import RemoteBotLoader, start_model_server
+from src.serving import (
+    DatabaseStates,
+    blob_response,
+    failure_display,
+    stats_sources,
+)
+from src.simple import SimpleChatBot
+from src.sse import format_event
+from src.tracing import span, traced_iter, tracer
 from src.utils import (
+    POOL_SIZE,
+    database_names,
+    get_database,
     scan_db_schema,
-    validate_sql,
-    execute_sql,
-    hardcoded_check_order_details_table_name,
+    stream_sql,
+    use_database,
 )
 
 logging.basicConfig(
@@ -20,75 +48,273 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# Schema of the default database, whose prompt prefix the bot prefills once
 db_schema = scan_db_schema()
 dialect = "sqlite3"
 attempts = 5
-bot = SimpleChatBot(dialect, db_schema, attempts, logger)
 
+# Inference engine: "transformers" (GPUs, else CPU), "llama_cpp" (quantized GGUF
+# on CPU) or "replay" (recorded completions, no model), see src/backends.py
+backend_name = "transformers"
+backend_options = {}  # e.g. {"device": "cpu"} or {"model_path": "model.Q4_K_M.gguf"}
+backend_record_path = None  # e.g. "replay.json" to record the completions
 
-@app.route("/", methods=["GET", "POST"])
-def index():
-    if request.method == "POST":
-        user_input = request.form["user_input"]
-        logger.info(f"\x1b[36m -- Received user input: {user_input}\x1b[0m")
-
-        base_prompt = get_base_prompt(dialect, db_schema, user_input)
-        error_message = ""
-        attempts = 5
-        errors = []
-        for attempt in range(attempts):
-            logger.info(
-                f"\x1b[36m -- Attempt {attempt + 1} to generate SQL query\x1b[0m"
-            )
 
-            prompt = extend_prompt_with_errors(base_prompt, errors)
-            logger.debug(f"""User prompt:
----
-{prompt}
----
-""")
-
-            sql_query = bot(prompt)
-            sql_query = hardcoded_check_order_details_table_name(sql_query)
-
-            logger.info(f"\x1b[33m Generated SQL Query: {sql_query}\x1b[0m")
-            is_valid, error_message = validate_sql(sql_query)
-            if is_valid:
-                logger.info(f"\x1b[33m SQL Query Valid: {is_valid}\x1b[0m")
-
-                results, columns = execute_sql(sql_query)
-                return render_template(
-                    "index.html",
-                    results=results,
-                    columns=columns,
-                    query=user_input,
-                    sql_query=sql_query,
-                    zip=zip,
-                    db_schema=db_schema,
-                )
-            else:
-                errors.append(
-                    {
-                        "sql_query": sql_query,
-                        "message": error_message,
-                    }
-                )
-                logger.warning("SQL Query failed validation: %s", error_message)
-
-        error_display = (
-            f"Failed to generate a valid SQL query after {attempts} attempts.<br><br>"
-            f"<strong>Last attempted SQL query:</strong><br><pre>{sql_query}</pre><br>"
-            f"<strong>Error message:</strong><br>{error_message}"
-        )
-        logger.error("All attempts failed. Error message: %s", error_message)
+def load_bot():
+    backend = create_backend(backend_name, backend_record_path, **backend_options)
+    return SimpleChatBot(dialect, db_schema, attempts, logger, backend=backend)
+
+
+# The model takes minutes to load: "lazy" loads it on the first question,
+# "background" starts a warm-up thread at import and "preload" loads it at
+# import, e.g. in a `gunicorn --preload` master so that the forked workers
+# share the weights copy-on-write (CPU backends only: CUDA does not survive
+# a fork). GET /ready answers 200 once it is loaded.
+model_loading = "background"
+
+# "local": the model runs in this process. "server": it runs in one model server
+# process, forked at import and shared by every worker process, e.g. of
+# `gunicorn --preload -w 8 app:app`, which then only do the SQLite, validation
+# and rendering work (see src/model_server.py). `model_loading` then applies to
+# the server: nothing is loaded in this process
+model_process = "local"
+model_server_address = ("127.0.0.1", 6001)
+# None: a random key, shared by the workers forked from this process. Set one
+# for workers started otherwise: any local process knowing it can call the model
+model_server_authkey = None
+
+if model_process == "server":
+    authkey = model_server_authkey or os.urandom(32)
+    start_model_server(load_bot, model_server_address, authkey, model_loading)
+    bot_loader = RemoteBotLoader(model_server_address, authkey)
+else:
+    bot_loader = LazyLoader(load_bot, "chat bot")
+    bot_loader.start(model_loading)
+
+# Concurrent requests are grouped into one padded generate call. The model
+# server batches the prompts of every worker itself: a scheduler here too would
+# only add its wait to every generation
+batch_max_size = 8
+batch_max_wait_ms = 20
+if model_process == "local":
+    scheduler = BatchScheduler(
+        lambda prompts: bot_loader.get().think_batch(prompts),
+        batch_max_size,
+        batch_max_wait_ms,
+    )
+    generate_sql = scheduler
+else:
+    scheduler = None
+
+    def generate_sql(prompt):
+        return bot_loader.get().think_batch([prompt])[0]
+
+
+# Above 1, each attempt samples that many queries in one generate call and
+# validates them concurrently; ranking is "first_valid" or "consistency"
+num_candidates = 1
+candidate_ranking = "first_valid"
+candidate_executor = ThreadPoolExecutor(max_workers=POOL_SIZE)
+
+# Repeated questions skip the LLM: question -> last validated SQL
+question_cache_path = None  # e.g. "question_cache.db" to persist across restarts
+
+# Validated answers become examples: the closest ones to each question go in
+# the prompt, so that the model can reuse their join paths (0 disables them)
+fewshot_k = 3
+fewshot_method = "hashed"  # or "bm25"
+fewshot_path = None  # e.g. "fewshot.db" to persist across restarts
+fewshot_seed_paths = {}  # e.g. {"northwind": "benchmarks/gold_northwind.json"}
+
+# Only put the tables relevant to each question in the prompt (large databases)
+schema_pruning = False
+schema_token_budget = 2048
+
+# Spans of every request feed GET /metrics; this fraction of the prompts is
+# also logged (they are long: logging all of them slows every attempt down)
+prompt_sample_rate = 0.0
+tracer.prompt_sample_rate = prompt_sample_rate
+
+
+database_states = DatabaseStates(
+    dialect,
+    question_cache_path,
+    fewshot_k=fewshot_k,
+    fewshot_method=fewshot_method,
+    fewshot_path=fewshot_path,
+    fewshot_seed_paths=fewshot_seed_paths,
+    schema_pruning=schema_pruning,
+    schema_token_budget=schema_token_budget,
+)
+
+
+def database_state():
+    """DatabaseState of the database of the current `use_database` block."""
+    return database_states.current()
+
+
+@app.errorhandler(UnknownDatabaseError)
+def unknown_database(error):
+    return jsonify(error=str(error)), 404
+
+
+def render(template_name, **context):
+    with span("render", template=template_name):
         return render_template(
-            "index.html",
-            error=error_display,
-            query=user_input,
-            db_schema=db_schema,
+            template_name,
+            databases=database_names(),
+            database=get_database().name,
+            **context,
         )
 
-    return render_template("index.html", db_schema=db_schema)
+
+def render_stream(template_name, **context):
+    """stream_template, timing the rendering and the rows it pulls as a span."""
+    response = stream_template(
+        template_name,
+        databases=database_names(),
+        database=get_database().name,
+        **context,
+    )
+    response.response = traced_iter("render", response.response, template=template_name)
+    return response
+
+
+def answer(user_input, page):
+    state = database_state()
+
+    def events():
+        base_prompt = state.base_prompt_for(user_input)
+        if num_candidates > 1:
+            return simple_events(
+                base_prompt,
+                lambda prompt: bot_loader.get().think_candidates(
+                    prompt, num_candidates
+                ),
+                attempts,
+                lambda candidates: select_candidate(
+                    candidates, candidate_ranking, candidate_executor
+                ),
+                candidates=num_candidates,
+            )
+        return simple_events(base_prompt, generate_sql, attempts)
+
+    for event, data in state.answer_events(user_input, "simple", events):
+        if event == "done":
+            results = stream_sql(data["sql_query"], page)
+            return render_stream(
+                "index.html",
+                results=results,
+                columns=results.columns,
+                page=page,
+                query=user_input,
+                sql_query=data["sql_query"],
+                zip=zip,
+                db_schema=state.db_schema,
+            )
+
+    # The loop ended on the "failed" event
+    return render(
+        "index.html",
+        error=failure_display(data),
+        query=user_input,
+        db_schema=state.db_schema,
+    )
+
+
+@app.route("/", methods=["GET", "POST"])
+def index():
+    # The database is picked by the `db` form field or query parameter
+    with use_database(request.values.get("db")) as database:
+        if request.method == "POST":
+            user_input = request.form["user_input"]
+            page = request.form.get("page", 0, type=int)
+            logger.info(f"\x1b[36m -- Received user input: {user_input}\x1b[0m")
+            with tracer.trace("question", flow="simple", db=database.name):
+                return answer(user_input, page)
+
+        return render("index.html", db_schema=database_state().db_schema)
+
+
+def question_events(user_input, database=None):
+    """
+    Answer a question on `database` like `index` does, yielding (event, data)
+    pairs: "attempt", "token" for each decoded piece, "sql", "invalid" and
+    lastly "done" with the validated SQL or "failed".
+    """
+    with (
+        use_database(database) as current,
+        tracer.trace("question", flow="simple", streamed=True, db=current.name),
+    ):
+        yield from _question_events(user_input)
+
+
+def _question_events(user_input):
+    state = database_state()
+    # Streamed generations are not batched: tokens go straight to the client
+    yield from state.answer_events(
+        user_input,
+        "simple",
+        lambda: simple_events(
+            state.base_prompt_for(user_input),
+            lambda prompt: bot_loader.get().think_stream(prompt),
+            attempts,
+            streamed=True,
+        ),
+    )
+
+
+@app.route("/stream", methods=["GET"])
+def stream():
+    """Server-sent events of `question_events`."""
+    user_input = request.args.get("user_input", "")
+    # Checked now: once streaming, errors can no longer be answered with a 404
+    database = get_database(request.args.get("db")).name
+    logger.info(f"\x1b[36m -- Streaming answer to: {user_input}\x1b[0m")
+    events = question_events(user_input, database)
+    return Response(
+        (format_event(event, data) for event, data in events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/blob/<digest>", methods=["GET"])
+def blob(digest):
+    return Response(*blob_response(digest, request.headers.get("If-None-Match")))
+
+
+def stopping_stats():
+    bot = bot_loader.peek()
+    return bot.stopping_stats.stats() if bot is not None else {}
+
+
+stats = dict(
+    stats_sources(database_states, bot_loader),
+    batching=lambda: scheduler.stats() if scheduler is not None else {},
+    stopping=stopping_stats,
+)
+
+
+@app.route("/stats/<name>", methods=["GET"])
+def stats_of(name):
+    if name not in stats:
+        abort(404)
+    with use_database(request.args.get("db")):
+        return jsonify(stats[name]())
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(tracer.metrics(), content_type="text/plain; version=0.0.4")
+
+
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness probe: 503 until the model is loaded."""
+    status = bot_loader.status()
+    return jsonify(status), 200 if status["ready"] else 503
 
 
 if __name__ == "__main__":
@@ -0,0 +1,416 @@
+import asyncio
+import contextvars
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from jinja2 import Environment, FileSystemLoader
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.responses import (
+    HTMLResponse,
+    JSONResponse,
+    Response,
+    StreamingResponse,
+)
+from starlette.routing import Route
+
+from src.actions import ActionStats
+from src.asgi import AdmissionControl, BodySizeLimit, Overloaded, overloaded
+from src.backends import create_backend
+from src.batching import BatchScheduler
+from src.databases import UnknownDatabaseError
+from src.flows import react_events, simple_events
+from src.loader import LazyLoader
+from src.model_server import RemoteBotLoader, start_model_server
+from src.react import ReactChatBot
+from src.serving import (
+    DatabaseStates,
+    blob_response,
+    failure_display,
+    stats_sources,
+)
+from src.simple import SimpleChatBot
+from src.sse import format_event
+from src.tracing import span, tracer
+from src.utils import (
+    POOL_SIZE,
+    database_names,
+    fetch_page,
+    get_database,
+    scan_db_schema,
+    use_database,
+)
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    handlers=[
+        logging.StreamHandler(),
+    ],
+)
+logger = logging.getLogger(__name__)
+
+# Schema of the default database, whose prompt prefix the bot prefills once
+db_schema = scan_db_schema()
+dialect = "sqlite3"
+attempts = 5
+
+# "simple": the flow of app.py. "react": the ReAct agent of app_react.py
+flow = "simple"
+
+# Inference engine: "transformers" (GPUs, else CPU), "llama_cpp" (quantized GGUF
+# on CPU) or "replay" (recorded completions, no model), see src/backends.py
+backend_name = "transformers"
+backend_options = {}  # e.g. {"device": "cpu"} or {"model_path": "model.Q4_K_M.gguf"}
+backend_record_path = None  # e.g. "replay.json" to record the completions
+
+
+def load_bot():
+    backend = create_backend(backend_name, backend_record_path, **backend_options)
+    if flow == "react":
+        return ReactChatBot(dialect, db_schema, attempts, backend=backend)
+    return SimpleChatBot(dialect, db_schema, attempts, logger, backend=backend)
+
+
+# The model takes minutes to load: "lazy" loads it on the first question,
+# "background" starts a warm-up thread at import and "preload" loads it at
+# import, e.g. in a `gunicorn --preload` master so that the forked workers
+# share the weights copy-on-write (CPU backends only: CUDA does not survive
+# a fork). GET /ready answers 200 once it is loaded.
+model_loading = "background"
+
+# "local": the model runs in this process. "server": it runs in one model server
+# process, forked at import and shared by every worker process, e.g. of
+# `gunicorn --preload -w 8 -k uvicorn.workers.UvicornWorker app_async:app`, which
+# then only do the SQLite, validation and rendering work (see
+# src/model_server.py). `model_loading` then applies to the server: nothing is
+# loaded in this process
+model_process = "local"
+model_server_address = ("127.0.0.1", 6001)
+# None: a random key, shared by the workers forked from this process. Set one
+# for workers started otherwise: any local process knowing it can call the model
+model_server_authkey = None
+
+if model_process == "server":
+    authkey = model_server_authkey or os.urandom(32)
+    start_model_server(load_bot, model_server_address, authkey, model_loading)
+    bot_loader = RemoteBotLoader(model_server_address, authkey)
+else:
+    bot_loader = LazyLoader(load_bot, "chat bot")
+    bot_loader.start(model_loading)
+
+# Inference runs on the scheduler's worker thread, batching concurrent questions.
+# The model server batches the prompts of every worker itself: a scheduler here
+# too would only add its wait to every generation
+batch_max_size = 8
+batch_max_wait_ms = 20
+scheduler = None
+if model_process == "local" and flow == "simple":
+    scheduler = BatchScheduler(
+        lambda prompts: bot_loader.get().think_batch(prompts),
+        batch_max_size,
+        batch_max_wait_ms,
+    )
+
+# Questions beyond max_in_flight + max_queue_depth are answered with a 429
+admission = AdmissionControl(max_in_flight=16, max_queue_depth=64)
+# Larger request bodies are answered with a 413: a question form is a few hundred
+# bytes
+max_request_bytes = 64 * 1024
+
+# The flows block on the model and on SQLite: each question in flight is worked
+# on by one of these threads, the event loop only relays its events
+question_executor = ThreadPoolExecutor(
+    max_workers=admission.max_in_flight, thread_name_prefix="question"
+)
+# Other SQLite work (paging, schema checks, stats) stays off the event loop too
+db_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="db")
+
+# Repeated questions skip the LLM: question -> last validated SQL
+question_cache_path = None  # e.g. "question_cache.db" to persist across restarts
+
+# Validated answers of the simple flow become examples: the closest ones to each
+# question go in the prompt, so that the model can reuse their join paths (0
+# disables them)
+fewshot_k = 3
+fewshot_method = "hashed"  # or "bm25"
+fewshot_path = None  # e.g. "fewshot.db" to persist across restarts
+fewshot_seed_paths = {}  # e.g. {"northwind": "benchmarks/gold_northwind.json"}
+
+# Only put the tables relevant to each question in the prompt (large databases)
+schema_pruning = False
+schema_token_budget = 2048
+
+# Latency of the agent actions and actions taken per question (ReAct flow)
+action_stats = ActionStats()
+
+# Spans of every request feed GET /metrics; this fraction of the prompts is
+# also logged (they are long: logging all of them slows every attempt down)
+prompt_sample_rate = 0.0
+tracer.prompt_sample_rate = prompt_sample_rate
+
+database_states = DatabaseStates(
+    dialect,
+    question_cache_path,
+    examples=flow == "simple",
+    fewshot_k=fewshot_k,
+    fewshot_method=fewshot_method,
+    fewshot_path=fewshot_path,
+    fewshot_seed_paths=fewshot_seed_paths,
+    schema_pruning=schema_pruning,
+    schema_token_budget=schema_token_budget,
+)
+
+templates = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(__file__), "templates")),
+    autoescape=True,
+)
+template_name = "react_index.html" if flow == "react" else "index.html"
+
+
+def database_state():
+    """DatabaseState of the database of the current `use_database` block."""
+    return database_states.current()
+
+
+async def run_db(fn, *args):
+    # With the request's context, so that the spans join its trace
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        db_executor, context.run, fn, *args
+    )
+
+
+async def pull_events(events):
+    """
+    Relay the (event, data) pairs of a flow, each pulled on the question
+    executor. The generator keeps one context, the request's, so that its
+    `use_database` block and spans last from one event to the next.
+    """
+    context = contextvars.copy_context()
+    future = None
+    try:
+        while True:
+            future = question_executor.submit(context.run, next, events, None)
+            item = await asyncio.wrap_future(future)
+            if item is None:
+                return
+            yield item
+    finally:
+        # e.g. the client went away: closed once the pending `next` returns
+        if future is not None:
+            future.add_done_callback(lambda _: context.run(events.close))
+
+
+def generate_sql(prompt):
+    if scheduler is not None:
+        return scheduler.submit(prompt).result()
+    return bot_loader.get().think_batch([prompt])[0]
+
+
+def _simple_events(state, user_input, stream_tokens):
+    base_prompt = state.base_prompt_for(user_input)
+    if stream_tokens:
+        # Streamed generations are not batched: tokens go straight to the client
+        return simple_events(
+            base_prompt,
+            lambda prompt: bot_loader.get().think_stream(prompt),
+            attempts,
+            streamed=True,
+        )
+    return simple_events(base_prompt, generate_sql, attempts)
+
+
+def _question_events(user_input, stream_tokens=False):
+    state = database_state()
+    if flow == "simple":
+        yield from state.answer_events(
+            user_input,
+            "simple",
+            lambda: _simple_events(state, user_input, stream_tokens),
+        )
+        return
+
+    events = state.answer_events(
+        user_input,
+        "react",
+        lambda: react_events(
+            user_input,
+            bot_loader.get(),
+            action_stats.run,
+            state.prompt_schema(user_input),
+            stream_tokens,
+        ),
+    )
+    for event, data in events:
+        # Cached answers took no action
+        if event in ("done", "failed") and "actions" in data:
+            action_stats.record_question(data["actions"])
+        yield event, data
+
+
+def question_events(user_input, database=None, stream_tokens=False):
+    """
+    Answer a question on `database` with the `flow` of the app, yielding
+    (event, data) pairs: those of src/flows.py, "token" ones only if
+    `stream_tokens`, and lastly "done" with the validated SQL or "failed".
+    """
+    with (
+        use_database(database) as current,
+        tracer.trace("question", flow=flow, streamed=stream_tokens, db=current.name),
+    ):
+        yield from _question_events(user_input, stream_tokens)
+
+
+def render(name, **context):
+    with span("render", template=name):
+        template = templates.get_template(name)
+        return HTMLResponse(
+            template.render(
+                databases=database_names(), database=get_database().name, **context
+            )
+        )
+
+
+async def answer(user_input, page):
+    agent_outputs = []
+    async for event, data in pull_events(_question_events(user_input)):
+        if event == "step":
+            agent_outputs.append(data)
+
+    state = await run_db(database_state)
+    if event == "failed":
+        return render(
+            template_name,
+            error=failure_display(data),
+            query=user_input,
+            db_schema=state.db_schema,
+            agent_outputs=agent_outputs,
+        )
+
+    results = await run_db(fetch_page, data["sql_query"], page)
+    return render(
+        template_name,
+        results=results,
+        columns=results.columns,
+        page=page,
+        query=user_input,
+        sql_query=data["sql_query"],
+        zip=zip,
+        db_schema=state.db_schema,
+        agent_outputs=agent_outputs,
+    )
+
+
+async def index(request):
+    form = await request.form() if request.method == "POST" else {}
+    # The database is picked by the `db` form field or query parameter
+    with use_database(form.get("db") or request.query_params.get("db")) as database:
+        if request.method == "POST":
+            user_input = form.get("user_input", "")
+            try:
+                page = int(form.get("page") or 0)
+            except ValueError:
+                page = 0
+            logger.info(f"\x1b[36m -- Received user input: {user_input}\x1b[0m")
+
+            async with admission.slot():
+                with tracer.trace("question", flow=flow, db=database.name):
+                    return await answer(user_input, page)
+
+        state = await run_db(database_state)
+        return render(template_name, db_schema=state.db_schema)
+
+
+async def stream(request):
+    """Server-sent events of `question_events`, tokens included."""
+    user_input = request.query_params.get("user_input", "")
+    # Checked now: once streaming, errors can no longer be answered with a 404
+    database = get_database(request.query_params.get("db")).name
+    logger.info(f"\x1b[36m -- Streaming answer to: {user_input}\x1b[0m")
+
+    events = pull_events(question_events(user_input, database, stream_tokens=True))
+    response = StreamingResponse(
+        (format_event(event, data) async for event, data in events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    return await admission.hold(response)
+
+
+async def blob(request):
+    digest = request.path_params["digest"]
+    if_none_match = request.headers.get("if-none-match")
+    return Response(*await run_db(blob_response, digest, if_none_match))
+
+
+def stopping_stats():
+    bot = bot_loader.peek()
+    return bot.stopping_stats.stats() if bot is not None else {}
+
+
+stats = dict(stats_sources(database_states, bot_loader), admission=admission.stats)
+if flow == "simple":
+    stats["batching"] = lambda: scheduler.stats() if scheduler is not None else {}
+    stats["stopping"] = stopping_stats
+else:
+    stats["actions"] = action_stats.stats
+
+
+async def stats_of(request):
+    name = request.path_params["name"]
+    if name not in stats:
+        raise HTTPException(404)
+    with use_database(request.query_params.get("db")):
+        return JSONResponse(await run_db(stats[name]))
+
+
+async def metrics(request):
+    """Prometheus scrape endpoint."""
+    return Response(tracer.metrics(), media_type="text/plain; version=0.0.4")
+
+
+async def ready(request):
+    """Readiness probe: 503 until the model is loaded."""
+    status = bot_loader.status()
+    return JSONResponse(status, 200 if status["ready"] else 503)
+
+
+async def unknown_database(request, error):
+    return JSONResponse({"error": str(error)}, 404)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    if scheduler is not None:
+        scheduler.close()
+    question_executor.shutdown()
+    db_executor.shutdown()
+
+
+app = Starlette(
+    routes=[
+        Route("/", index, methods=["GET", "POST"]),
+        Route("/stream", stream),
+        Route("/blob/{digest}", blob),
+        Route("/stats/{name}", stats_of),
+        Route("/metrics", metrics),
+        Route("/ready", ready),
+    ],
+    middleware=[Middleware(BodySizeLimit, max_bytes=max_request_bytes)],
+    exception_handlers={
+        UnknownDatabaseError: unknown_database,
+        Overloaded: overloaded,
+    },
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -3,12 +3,40 @@ ReAct agent from https://arxiv.org/abs/2210.03629
 """
 
 import logging
-import json
-from flask import Flask, render_template, request
+import os
 
+from flask import (
+    Flask,
+    Response,
+    abort,
+    jsonify,
+    render_template,
+    request,
+    stream_template,
+)
 
-from src.react import ReactChatBot, generate_user_prompt, extend_user_prompt
-from src.utils import scan_db_schema, validate_sql, execute_sql
+from src.actions import ActionStats
+from src.backends import create_backend
+from src.databases import UnknownDatabaseError
+from src.flows import react_events
+from src.loader import LazyLoader
+from src.model_server import RemoteBotLoader, start_model_server
+from src.react import ReactChatBot
+from src.serving import (
+    DatabaseStates,
+    blob_response,
+    failure_display,
+    stats_sources,
+)
+from src.sse import format_event
+from src.tracing import span, traced_iter, tracer
+from src.utils import (
+    database_names,
+    get_database,
+    scan_db_schema,
+    stream_sql,
+    use_database,
+)
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -21,119 +49,221 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
+# Schema of the default database, whose prompt prefix the bot prefills once
 db_schema = scan_db_schema()
 dialect = "sqlite3"
 attempts = 5
-bot = ReactChatBot(dialect, db_schema, attempts)
+
+# Inference engine: "transformers" (GPUs, else CPU), "llama_cpp" (quantized GGUF
+# on CPU) or "replay" (recorded completions, no model), see src/backends.py
+backend_name = "transformers"
+backend_options = {}  # e.g. {"device": "cpu"} or {"model_path": "model.Q4_K_M.gguf"}
+backend_record_path = None  # e.g. "replay.json" to record the completions
+
+
+def load_bot():
+    backend = create_backend(backend_name, backend_record_path, **backend_options)
+    return ReactChatBot(dialect, db_schema, attempts, backend=backend)
+
+
+# The model takes minutes to load: "lazy" loads it on the first question,
+# "background" starts a warm-up thread at import and "preload" loads it at
+# import, e.g. in a `gunicorn --preload` master so that the forked workers
+# share the weights copy-on-write (CPU backends only: CUDA does not survive
+# a fork). GET /ready answers 200 once it is loaded.
+model_loading = "background"
+
+# "local": the model runs in this process. "server": it runs in one model server
+# process, forked at import and shared by every worker process, e.g. of
+# `gunicorn --preload -w 8 app_react:app`, which then only do the SQLite, validation
+# and rendering work (see src/model_server.py). `model_loading` then applies to
+# the server: nothing is loaded in this process
+model_process = "local"
+model_server_address = ("127.0.0.1", 6001)
+# None: a random key, shared by the workers forked from this process. Set one
+# for workers started otherwise: any local process knowing it can call the model
+model_server_authkey = None
+
+if model_process == "server":
+    authkey = model_server_authkey or os.urandom(32)
+    start_model_server(load_bot, model_server_address, authkey, model_loading)
+    bot_loader = RemoteBotLoader(model_server_address, authkey)
+else:
+    bot_loader = LazyLoader(load_bot, "chat bot")
+    bot_loader.start(model_loading)
+
+# Repeated questions skip the LLM: question -> last validated SQL
+question_cache_path = None  # e.g. "question_cache.db" to persist across restarts
+
+# Latency of the agent actions and actions taken per question
+action_stats = ActionStats()
+
+# Only put the tables relevant to each question in the prompt (large databases)
+schema_pruning = False
+schema_token_budget = 2048
+
+# Spans of every request feed GET /metrics; this fraction of the prompts is
+# also logged (they are long: logging all of them slows every attempt down)
+prompt_sample_rate = 0.0
+tracer.prompt_sample_rate = prompt_sample_rate
+
+
+# Validated answers are cached but not kept as examples: the agent does not use them
+database_states = DatabaseStates(
+    dialect,
+    question_cache_path,
+    examples=False,
+    schema_pruning=schema_pruning,
+    schema_token_budget=schema_token_budget,
+)
+
+
+def database_state():
+    """DatabaseState of the database of the current `use_database` block."""
+    return database_states.current()
+
+
+@app.errorhandler(UnknownDatabaseError)
+def unknown_database(error):
+    return jsonify(error=str(error)), 404
+
+
+def render(template_name, **context):
+    with span("render", template=template_name):
+        return render_template(
+            template_name,
+            databases=database_names(),
+            database=get_database().name,
+            **context,
+        )
+
+
+def render_stream(template_name, **context):
+    """stream_template, timing the rendering and the rows it pulls as a span."""
+    response = stream_template(
+        template_name,
+        databases=database_names(),
+        database=get_database().name,
+        **context,
+    )
+    response.response = traced_iter("render", response.response, template=template_name)
+    return response
+
+
+def run_agent(user_input, stream_tokens=False, database=None):
+    """
+    Answer a question on `database`, yielding (event, data) pairs as the
+    episode unfolds: "attempt", "token" (decoded pieces, only if
+    `stream_tokens`), "step" (each parsed Scratchpad/Thought/Action/Observation
+    or final answer) and lastly "done" with the validated SQL or "failed".
+    """
+    with (
+        use_database(database) as current,
+        tracer.trace("question", flow="react", streamed=stream_tokens, db=current.name),
+    ):
+        yield from _run_agent(user_input, stream_tokens)
+
+
+def _run_agent(user_input, stream_tokens):
+    state = database_state()
+    events = state.answer_events(
+        user_input,
+        "react",
+        lambda: react_events(
+            user_input,
+            bot_loader.get(),
+            action_stats.run,
+            state.prompt_schema(user_input),
+            stream_tokens,
+        ),
+    )
+    for event, data in events:
+        # Cached answers took no action
+        if event in ("done", "failed") and "actions" in data:
+            action_stats.record_question(data["actions"])
+        yield event, data
 
 
 @app.route("/", methods=["GET", "POST"])
 def index():
-    if request.method == "POST":
-        user_input = request.form["user_input"]
-        logger.info(f"\x1b[36m -- Received user input: {user_input}\x1b[0m")
-
-        user_prompt = generate_user_prompt(user_input)
-        errors = []
-        previous_actions = []
-        agent_outputs = []
-        for attempt in range(bot.attempts):
-            logger.info(
-                f"\x1b[36m -- Attempt {attempt + 1} to generate SQL query\x1b[0m"
-            )
-            logger.debug(f"""User prompt:
----
-{user_prompt}
----
-""")
-
-            json_result = bot(user_prompt)
-            data = json.loads(json_result)
-            decision = data["Decision"]
-            if "Final_Answer" not in list(decision.keys()):
-                scratchpad = decision["Scratchpad"]
-                thought = decision["Thought"]
-                action = decision["Action"]
-                action_input = decision["Action_Input"]
-                logger.info(f"\x1b[34m Scratchpad: {scratchpad} \x1b[0m")
-                logger.info(f"\x1b[34m Thought: {thought} \x1b[0m")
-                logger.info(
-                    f"\x1b[36m  -- running action: {action} with inputs: {action_input}\x1b[0m"
-                )
-                if action + ": " + str(action_input) in previous_actions:
-                    observation = (
-                        "You already run that action. **TRY A DIFFERENT ACTION INPUT.**"
-                    )
-                else:
-                    if action == "verify":
-                        is_valid, error = validate_sql(action_input)
-                        if is_valid:
-                            observation = f"Validity: {is_valid}"
-                        else:
-                            observation = f"Validity: {is_valid}, Error: {error}"
-                logger.info(f"\x1b[33m Observation: {observation} \x1b[0m")
-                previous_actions.append(action + ": " + str(action_input))
-                agent_outputs.append(
-                    {
-                        "scratchpad": scratchpad,
-                        "thought": thought,
-                        "action": action,
-                        "action_input": action_input,
-                        "observation": observation,
-                    }
-                )
-
-                user_prompt = extend_user_prompt(
-                    user_prompt, scratchpad, thought, action, action_input, observation
-                )
-
-            else:
-                thought = decision["Final_Thought"]
-                sql_query = decision["Final_Answer"]
-                logger.info(f"\x1b[34m Final thought: {thought} \x1b[0m")
-                logger.info(f"\x1b[34m Final Answer: {sql_query} \x1b[0m")
-                agent_outputs.append(
-                    {"final_thought": thought, "final_answer": sql_query}
-                )
-
-                is_valid, error_message = validate_sql(sql_query)
-                if is_valid:
-                    results, columns = execute_sql(sql_query)
-                    return render_template(
+    # The database is picked by the `db` form field or query parameter
+    with use_database(request.values.get("db")):
+        if request.method == "POST":
+            user_input = request.form["user_input"]
+            page = request.form.get("page", 0, type=int)
+            logger.info(f"\x1b[36m -- Received user input: {user_input}\x1b[0m")
+
+            agent_outputs = []
+            for event, data in run_agent(user_input):
+                if event == "step":
+                    agent_outputs.append(data)
+                elif event == "done":
+                    results = stream_sql(data["sql_query"], page)
+                    return render_stream(
                         "react_index.html",
                         results=results,
-                        columns=columns,
+                        columns=results.columns,
+                        page=page,
                         query=user_input,
-                        sql_query=sql_query,
+                        sql_query=data["sql_query"],
                         zip=zip,
-                        db_schema=db_schema,
+                        db_schema=database_state().db_schema,
                         agent_outputs=agent_outputs,
                     )
-                else:
-                    errors.append(
-                        {
-                            "sql_query": sql_query,
-                            "message": error_message,
-                        }
+                elif event == "failed":
+                    return render(
+                        "react_index.html",
+                        error=failure_display(data),
+                        query=user_input,
+                        db_schema=database_state().db_schema,
+                        agent_outputs=agent_outputs,
                     )
-                    logger.warning("SQL Query failed validation: %s", error_message)
-                break
 
-        error_display = (
-            f"Failed to generate a valid SQL query after {bot.attempts} attempts.<br><br>"
-            f"<strong>Last attempted SQL query:</strong><br><pre>{sql_query}</pre><br>"
-            f"<strong>Error message:</strong><br>{error_message}"
-        )
-        logger.error("All attempts failed. Error message: %s", error_message)
-        return render_template(
-            "react_index.html",
-            error=error_display,
-            query=user_input,
-            db_schema=db_schema,
-            agent_outputs=agent_outputs,
-        )
+        return render("react_index.html", db_schema=database_state().db_schema)
+
+
+@app.route("/stream", methods=["GET"])
+def stream():
+    """Server-sent events of `run_agent`, tokens included."""
+    user_input = request.args.get("user_input", "")
+    # Checked now: once streaming, errors can no longer be answered with a 404
+    database = get_database(request.args.get("db")).name
+    logger.info(f"\x1b[36m -- Streaming answer to: {user_input}\x1b[0m")
+    events = run_agent(user_input, stream_tokens=True, database=database)
+    return Response(
+        (format_event(event, data) for event, data in events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/blob/<digest>", methods=["GET"])
+def blob(digest):
+    return Response(*blob_response(digest, request.headers.get("If-None-Match")))
+
+
+stats = dict(stats_sources(database_states, bot_loader), actions=action_stats.stats)
+
+
+@app.route("/stats/<name>", methods=["GET"])
+def stats_of(name):
+    if name not in stats:
+        abort(404)
+    with use_database(request.args.get("db")):
+        return jsonify(stats[name]())
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(tracer.metrics(), content_type="text/plain; version=0.0.4")
+
 
-    return render_template("react_index.html", db_schema=db_schema)
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness probe: 503 until the model is loaded."""
+    status = bot_loader.status()
+    return jsonify(status), 200 if status["ready"] else 503
 
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+"""
+Throughput/latency of the BatchScheduler with a stub model.
+
+The stub mimics a GPU forward pass: the cost of a batch is a fixed overhead
+plus a small per-sequence term, so batching pays off when requests overlap.
+
+    python -m benchmarks.bench_batching --requests 64 --concurrency 16
+"""
+
+import argparse
+import json
+import threading
+import time
+
+from src.batching import BatchScheduler
+
+
+class StubModel:
+    def __init__(self, fixed_ms: float, per_item_ms: float):
+        self.fixed_ms = fixed_ms
+        self.per_item_ms = per_item_ms
+
+    def generate_batch(self, prompts):
+        time.sleep((self.fixed_ms + self.per_item_ms * len(prompts)) / 1000)
+        return [f"SELECT '{prompt}';" for prompt in prompts]
+
+
+def run(scheduler, requests: int, concurrency: int):
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                idx = next(counter, None)
+            if idx is None:
+                return
+            scheduler(f"question {idx}")
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    scheduler.close()
+
+    stats = scheduler.stats()
+    stats["wall_time_s"] = elapsed
+    stats["throughput_rps"] = requests / elapsed
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=20)
+    parser.add_argument("--fixed-ms", type=float, default=50)
+    parser.add_argument("--per-item-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    model = StubModel(args.fixed_ms, args.per_item_ms)
+    results = {
+        "serial": run(
+            BatchScheduler(model.generate_batch, max_batch_size=1, max_wait_ms=0),
+            args.requests,
+            args.concurrency,
+        ),
+        "batched": run(
+            BatchScheduler(
+                model.generate_batch,
+                max_batch_size=args.max_batch_size,
+                max_wait_ms=args.max_wait_ms,
+            ),
+            args.requests,
+            args.concurrency,
+        ),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Latency of the sequential retry loop against parallel candidate generation,
+with a stub model.
+
+Generating a batch costs a fixed overhead plus a small per-sequence term, each
+sample is valid with probability `--valid-rate`, and validating a query takes
+`--validate-ms`.
+
+    python -m benchmarks.bench_candidates --candidates 5 --valid-rate 0.4
+"""
+
+import argparse
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.batching import percentile
+from src.candidates import select_candidate
+
+
+class StubModel:
+    def __init__(self, fixed_ms: float, per_item_ms: float, valid_rate: float, seed=0):
+        self.fixed_ms = fixed_ms
+        self.per_item_ms = per_item_ms
+        self.valid_rate = valid_rate
+        self.rng = random.Random(seed)
+        self.generations = 0
+
+    def generate(self, n: int):
+        self.generations += 1
+        time.sleep((self.fixed_ms + self.per_item_ms * n) / 1000)
+        return [
+            f"SELECT {'valid' if self.rng.random() < self.valid_rate else 'invalid'}"
+            f" /* {self.rng.random()} */"
+            for _ in range(n)
+        ]
+
+
+def make_validate(validate_ms: float):
+    def validate(sql_query):
+        time.sleep(validate_ms / 1000)
+        if sql_query.startswith("SELECT valid"):
+            return True, ""
+        return False, "no such column: invalid"
+
+    return validate
+
+
+def serial(model, validate, attempts: int):
+    for _ in range(attempts):
+        [sql_query] = model.generate(1)
+        if validate(sql_query)[0]:
+            return True
+    return False
+
+
+def parallel(model, validate, attempts: int, n: int, executor):
+    for _ in range(attempts):
+        candidates = model.generate(n)
+        _, is_valid, _ = select_candidate(
+            candidates, "first_valid", executor, validate=validate
+        )
+        if is_valid:
+            return True
+    return False
+
+
+def run(name, answer, questions: int, model):
+    latencies = []
+    successes = 0
+    for _ in range(questions):
+        start = time.perf_counter()
+        successes += answer()
+        latencies.append(time.perf_counter() - start)
+    return {
+        "mode": name,
+        "success_rate": successes / questions,
+        "avg_generate_calls": model.generations / questions,
+        "p50_latency_ms": 1000 * percentile(latencies, 0.5),
+        "p95_latency_ms": 1000 * percentile(latencies, 0.95),
+        "max_latency_ms": 1000 * max(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--attempts", type=int, default=5)
+    parser.add_argument("--candidates", type=int, default=5)
+    parser.add_argument("--valid-rate", type=float, default=0.4)
+    parser.add_argument("--fixed-ms", type=float, default=40)
+    parser.add_argument("--per-item-ms", type=float, default=4)
+    parser.add_argument("--validate-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    validate = make_validate(args.validate_ms)
+
+    def stub():
+        return StubModel(args.fixed_ms, args.per_item_ms, args.valid_rate)
+
+    serial_model = stub()
+    results = [
+        run(
+            "serial",
+            lambda: serial(serial_model, validate, args.attempts),
+            args.questions,
+            serial_model,
+        )
+    ]
+
+    parallel_model = stub()
+    with ThreadPoolExecutor(max_workers=args.candidates) as executor:
+        results.append(
+            run(
+                f"candidates_{args.candidates}",
+                lambda: parallel(
+                    parallel_model, validate, args.attempts, args.candidates, executor
+                ),
+                args.questions,
+                parallel_model,
+            )
+        )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
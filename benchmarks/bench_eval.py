@@ -0,0 +1,284 @@
+"""
+Offline evaluation of the question -> SQL flows on the Northwind database.
+
+Each question of the gold set goes through the simple (generate, validate,
+retry) or the ReAct flow, and the generated query is scored by execution
+accuracy: it must return the same rows as the gold query (in the same order
+when the gold query has an ORDER BY).
+
+The bots run on any backend of src/backends.py, or on a stub that answers the
+gold query, deterministically corrupted on a fraction of the first attempts to
+exercise the retries (CPU only, no model download). Completions recorded with
+`--record` can be replayed exactly on any machine with the replay backend.
+
+    python -m benchmarks.bench_eval --flow simple --backend stub
+    python -m benchmarks.bench_eval --flow simple --backend transformers --fewshot 3
+    python -m benchmarks.bench_eval --flow react --backend transformers \\
+        --backend-option device=cpu --record replay.json
+    python -m benchmarks.bench_eval --flow react --backend replay \\
+        --backend-option path=replay.json --output results.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import time
+
+from src.actions import ActionStats
+from src.backends import BACKENDS, Backend, RecordingBackend, create_backend
+from src.batching import percentile
+from src.fewshot import ExampleStore
+from src.flows import react_events, simple_events
+from src.tracing import tracer
+from src.utils import execute_sql, scan_db_schema
+
+GOLD_PATH = os.path.join(os.path.dirname(__file__), "gold_northwind.json")
+DIALECT = "sqlite3"
+
+
+def load_gold(path: str = GOLD_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+class StubBackend(Backend):
+    """
+    Plays a model that knows the gold answers. With probability `error_rate`
+    the first attempt at a question references a misspelled table, so that
+    the retry path and its prompts are exercised too.
+    """
+
+    def __init__(self, gold, error_rate: float = 0.3, seed: int = 0):
+        self.gold = gold
+        self.error_rate = error_rate
+        self.seed = seed
+
+    def _item(self, prompt):
+        # Few-shot examples precede the question
+        prompt = prompt[max(prompt.rfind("**User Question:**"), 0) :]
+        matches = [item for item in self.gold if item["question"] in prompt]
+        if not matches:
+            raise KeyError("The stub backend only answers questions of the gold set")
+        return max(matches, key=lambda item: len(item["question"]))
+
+    def _answer(self, item, first_attempt: bool):
+        rng = random.Random(f"{self.seed}:{item['question']}")
+        if first_attempt and rng.random() < self.error_rate:
+            return re.sub(
+                r'(?i)\bFROM\s+"?(\w+)"?', r"FROM \1_table", item["sql"], count=1
+            )
+        return item["sql"]
+
+    def stream(self, prompt, max_tokens=1024, temperature=0.0, json_schema=None):
+        if json_schema is None:
+            first_attempt = "**Returned Error:**" not in prompt
+            sql_query = self._answer(self._item(prompt), first_attempt)
+            yield f"```sql\n{sql_query}\n```"
+        else:
+            yield json.dumps({"Decision": self._decide(prompt)})
+
+    def _decide(self, prompt):
+        # Only look at the transcript, after the system prompt
+        transcript = prompt[prompt.rfind("<s>user") :]
+        item = self._item(transcript)
+        observations = re.findall(r"Observation:\s*\n\s*(.*)", transcript)
+        if observations and not observations[-1].startswith("Validity: False"):
+            sql_query = re.findall(r"Action Input:\s*\n\s*(.*)", transcript)[-1]
+            return {
+                "Final_Thought": "The preview matches the question.",
+                "Final_Answer": sql_query,
+            }
+        return {
+            "Scratchpad": "",
+            "Thought": "Let me look at the results of this query.",
+            "Action": "preview",
+            "Action_Input": self._answer(item, not observations),
+        }
+
+
+def run_simple(question, bot, db_schema, attempts, examples=()):
+    from src.simple import get_base_prompt
+
+    base_prompt = get_base_prompt(DIALECT, db_schema, question, list(examples))
+    return _outcome(simple_events(base_prompt, bot.think, attempts))
+
+
+def run_react(question, bot, action_stats):
+    return _outcome(react_events(question, bot, action_stats.run))
+
+
+def _outcome(events):
+    """(sql_query or None, attempts) once the flow is over."""
+    for event, data in events:
+        if event in ("done", "failed"):
+            return (data["sql_query"] if event == "done" else None), data["attempts"]
+    raise RuntimeError("The flow ended without an outcome")
+
+
+def trace_costs(trace):
+    """
+    Tokens and database time of one question, as accounted by the bot and
+    the database layer in the spans of its trace: prefilled tokens are those
+    actually computed, prompt cache hits are counted as reused.
+    """
+    costs = {"prefill_tokens": 0, "reused_tokens": 0, "decode_tokens": 0}
+    db_time = 0.0
+    for name, _, duration, attrs in trace.spans:
+        if name == "prefill":
+            costs["prefill_tokens"] += attrs.get("tokens", 0)
+            costs["reused_tokens"] += attrs.get("reused_tokens", 0)
+        elif name == "decode":
+            costs["decode_tokens"] += attrs.get("tokens", 0)
+        elif name == "guided_generation":
+            for key in costs:
+                costs[key] += attrs.get(key, 0)
+        elif name in ("validate_sql", "execute_sql"):
+            db_time += duration
+    costs["db_time_ms"] = 1000 * db_time
+    return costs
+
+
+def same_result(sql_query, gold_sql) -> bool:
+    """Execution accuracy: both queries return the same rows."""
+    try:
+        rows, _ = execute_sql(sql_query)
+    except sqlite3.Error:
+        return False
+    gold_rows, _ = execute_sql(gold_sql)
+    if re.search(r"(?i)\border\s+by\b", gold_sql):
+        return rows == gold_rows
+    return sorted(map(repr, rows)) == sorted(map(repr, gold_rows))
+
+
+def make_bot(flow: str, backend: Backend, db_schema: str, attempts: int):
+    if flow == "simple":
+        from src.simple import SimpleChatBot
+
+        return SimpleChatBot(
+            DIALECT, db_schema, attempts, logging.getLogger(__name__), backend=backend
+        )
+    from src.react import ReactChatBot
+
+    return ReactChatBot(DIALECT, db_schema, attempts, backend=backend)
+
+
+def fewshot_examples(item, store: ExampleStore, k: int):
+    """Closest examples of the gold set, leaving the question itself out."""
+    examples = store.search(item["question"], k + 1)
+    return [example for example in examples if example.question != item["question"]][:k]
+
+
+def evaluate(gold, flow: str, backend: Backend, attempts: int, fewshot: int = 0):
+    """With `fewshot`, the simple flow gets that many examples from the gold set."""
+    db_schema = scan_db_schema()
+    bot = make_bot(flow, backend, db_schema, attempts)
+    store = ExampleStore(db_schema)
+    for item in gold:
+        store.put(item["question"], item["sql"])
+    action_stats = ActionStats()
+    results = []
+    for item in gold:
+        start = time.perf_counter()
+        with tracer.trace("question", flow=flow, benchmark=True) as trace:
+            if flow == "simple":
+                examples = fewshot_examples(item, store, fewshot) if fewshot else []
+                sql_query, used_attempts = run_simple(
+                    item["question"], bot, db_schema, attempts, examples
+                )
+            else:
+                sql_query, used_attempts = run_react(
+                    item["question"], bot, action_stats
+                )
+        latency = time.perf_counter() - start
+        results.append(
+            {
+                "question": item["question"],
+                "sql_query": sql_query,
+                "correct": sql_query is not None
+                and same_result(sql_query, item["sql"]),
+                "latency_ms": 1000 * latency,
+                "attempts": used_attempts,
+                **trace_costs(trace),
+            }
+        )
+    return results
+
+
+def summarize(results):
+    n = len(results)
+    latencies = [result["latency_ms"] for result in results]
+
+    def avg(key):
+        return sum(result[key] for result in results) / n
+
+    return {
+        "questions": n,
+        "execution_accuracy": sum(result["correct"] for result in results) / n,
+        "p50_latency_ms": percentile(latencies, 0.5),
+        "p95_latency_ms": percentile(latencies, 0.95),
+        "avg_attempts": avg("attempts"),
+        "avg_prefill_tokens": avg("prefill_tokens"),
+        "avg_reused_tokens": avg("reused_tokens"),
+        "avg_decode_tokens": avg("decode_tokens"),
+        "avg_db_time_ms": avg("db_time_ms"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--flow", choices=("simple", "react"), default="simple")
+    parser.add_argument("--backend", choices=("stub",) + BACKENDS, default="stub")
+    parser.add_argument(
+        "--backend-option",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="Passed to the backend, e.g. device=cpu or model_path=model.gguf",
+    )
+    parser.add_argument("--gold", default=GOLD_PATH)
+    parser.add_argument("--attempts", type=int, default=5)
+    parser.add_argument(
+        "--fewshot",
+        type=int,
+        default=0,
+        help="Few-shot examples from the rest of the gold set (simple flow)",
+    )
+    parser.add_argument("--error-rate", type=float, default=0.3)
+    parser.add_argument("--record", help="Record the completions to this file")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    gold = load_gold(args.gold)
+    if args.backend == "stub":
+        backend = StubBackend(gold, args.error_rate)
+        if args.record:
+            backend = RecordingBackend(backend, args.record)
+    else:
+        options = dict(option.split("=", 1) for option in args.backend_option)
+        backend = create_backend(args.backend, args.record, **options)
+
+    results = evaluate(gold, args.flow, backend, args.attempts, args.fewshot)
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "flow": args.flow,
+        "backend": args.backend,
+        "fewshot": args.fewshot,
+        "gold": os.path.basename(args.gold),
+        **summarize(results),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Prompt size with and without schema linking on a synthetic many-table database.
+
+Every table is named after an entity (`customer_orders`, `warehouse_shipments`,
+...) and most reference another one, so questions about one or two entities
+should only need a handful of the tables.
+
+    python -m benchmarks.bench_schema_linking --tables 200 --budget 1024
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from src.schema import introspect, render_schema
+from src.schema_linking import SchemaLinker, approx_token_count
+
+DOMAINS = [
+    "customer", "supplier", "warehouse", "employee", "invoice", "product",
+    "shipment", "payment", "contract", "region", "campaign", "ticket",
+    "vehicle", "account", "branch", "device", "course", "patient",
+    "station", "project",
+]  # fmt: skip
+ENTITIES = [
+    "orders", "events", "notes", "ratings", "addresses", "audits", "budgets",
+    "claims", "credits", "discounts", "grades", "incidents", "licenses",
+]  # fmt: skip
+ATTRIBUTES = [
+    "name", "status", "created_at", "updated_at", "amount", "quantity",
+    "description", "priority", "score", "currency", "country", "city",
+]  # fmt: skip
+
+
+def build_database(path: str, n_tables: int, seed: int = 0):
+    rng = random.Random(seed)
+    names = [f"{domain}_{entity}" for entity in ENTITIES for domain in DOMAINS]
+    names = names[:n_tables]
+
+    conn = sqlite3.connect(path)
+    for idx, name in enumerate(names):
+        columns = ["id INTEGER PRIMARY KEY"]
+        columns += [f"{attr} TEXT" for attr in rng.sample(ATTRIBUTES, 5)]
+        if idx > 0:
+            ref = names[rng.randrange(idx)]
+            columns.append(f"{ref}_id INTEGER REFERENCES {ref}(id)")
+        conn.execute(f"CREATE TABLE {name} ({', '.join(columns)})")
+    conn.commit()
+    return conn, names
+
+
+def make_questions(names, n_questions: int, seed: int = 0):
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(n_questions):
+        first, second = rng.sample(names, 2)
+        attr = rng.choice(ATTRIBUTES)
+        text = (
+            f"What is the {attr.replace('_', ' ')} of the "
+            f"{first.replace('_', ' ')} linked to the {second.replace('_', ' ')}?"
+        )
+        questions.append((text, {first, second}))
+    return questions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tables", type=int, default=200)
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--budget", type=int, default=1024)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        conn, names = build_database(os.path.join(tmp_dir, "bench.db"), args.tables)
+        schema = introspect(conn)
+        conn.close()
+
+    linker = SchemaLinker(schema, max_tokens=args.budget)
+    full_tokens = approx_token_count(render_schema(schema))
+
+    linked_tokens = []
+    recall = []
+    start = time.perf_counter()
+    for question, gold in make_questions(names, args.questions):
+        linked = linker.link(question)
+        linked_tokens.append(approx_token_count(render_schema(linked)))
+        kept = {table.name for table in linked.tables}
+        recall.append(len(gold & kept) / len(gold))
+    elapsed = time.perf_counter() - start
+
+    avg_linked = sum(linked_tokens) / len(linked_tokens)
+    print(
+        json.dumps(
+            {
+                "tables": len(schema.tables),
+                "budget_tokens": args.budget,
+                "full_schema_tokens": full_tokens,
+                "avg_linked_tokens": avg_linked,
+                "max_linked_tokens": max(linked_tokens),
+                "token_reduction": 1 - avg_linked / full_tokens,
+                "table_recall": sum(recall) / len(recall),
+                "avg_link_ms": 1000 * elapsed / args.questions,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,11 @@
-import logging
 import json
+import logging
 
-from src.react import ReactChatBot, generate_user_prompt, extend_user_prompt
+from src.react import ReactChatBot, extend_user_prompt, generate_user_prompt
 from src.utils import (
+    execute_sql,
     scan_db_schema,
     validate_sql,
-    execute_sql,
 )
 
 logging.basicConfig(
@@ -27,13 +27,15 @@ question = "Get the total number of orders placed in 1997."
 user_prompt = generate_user_prompt(question)
 
 previous_actions = []
+episode = bot.new_episode()
 for attempt in range(bot.attempts):
     logger.debug(f"""User prompt:
 ---
 {user_prompt}
 ---
 """)
-    result = bot(user_prompt)
+    result = bot(user_prompt, episode)
+    logger.info(f"\x1b[35m Tokens: {episode.steps[-1]} \x1b[0m")
     json_result = json.loads(result)
     decision = json_result["Decision"]
     if "Final_Answer" not in list(decision.keys()):
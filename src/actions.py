@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import defaultdict
+
+from src.batching import percentile
+from src.governor import QueryBudgetExceeded, describe_cost
+from src.tracing import tracer
+from src.utils import preview_sql, validate_sql
+
+# Rows sampled by the preview action, and how many of them are shown
+PREVIEW_SAMPLE_ROWS = 50
+PREVIEW_SHOWN_ROWS = 3
+PREVIEW_MAX_VALUE_CHARS = 40
+
+# Latencies kept per action for the percentiles
+LATENCY_WINDOW = 1000
+
+
+def verify(sql_query: str) -> str:
+    """Validity of the query and, once it runs, what running it costs."""
+    is_valid, error = validate_sql(sql_query)
+    if not is_valid:
+        return f"Validity: {is_valid}, Error: {error}"
+    try:
+        _, _, cost = preview_sql(sql_query)
+    except QueryBudgetExceeded as e:
+        return f"Validity: False, Error: {e}"
+    return f"Validity: {is_valid}, Cost: {describe_cost(cost)}"
+
+
+def preview(sql_query: str) -> str:
+    """Run the query on a sample of its rows and summarize them."""
+    is_valid, error = validate_sql(sql_query)
+    if not is_valid:
+        return f"Validity: {is_valid}, Error: {error}"
+    try:
+        rows, columns, cost = preview_sql(sql_query, PREVIEW_SAMPLE_ROWS)
+    except QueryBudgetExceeded as e:
+        return f"Validity: False, Error: {e}"
+    return summarize_rows(rows, columns, cost)
+
+
+def _short(value) -> str:
+    text = str(value)
+    if len(text) > PREVIEW_MAX_VALUE_CHARS:
+        text = text[: PREVIEW_MAX_VALUE_CHARS - 3] + "..."
+    return text
+
+
+def summarize_rows(rows, columns, cost) -> str:
+    """
+    Compact view of a result for the agent: row count, distinct values per
+    column (over the sampled rows) and the first rows.
+    """
+    count = f"at least {len(rows)}" if cost.get("limited") else str(len(rows))
+    lines = [
+        f"Rows: {count}, Cost: {cost['elapsed_ms']:.1f} ms, ~{cost['vm_steps']} VM steps"
+    ]
+    if columns:
+        lines.append(
+            "Columns: "
+            + ", ".join(
+                f"{column} ({len({repr(row[idx]) for row in rows})} distinct)"
+                for idx, column in enumerate(columns)
+            )
+        )
+    if rows:
+        lines.append("First rows:")
+        lines.extend(
+            " | ".join(_short(value) for value in row)
+            for row in rows[:PREVIEW_SHOWN_ROWS]
+        )
+    return "\n".join(lines)
+
+
+ACTIONS = {
+    "verify": verify,
+    "preview": preview,
+}
+
+
+class ActionStats:
+    """Latency of each agent action, and actions taken per question."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._latencies = defaultdict(list)
+        self._calls = defaultdict(int)
+        self._questions = 0
+        self._steps = 0
+
+    def run(self, action: str, action_input: str):
+        """Run the action and record how long it took, returns (observation, ms)."""
+        start = time.perf_counter()
+        observation = ACTIONS[action](action_input)
+        elapsed = time.perf_counter() - start
+        tracer.record("action", elapsed, start, action=action)
+        elapsed_ms = 1000 * elapsed
+        with self._lock:
+            self._calls[action] += 1
+            latencies = self._latencies[action]
+            latencies.append(elapsed_ms)
+            del latencies[: -self.window]
+        return observation, elapsed_ms
+
+    def record_question(self, steps: int):
+        with self._lock:
+            self._questions += 1
+            self._steps += steps
+
+    def stats(self):
+        with self._lock:
+            return {
+                "questions": self._questions,
+                "avg_steps_per_question": self._steps / self._questions
+                if self._questions
+                else 0.0,
+                "actions": {
+                    action: {
+                        "calls": self._calls[action],
+                        "p50_ms": percentile(latencies, 0.5),
+                        "p95_ms": percentile(latencies, 0.95),
+                        "max_ms": max(latencies),
+                    }
+                    for action, latencies in self._latencies.items()
+                },
+            }
@@ -0,0 +1,136 @@
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import PlainTextResponse
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted; served as a 429."""
+
+
+async def overloaded(request, error):
+    """Starlette exception handler of Overloaded."""
+    return PlainTextResponse(
+        "Too many questions in flight, retry later", 429, {"Retry-After": "1"}
+    )
+
+
+class AdmissionControl:
+    """
+    Bound the number of questions being worked on and waiting for a slot.
+
+    Up to `max_in_flight` requests run concurrently; up to `max_queue_depth`
+    more wait for a slot, and anything beyond that is rejected immediately
+    with `Overloaded` instead of piling up behind a slow model.
+    """
+
+    def __init__(self, max_in_flight: int = 8, max_queue_depth: int = 32):
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self._semaphore = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._rejected = 0
+
+    async def acquire(self):
+        if self._semaphore is None:
+            # Created lazily so it binds to the server's event loop
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        with self._lock:
+            if self._in_flight + self._waiting >= (
+                self.max_in_flight + self.max_queue_depth
+            ):
+                self._rejected += 1
+                raise Overloaded()
+            self._waiting += 1
+
+        try:
+            await self._semaphore.acquire()
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        with self._lock:
+            self._in_flight += 1
+            self._admitted += 1
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def hold(self, response):
+        """
+        `response` holding a slot until it is sent, e.g. a stream of events.
+        The slot is taken now, so that Overloaded can still be answered with
+        a 429 rather than end the stream.
+        """
+        await self.acquire()
+
+        async def send_response(scope, receive, send):
+            try:
+                await response(scope, receive, send)
+            finally:
+                self.release()
+
+        return send_response
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_in_flight": self.max_in_flight,
+                "max_queue_depth": self.max_queue_depth,
+                "in_flight": self._in_flight,
+                "waiting": self._waiting,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+            }
+
+
+class BodySizeLimit:
+    """
+    ASGI middleware answering 413 to requests with a body larger than
+    `max_bytes`: right away when their Content-Length says so, else once the
+    body read so far is too large.
+    """
+
+    def __init__(self, app, max_bytes: int = 64 * 1024):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length", "")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = PlainTextResponse("Request body too large", 413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(413, "Request body too large")
+            return message
+
+        await self.app(scope, receive_limited, send)
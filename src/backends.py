@@ -0,0 +1,275 @@
+import abc
+import hashlib
+import json
+import os
+import re
+import threading
+from collections.abc import Iterator
+
+import torch
+from outlines.integrations.utils import convert_json_schema_to_str
+from transformers import (
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+)
+
+from src.guide_cache import GUIDE_CACHE_DIR, load_regex_guide
+from src.schema_linking import approx_token_count
+
+MODEL_NAME = "mistralai/Mistral-7B-Instruct-v0.3"
+BACKENDS = ("transformers", "llama_cpp", "replay")
+
+
+class Backend(abc.ABC):
+    """
+    Text completion engine behind the chat bots.
+
+    `stream` yields the completion of `prompt` piece by piece; closing the
+    generator early stops the generation. With `json_schema` the completion
+    is constrained to JSON documents valid against it.
+    """
+
+    @abc.abstractmethod
+    def stream(
+        self,
+        prompt: str,
+        max_tokens: int = 1024,
+        temperature: float = 0.0,
+        json_schema: dict | None = None,
+    ) -> Iterator[str]: ...
+
+    def complete(self, prompt: str, **kwargs) -> str:
+        return "".join(self.stream(prompt, **kwargs))
+
+    def count_tokens(self, text: str) -> int:
+        return approx_token_count(text)
+
+
+class _Cancelled(StoppingCriteria):
+    def __init__(self, event: threading.Event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self.event.is_set()
+
+
+class TransformersBackend(Backend):
+    """
+    Hugging Face model in bfloat16 spread over the GPUs, or in float32 on CPU
+    when there is no GPU.
+
+    The chat bots drive `model` and `tokenizer` directly to get the prompt
+    caches, batching and guided decoding; `stream` is the plain path, used
+    when the backend is wrapped, e.g. to record it.
+    """
+
+    def __init__(
+        self,
+        model_name: str = MODEL_NAME,
+        device: str = "auto",
+        model=None,
+        tokenizer=None,
+    ):
+        if device == "auto":
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = device
+
+        if tokenizer is None:
+            tokenizer = AutoTokenizer.from_pretrained(model_name, padding_side="left")
+        if tokenizer.pad_token is None:
+            # Mistral ships without a padding token, needed to batch
+            tokenizer.pad_token = tokenizer.eos_token
+        self.tokenizer = tokenizer
+
+        if model is None:
+            if device == "cuda":
+                model = AutoModelForCausalLM.from_pretrained(
+                    model_name, device_map="auto", torch_dtype=torch.bfloat16
+                )
+            else:
+                # Weights are read straight from the mmap'd safetensors files
+                model = AutoModelForCausalLM.from_pretrained(
+                    model_name, torch_dtype=torch.float32, low_cpu_mem_usage=True
+                ).to(device)
+        self.model = model
+        self._json_generators = {}
+        self._lock = threading.Lock()
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer(text)["input_ids"])
+
+    def stream(self, prompt, max_tokens=1024, temperature=0.0, json_schema=None):
+        if json_schema is not None:
+            generator = self._json_generator(json_schema)
+            yield from generator.stream(prompt, max_tokens=max_tokens)
+            return
+
+        model_inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+        streamer = TextIteratorStreamer(
+            self.tokenizer, skip_prompt=True, skip_special_tokens=True
+        )
+        cancelled = threading.Event()
+        sampling = (
+            {"do_sample": True, "temperature": temperature} if temperature else {}
+        )
+
+        def generate():
+            with torch.inference_mode():
+                self.model.generate(
+                    **model_inputs,
+                    max_new_tokens=max_tokens,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    stopping_criteria=StoppingCriteriaList([_Cancelled(cancelled)]),
+                    streamer=streamer,
+                    **sampling,
+                )
+
+        thread = threading.Thread(target=generate, daemon=True)
+        thread.start()
+        try:
+            yield from streamer
+        finally:
+            cancelled.set()
+            thread.join()
+
+    def _json_generator(self, json_schema):
+        from outlines import samplers
+        from outlines.fsm.json_schema import build_regex_from_schema
+        from outlines.generate.api import SequenceGenerator
+        from outlines.models.transformers import Transformers
+
+        # Not sorted: the properties are generated in the order of the schema
+        key = convert_json_schema_to_str(json_schema)
+        with self._lock:
+            if key not in self._json_generators:
+                model = Transformers(self.model, self.tokenizer)
+                guide = load_regex_guide(
+                    build_regex_from_schema(key), model.tokenizer, GUIDE_CACHE_DIR
+                )
+                self._json_generators[key] = SequenceGenerator(
+                    guide, model, samplers.greedy(), model.device
+                )
+            return self._json_generators[key]
+
+
+class LlamaCppBackend(Backend):
+    """
+    Quantized GGUF model on CPU through llama-cpp-python (optional dependency:
+    `pip install llama-cpp-python`). llama.cpp reuses the KV cache of the
+    common prefix of consecutive prompts by itself.
+    """
+
+    def __init__(self, model_path: str, n_ctx: int = 8192, n_threads=None):
+        try:
+            from llama_cpp import Llama
+        except ImportError as e:
+            raise ImportError(
+                "The llama_cpp backend needs llama-cpp-python: "
+                "pip install llama-cpp-python"
+            ) from e
+        self.llm = Llama(
+            model_path=model_path, n_ctx=n_ctx, n_threads=n_threads, verbose=False
+        )
+        self._lock = threading.Lock()
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.llm.tokenize(text.encode("utf-8")))
+
+    def stream(self, prompt, max_tokens=1024, temperature=0.0, json_schema=None):
+        from llama_cpp import LlamaGrammar
+
+        grammar = None
+        if json_schema is not None:
+            grammar = LlamaGrammar.from_json_schema(json.dumps(json_schema))
+        # A Llama instance holds one context: one generation at a time
+        with self._lock:
+            chunks = self.llm.create_completion(
+                prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                grammar=grammar,
+                stream=True,
+            )
+            try:
+                for chunk in chunks:
+                    yield chunk["choices"][0]["text"]
+            finally:
+                chunks.close()
+
+
+def prompt_key(prompt: str, json_schema=None) -> str:
+    # Agent observations report timings, which differ from one run to the next
+    prompt = re.sub(r"\d+(?:\.\d+)? ms\b", "_ ms", prompt)
+    if json_schema is not None:
+        # Not sorted either: the order of the properties is part of the completion
+        prompt += "\n" + convert_json_schema_to_str(json_schema)
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class RecordingBackend(Backend):
+    """Passes through to `backend` and saves every completion to `path`."""
+
+    def __init__(self, backend: Backend, path: str):
+        self.backend = backend
+        self.path = path
+        self._lock = threading.Lock()
+        self.records = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.records = json.load(f)
+
+    def count_tokens(self, text: str) -> int:
+        return self.backend.count_tokens(text)
+
+    def stream(self, prompt, max_tokens=1024, temperature=0.0, json_schema=None):
+        completion = ""
+        try:
+            for piece in self.backend.stream(
+                prompt, max_tokens, temperature, json_schema
+            ):
+                completion += piece
+                yield piece
+        finally:
+            # Also when the caller stops early: replays stop at the same point
+            with self._lock:
+                self.records[prompt_key(prompt, json_schema)] = completion
+                with open(self.path, "w") as f:
+                    json.dump(self.records, f)
+
+
+class ReplayBackend(Backend):
+    """Completions recorded by a RecordingBackend, so no model is needed."""
+
+    def __init__(self, path: str):
+        with open(path) as f:
+            self.records = json.load(f)
+
+    def stream(self, prompt, max_tokens=1024, temperature=0.0, json_schema=None):
+        try:
+            yield self.records[prompt_key(prompt, json_schema)]
+        except KeyError:
+            raise KeyError(
+                "Prompt not recorded: the prompts changed since the recording"
+            ) from None
+
+
+def create_backend(name: str = "transformers", record_path=None, **options) -> Backend:
+    """
+    Backend from the apps' configuration: `options` are passed to its
+    constructor, e.g. {"device": "cpu"} or {"model_path": "model.Q4_K_M.gguf"},
+    and with `record_path` every completion is also saved there for replay.
+    """
+    if name == "transformers":
+        backend = TransformersBackend(**options)
+    elif name == "llama_cpp":
+        backend = LlamaCppBackend(**options)
+    elif name == "replay":
+        backend = ReplayBackend(**options)
+    else:
+        raise ValueError(f"Unknown backend {name!r}, use one of {BACKENDS}")
+    if record_path is not None:
+        backend = RecordingBackend(backend, record_path)
+    return backend
@@ -0,0 +1,155 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future
+
+
+def percentile(values, q: float):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, round(q * (len(values) - 1)))
+    return values[idx]
+
+
+class BatchScheduler:
+    """
+    Dynamic batching in front of a single model.
+
+    Prompts submitted from concurrent requests are queued; a worker thread
+    takes the first pending prompt, waits at most `max_wait_ms` for more to
+    arrive (up to `max_batch_size`), runs them through `generate_batch` in one
+    call and routes each completion back to its caller's future.
+    """
+
+    def __init__(
+        self,
+        generate_batch: Callable[[list[str]], list[str]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        latency_window: int = 1024,
+    ):
+        self.generate_batch = generate_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._started_at = time.perf_counter()
+        self._requests = 0
+        self._batches = 0
+        self._failed_batches = 0
+        self._generate_time = 0.0
+        self._latencies = deque(maxlen=latency_window)
+        self._queue_waits = deque(maxlen=latency_window)
+
+        self._thread = None
+        self._pid = None
+        self._start_worker()
+
+    def _start_worker(self):
+        """
+        (Re)start the worker thread. Threads do not survive a fork: a process
+        forked from the one that created the scheduler (e.g. a `gunicorn
+        --preload` worker) starts its own on first submit.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def __call__(self, prompt: str):
+        return self.submit(prompt).result()
+
+    def submit(self, prompt: str) -> Future:
+        if self._pid != os.getpid():
+            self._start_worker()
+        future = Future()
+        self._queue.put((prompt, future, time.perf_counter()))
+        return future
+
+    def _collect_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+
+        batch = [item]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = (
+                    self._queue.get(timeout=remaining)
+                    if remaining > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+            if item is None:
+                # Serve what we already have, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+
+            prompts = [prompt for prompt, _, _ in batch]
+            start = time.perf_counter()
+            try:
+                completions = self.generate_batch(prompts)
+            except Exception as e:  # noqa: BLE001 - raised to every caller
+                with self._lock:
+                    self._failed_batches += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            end = time.perf_counter()
+
+            with self._lock:
+                self._batches += 1
+                self._requests += len(batch)
+                self._generate_time += end - start
+                for _, _, submitted_at in batch:
+                    self._queue_waits.append(start - submitted_at)
+                    self._latencies.append(end - submitted_at)
+
+            for (_, future, _), completion in zip(batch, completions):
+                future.set_result(completion)
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.perf_counter() - self._started_at
+            latencies = list(self._latencies)
+            queue_waits = list(self._queue_waits)
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "pending": self._queue.qsize(),
+                "requests": self._requests,
+                "batches": self._batches,
+                "failed_batches": self._failed_batches,
+                "avg_batch_size": self._requests / self._batches
+                if self._batches
+                else 0.0,
+                "throughput_rps": self._requests / elapsed if elapsed else 0.0,
+                "avg_generate_ms": 1000 * self._generate_time / self._batches
+                if self._batches
+                else 0.0,
+                "p50_latency_ms": 1000 * percentile(latencies, 0.5),
+                "p95_latency_ms": 1000 * percentile(latencies, 0.95),
+                "p50_queue_wait_ms": 1000 * percentile(queue_waits, 0.5),
+            }
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+
+_DIGEST = re.compile(r"[0-9a-f]{32}")
+
+
+class BlobStore:
+    """
+    Binary column values on disk, keyed by content digest, so that every
+    worker process of the app serves the blobs any of them read.
+
+    Result rows carry a short `/blob/<digest>` URL instead of an inline data
+    URI; the app serves the bytes from here with an ETag equal to the digest,
+    so browsers fetch each image once and revalidate with a 304.
+
+    Each blob is one file, `<path>/<digest[:2]>/<digest>`: its mime type on the
+    first line, then the data. Reads refresh the modification time, and once
+    the files weigh more than `max_bytes` the least recently used ones are
+    deleted, by whichever process wrote last.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        # Bytes written between two sweeps of the directory
+        self.sweep_bytes = max(max_bytes // 16, 1)
+
+        self._lock = threading.Lock()
+        self._written = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+    def _file(self, key: str) -> str | None:
+        # Keys come from URLs: only digests name a file
+        if not _DIGEST.fullmatch(key):
+            return None
+        return os.path.join(self.path, key[:2], key)
+
+    def put(self, data: bytes, mime_type: str) -> str:
+        key = self.digest(data)
+        path = self._file(key)
+        if os.path.exists(path):
+            _touch(path)
+            return key
+        if len(data) > self.max_bytes:
+            # Too large to cache: the reference will 404, like an eviction
+            return key
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(mime_type.encode("utf-8") + b"\n")
+                f.write(data)
+            # Atomic: other processes never read a partial blob
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        _touch(path)
+
+        with self._lock:
+            self._written += len(data)
+            sweep = self._written >= self.sweep_bytes
+            if sweep:
+                self._written = 0
+        if sweep:
+            self._sweep()
+        return key
+
+    def __contains__(self, key: str) -> bool:
+        path = self._file(key)
+        return path is not None and os.path.exists(path)
+
+    def get(self, key: str):
+        path = self._file(key)
+        try:
+            if path is None:
+                raise FileNotFoundError(key)
+            with open(path, "rb") as f:
+                mime_type = f.readline()[:-1].decode("utf-8")
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._misses += 1
+            return None
+        _touch(path)
+        with self._lock:
+            self._hits += 1
+        return data, mime_type
+
+    def _files(self):
+        """(mtime, size, path) of every blob file."""
+        files = []
+        for directory, _, names in os.walk(self.path):
+            for name in names:
+                if not _DIGEST.fullmatch(name):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime_ns, stat.st_size, path))
+        return files
+
+    def _sweep(self):
+        files = sorted(self._files())
+        size = sum(file_size for _, file_size, _ in files)
+        evicted = 0
+        for _, file_size, path in files:
+            if size <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                evicted += 1
+            except FileNotFoundError:
+                # Swept by another process
+                pass
+            size -= file_size
+        with self._lock:
+            self._evictions += evicted
+
+    def stats(self):
+        files = self._files()
+        with self._lock:
+            return {
+                "path": self.path,
+                "entries": len(files),
+                "bytes": sum(file_size for _, file_size, _ in files),
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+
+def _touch(path):
+    # Explicit nanoseconds: file system timestamps can be a few ms coarse
+    now = time.time_ns()
+    try:
+        os.utime(path, ns=(now, now))
+    except FileNotFoundError:
+        pass
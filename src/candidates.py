@@ -0,0 +1,98 @@
+import hashlib
+import sqlite3
+from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+from src.utils import execute_sql, validate_sql
+
+RANKING_POLICIES = ("first_valid", "consistency")
+
+# Rows compared per candidate by the consistency ranking
+CONSISTENCY_ROWS = 200
+
+
+def result_fingerprint(sql_query: str) -> str:
+    """Hash of the first rows returned by the query, ignoring their order."""
+    rows, _ = execute_sql(sql_query, limit=CONSISTENCY_ROWS)
+    digest = hashlib.sha256()
+    for row in sorted(repr(row) for row in rows):
+        digest.update(row.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def select_candidate(
+    candidates: list[str],
+    policy: str = "first_valid",
+    executor: ThreadPoolExecutor | None = None,
+    validate: Callable = validate_sql,
+    fingerprint: Callable = result_fingerprint,
+):
+    """
+    Validate sampled candidates concurrently and pick one.
+
+    "first_valid" returns the first valid candidate in sampling order.
+    "consistency" runs the valid candidates and returns one whose result is
+    shared by the most samples (self-consistency), duplicates counting as
+    votes.
+
+    Returns (sql_query, is_valid, errors) where `errors` lists the distinct
+    invalid candidates with their message, ready for the retry prompt.
+    """
+    if policy not in RANKING_POLICIES:
+        raise ValueError(f"Unknown ranking policy {policy!r}, use {RANKING_POLICIES}")
+
+    votes = Counter(candidates)
+    unique = list(votes)
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=len(unique))
+    try:
+        checks = list(_map(executor, validate, unique))
+        valid = [sql for sql, (is_valid, _) in zip(unique, checks) if is_valid]
+        errors = [
+            {"sql_query": sql, "message": message}
+            for sql, (is_valid, message) in zip(unique, checks)
+            if not is_valid
+        ]
+
+        if not valid:
+            return unique[0], False, errors
+        if policy == "first_valid" or len(valid) == 1:
+            return valid[0], True, errors
+
+        fingerprints = list(_map(executor, _safe(fingerprint), valid))
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    scores = Counter()
+    for sql, result in zip(valid, fingerprints):
+        if result is not None:
+            scores[result] += votes[sql]
+    if not scores:
+        return valid[0], True, errors
+    best = max(scores.values())
+    for sql, result in zip(valid, fingerprints):
+        if result is not None and scores[result] == best:
+            return sql, True, errors
+
+
+def _map(executor, fn, items):
+    # Each call in a copy of the caller's context: the request's database
+    # and trace follow it to the worker thread
+    contexts = [copy_context() for _ in items]
+    return executor.map(lambda context, item: context.run(fn, item), contexts, items)
+
+
+def _safe(fingerprint):
+    def run(sql_query):
+        try:
+            return fingerprint(sql_query)
+        except sqlite3.Error:
+            # Valid plan but failing at run time: cannot vote
+            return None
+
+    return run
@@ -0,0 +1,250 @@
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+
+from src.pool import DEFAULT_PRAGMAS, ConnectionPool
+from src.result_cache import DataVersion, ResultCache
+from src.schema import Schema, SchemaCache
+from src.sql_check import SqlChecker
+
+
+class UnknownDatabaseError(Exception):
+    pass
+
+
+class Database:
+    """
+    One SQLite file served by the app and what is derived from it: the
+    read-only connection pool, the schema model, its SqlChecker and the
+    result cache, each built on first use.
+
+    `state` keeps objects of the app tied to the database, e.g. its question
+    cache, so that they are built once and closed with it.
+
+    `memory_budget` bytes bound its caches: half for the result cache, a
+    quarter for the page caches of the pooled connections (`cache_size`,
+    split between them) and a quarter for memory-mapped I/O (`mmap_size`,
+    counted once: the connections map the same pages of the file).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        db_path: str,
+        pool_size: int = 8,
+        schema_cache_dir: str | None = None,
+        memory_budget: int = 64 * 1024 * 1024,
+    ):
+        self.name = name
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self._set_budget(memory_budget)
+
+        self._schema_cache = SchemaCache(db_path, schema_cache_dir)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._sql_checker = None
+        self._result_cache = None
+        self._states = {}
+        self._state_lock = threading.Lock()
+
+    @property
+    def pool(self) -> ConnectionPool:
+        """Created on first use, and again in a process forked from its creator."""
+        with self._lock:
+            if self._pool is None or self._pool.pid != os.getpid():
+                self._pool = ConnectionPool(
+                    self.db_path,
+                    size=self.pool_size,
+                    pragmas=dict(DEFAULT_PRAGMAS, **self.pool_pragmas()),
+                )
+            return self._pool
+
+    @property
+    def result_cache(self) -> ResultCache:
+        with self._lock:
+            if self._result_cache is None:
+                self._result_cache = ResultCache(
+                    DataVersion(self.db_path), self.result_cache_bytes
+                )
+            return self._result_cache
+
+    def schema_version(self) -> int:
+        """Cheap change detector: SQLite bumps it on every schema modification."""
+        with self.pool.connection() as conn:
+            return conn.execute("PRAGMA schema_version;").fetchone()[0]
+
+    def schema(self) -> Schema:
+        """Structured schema: tables, columns, keys, indexes, row counts."""
+        with self.pool.connection() as conn:
+            return self._schema_cache.get(conn)
+
+    def sql_checker(self) -> SqlChecker:
+        """SqlChecker of the current schema, rebuilt when the schema changes."""
+        schema = self.schema()
+        with self._lock:
+            if self._sql_checker is None or self._sql_checker.schema is not schema:
+                self._sql_checker = SqlChecker(schema)
+            return self._sql_checker
+
+    def _set_budget(self, memory_budget: int):
+        self.memory_budget = memory_budget
+        self.result_cache_bytes = memory_budget // 2
+        self.page_cache_bytes = memory_budget // 4 // self.pool_size
+        self.mmap_bytes = memory_budget // 4
+
+    def pool_pragmas(self) -> dict:
+        """cache_size and mmap_size of the pooled connections, from the budget."""
+        return {
+            # Negative cache_size is in KiB
+            "cache_size": -max(self.page_cache_bytes // 1024, 1),
+            "mmap_size": self.mmap_bytes,
+        }
+
+    def resize(self, memory_budget: int):
+        with self._lock:
+            self._set_budget(memory_budget)
+            pool, result_cache = self._pool, self._result_cache
+        if result_cache is not None:
+            result_cache.resize(self.result_cache_bytes)
+        if pool is not None:
+            pool.set_pragmas(**self.pool_pragmas())
+
+    def state(self, build: Callable):
+        """The object `build(self)` returned the first time it was asked for."""
+        with self._state_lock:
+            if build not in self._states:
+                self._states[build] = build(self)
+            return self._states[build]
+
+    def file_for(self, path: str | None) -> str | None:
+        """`path` made specific to this database, e.g. cache.db -> cache.<name>.db."""
+        if path is None:
+            return None
+        root, ext = os.path.splitext(path)
+        return f"{root}.{self.name}{ext}"
+
+    def stats(self):
+        with self._lock:
+            pool, result_cache = self._pool, self._result_cache
+        return {
+            "name": self.name,
+            "db_path": self.db_path,
+            "memory_budget": self.memory_budget,
+            "result_cache_bytes": self.result_cache_bytes,
+            "pragmas": self.pool_pragmas(),
+            "pool": pool.stats() if pool is not None else None,
+            "result_cache": result_cache.stats() if result_cache is not None else None,
+        }
+
+    def close(self):
+        with self._state_lock:
+            states = list(self._states.values())
+            self._states.clear()
+        with self._lock:
+            pool, self._pool = self._pool, None
+            result_cache, self._result_cache = self._result_cache, None
+            self._sql_checker = None
+        for state in states:
+            if hasattr(state, "close"):
+                state.close()
+        if pool is not None:
+            pool.close()
+        if result_cache is not None:
+            result_cache.version.close()
+
+
+class DatabaseRegistry:
+    """
+    The databases one process serves, by name; the first one is the default.
+
+    Databases are opened on first use and share `memory_budget` bytes of
+    result and SQLite caches evenly (see Database), resized as databases open
+    and close. Past
+    `max_open` open databases the least recently used one is closed (its
+    idle connections, caches and states are dropped; queries in flight finish
+    on the connections they hold) and reopened on its next use.
+    """
+
+    def __init__(
+        self,
+        paths: dict[str, str],
+        pool_size: int = 8,
+        memory_budget: int = 64 * 1024 * 1024,
+        max_open: int = 16,
+        schema_cache_dir: str | None = None,
+    ):
+        if not paths:
+            raise ValueError("At least one database is needed")
+        self.paths = dict(paths)
+        self.default = next(iter(self.paths))
+        self.pool_size = pool_size
+        self.memory_budget = memory_budget
+        self.max_open = max_open
+        self.schema_cache_dir = schema_cache_dir
+
+        self._open = OrderedDict()  # name -> Database, least recently used first
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._closed = 0
+
+    def names(self):
+        return list(self.paths)
+
+    def add(self, name: str, db_path: str):
+        with self._lock:
+            self.paths[name] = db_path
+
+    def get(self, name: str | None = None) -> Database:
+        """The database `name` (default: the default one), opened if needed."""
+        if name is None:
+            name = self.default
+        with self._lock:
+            database = self._open.get(name)
+            if database is not None:
+                self._open.move_to_end(name)
+                return database
+            if name not in self.paths:
+                raise UnknownDatabaseError(
+                    f"Unknown database {name!r}, use one of {list(self.paths)}"
+                )
+
+            database = Database(
+                name, self.paths[name], self.pool_size, self.schema_cache_dir
+            )
+            self._open[name] = database
+            self._opened += 1
+            closing = []
+            while len(self._open) > self.max_open:
+                _, evicted = self._open.popitem(last=False)
+                closing.append(evicted)
+            self._closed += len(closing)
+            share = self.memory_budget // len(self._open)
+            for open_database in self._open.values():
+                open_database.resize(share)
+
+        for evicted in closing:
+            evicted.close()
+        return database
+
+    def stats(self):
+        with self._lock:
+            open_databases = list(self._open.values())
+            stats = {
+                "default": self.default,
+                "databases": list(self.paths),
+                "max_open": self.max_open,
+                "memory_budget": self.memory_budget,
+                "opened": self._opened,
+                "closed": self._closed,
+            }
+        stats["open"] = [database.stats() for database in open_databases]
+        return stats
+
+    def close(self):
+        with self._lock:
+            open_databases = list(self._open.values())
+            self._open.clear()
+        for database in open_databases:
+            database.close()
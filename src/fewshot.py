@@ -0,0 +1,260 @@
+import itertools
+import json
+import math
+import sqlite3
+import threading
+import time
+import zlib
+from collections import defaultdict
+from typing import NamedTuple
+
+import numpy as np
+
+from src.question_cache import normalize_question, schema_fingerprint
+from src.schema_linking import question_terms
+
+INDEX_METHODS = ("hashed", "bm25")
+EMBEDDING_DIM = 1024
+# Word pairs count less than the words themselves
+BIGRAM_WEIGHT = 0.5
+MIN_SIMILARITY = 0.3
+
+
+class Example(NamedTuple):
+    question: str
+    sql_query: str
+    score: float = 0.0
+
+
+def hashed_embedding(terms: list[str], dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """
+    Unit vector of the terms and word pairs of a question, each hashed to one
+    of `dim` signed buckets: no model, stable across processes.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    features = [(term, 1.0) for term in terms] + [
+        (f"{a} {b}", BIGRAM_WEIGHT) for a, b in itertools.pairwise(terms)
+    ]
+    for feature, weight in features:
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[h % dim] += weight if h & 0x80000000 else -weight
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class HashedIndex:
+    """Cosine similarity over hashed embeddings, one matrix product per search."""
+
+    def __init__(self, dim: int = EMBEDDING_DIM, min_score: float = MIN_SIMILARITY):
+        self.dim = dim
+        self.min_score = min_score
+        self.clear()
+
+    def clear(self):
+        self._vectors = np.zeros((16, self.dim), dtype=np.float32)
+        self._size = 0
+
+    def set(self, idx: int, terms: list[str]):
+        if idx >= len(self._vectors):
+            # Doubling keeps incremental inserts amortized O(1)
+            grown = np.zeros((2 * len(self._vectors), self.dim), dtype=np.float32)
+            grown[: self._size] = self._vectors[: self._size]
+            self._vectors = grown
+        self._vectors[idx] = hashed_embedding(terms, self.dim)
+        self._size = max(self._size, idx + 1)
+
+    def search(self, terms: list[str], k: int):
+        if not self._size:
+            return []
+        scores = self._vectors[: self._size] @ hashed_embedding(terms, self.dim)
+        if self._size > k:
+            best = np.argpartition(-scores, k)[:k]
+        else:
+            best = np.arange(self._size)
+        return [
+            (int(idx), float(scores[idx]))
+            for idx in best
+            if scores[idx] >= self.min_score
+        ]
+
+
+class BM25Index:
+    """Okapi BM25 over the question terms, with incremental postings."""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, min_score: float = 0.0):
+        self.k1 = k1
+        self.b = b
+        self.min_score = min_score
+        self.clear()
+
+    def clear(self):
+        self._postings = defaultdict(dict)  # term -> {idx: term frequency}
+        self._documents = {}  # idx -> terms
+        self._lengths = {}
+
+    def set(self, idx: int, terms: list[str]):
+        for term in set(self._documents.get(idx, ())):
+            del self._postings[term][idx]
+        self._documents[idx] = terms
+        self._lengths[idx] = len(terms)
+        for term in terms:
+            postings = self._postings[term]
+            postings[idx] = postings.get(idx, 0) + 1
+
+    def search(self, terms: list[str], k: int):
+        n = len(self._lengths)
+        if not n:
+            return []
+        avg_length = sum(self._lengths.values()) / n or 1.0
+        scores = defaultdict(float)
+        for term in set(terms):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for idx, tf in postings.items():
+                length_norm = 1 - self.b + self.b * self._lengths[idx] / avg_length
+                scores[idx] += idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+        best = sorted(scores.items(), key=lambda item: -item[1])[:k]
+        return [(idx, score) for idx, score in best if score > self.min_score]
+
+
+class ExampleStore:
+    """
+    Question -> SQL examples, e.g. the validated answers of previous
+    questions, searched by similarity to a new question to put the closest
+    ones in the prompt as few-shot examples.
+
+    The index is "hashed" (cosine over hashed embeddings, see
+    `hashed_embedding`) or "bm25" (lexical). Inserts are incremental; with
+    `path` the examples are also kept in a SQLite file, and re-indexed on
+    load. Past `max_examples`, new questions are not added. Like the
+    question cache, examples are tied to the schema they were validated
+    against and dropped by `set_schema` when it changes.
+    """
+
+    def __init__(
+        self,
+        db_schema: str,
+        method: str = "hashed",
+        max_examples: int = 10000,
+        path: str | None = None,
+    ):
+        if method not in INDEX_METHODS:
+            raise ValueError(f"Unknown index method {method!r}, use {INDEX_METHODS}")
+        self.method = method
+        self.max_examples = max_examples
+        self.path = path
+        self.fingerprint = schema_fingerprint(db_schema)
+        self.index = HashedIndex() if method == "hashed" else BM25Index()
+
+        self._examples = []  # idx -> (question, sql_query)
+        self._positions = {}  # normalized question -> idx
+        self._lock = threading.Lock()
+        self._searches = 0
+        self._hits = 0
+        self._search_seconds = 0.0
+
+        self._conn = None
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS fewshot_examples ("
+                "schema_fingerprint TEXT NOT NULL, "
+                "question_key TEXT NOT NULL, "
+                "question TEXT NOT NULL, "
+                "sql_query TEXT NOT NULL, "
+                "PRIMARY KEY (schema_fingerprint, question_key))"
+            )
+            self._conn.commit()
+            rows = self._conn.execute(
+                "SELECT question, sql_query FROM fewshot_examples "
+                "WHERE schema_fingerprint = ? ORDER BY rowid",
+                (self.fingerprint,),
+            ).fetchall()
+            for question, sql_query in rows:
+                self._insert(question, sql_query)
+
+    def __len__(self):
+        return len(self._examples)
+
+    def set_schema(self, db_schema: str) -> bool:
+        """Drop every example if `db_schema` differs. Return True if it did."""
+        fingerprint = schema_fingerprint(db_schema)
+        with self._lock:
+            if fingerprint == self.fingerprint:
+                return False
+            self.fingerprint = fingerprint
+            self._examples.clear()
+            self._positions.clear()
+            self.index.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM fewshot_examples")
+                self._conn.commit()
+        return True
+
+    def _insert(self, question: str, sql_query: str) -> bool:
+        key = normalize_question(question)
+        idx = self._positions.get(key)
+        if idx is None:
+            if len(self._examples) >= self.max_examples:
+                return False
+            idx = self._positions[key] = len(self._examples)
+            self._examples.append(None)
+        self._examples[idx] = (question, sql_query)
+        self.index.set(idx, question_terms(question))
+        return True
+
+    def put(self, question: str, sql_query: str):
+        """Add an example, or replace the SQL of the same question."""
+        with self._lock:
+            if self._insert(question, sql_query) and self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO fewshot_examples VALUES (?, ?, ?, ?)",
+                    (
+                        self.fingerprint,
+                        normalize_question(question),
+                        question,
+                        sql_query,
+                    ),
+                )
+                self._conn.commit()
+
+    def load_json(self, path: str):
+        """Add the examples of a JSON list of {"question", "sql"} objects."""
+        with open(path) as f:
+            for item in json.load(f):
+                self.put(item["question"], item["sql"])
+
+    def search(self, question: str, k: int = 3) -> list[Example]:
+        """The `k` examples most similar to `question`, best first."""
+        start = time.perf_counter()
+        with self._lock:
+            matches = self.index.search(question_terms(question), k)
+            examples = [
+                Example(*self._examples[idx], score)
+                for idx, score in sorted(matches, key=lambda match: -match[1])
+            ]
+            self._searches += 1
+            self._hits += bool(examples)
+            self._search_seconds += time.perf_counter() - start
+        return examples
+
+    def stats(self):
+        with self._lock:
+            return {
+                "examples": len(self._examples),
+                "method": self.method,
+                "searches": self._searches,
+                "hit_rate": self._hits / self._searches if self._searches else 0.0,
+                "avg_search_ms": 1000 * self._search_seconds / self._searches
+                if self._searches
+                else 0.0,
+                "schema_fingerprint": self.fingerprint,
+                "persistent": self._conn is not None,
+            }
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,184 @@
+import json
+import logging
+from collections.abc import Callable, Generator
+
+from src.react import extend_user_prompt, generate_user_prompt
+from src.simple import extend_prompt_with_errors
+from src.sse import relay_tokens
+from src.tracing import span, tracer
+from src.utils import prepare_sql, validate_sql
+
+logger = logging.getLogger(__name__)
+
+
+def simple_events(
+    base_prompt: str,
+    generate: Callable,
+    attempts: int,
+    select: Callable | None = None,
+    **span_attrs,
+):
+    """
+    The simple flow: generate a query, validate it, and retry with the errors
+    appended to the prompt. Yields (event, data) pairs: "attempt", "token" for
+    each piece of a streamed generation, "sql", "invalid", and lastly "done"
+    with the valid SQL or "failed".
+
+    `generate(prompt)` returns the SQL query, or a generator of pieces
+    returning it. With `select`, it returns sampled candidates instead and
+    `select(candidates)` picks one, as `select_candidate` does.
+    """
+    sql_query = ""
+    error_message = ""
+    errors = []
+    for attempt in range(1, attempts + 1):
+        logger.info(f"\x1b[36m -- Attempt {attempt} to generate SQL query\x1b[0m")
+        yield "attempt", attempt
+
+        prompt = extend_prompt_with_errors(base_prompt, errors)
+        tracer.log_prompt(prompt, attempt=attempt)
+        with span("generate", attempt=attempt, **span_attrs):
+            generated = generate(prompt)
+            if isinstance(generated, Generator):
+                generated = yield from relay_tokens(generated)
+
+        if select is None:
+            sql_query = prepare_sql(generated)
+            is_valid, error_message = validate_sql(sql_query)
+            error = {"sql_query": sql_query, "message": error_message}
+        else:
+            candidates = [prepare_sql(candidate) for candidate in generated]
+            sql_query, is_valid, candidate_errors = select(candidates)
+            # One error per attempt: the prompt grows with attempts, not samples
+            error = candidate_errors[0] if candidate_errors else None
+            error_message = error["message"] if error else ""
+        logger.info(f"\x1b[33m Generated SQL Query: {sql_query}\x1b[0m")
+        yield "sql", sql_query
+
+        if is_valid:
+            yield "done", {"sql_query": sql_query, "attempts": attempt}
+            return
+        logger.warning("SQL Query failed validation: %s", error_message)
+        errors.append(error)
+        yield "invalid", error
+
+    logger.error("All attempts failed. Error message: %s", error_message)
+    yield (
+        "failed",
+        {"sql_query": sql_query, "message": error_message, "attempts": attempts},
+    )
+
+
+def react_events(
+    question: str,
+    bot,
+    run_action: Callable,
+    db_schema: str | None = None,
+    stream_tokens: bool = False,
+):
+    """
+    The ReAct flow: the bot reasons and runs actions on the database until it
+    gives its final answer, in at most `bot.attempts` steps. Yields (event,
+    data) pairs: "attempt", "token" (decoded pieces, only if `stream_tokens`),
+    "step" (each parsed Scratchpad/Thought/Action/Observation or final
+    answer) and lastly "done" with the validated SQL or "failed", both with
+    the number of actions run.
+
+    `run_action(action, action_input)` returns (observation, latency_ms), see
+    ActionStats.run.
+    """
+    user_prompt = generate_user_prompt(question)
+    previous_actions = []
+    sql_query = ""
+    error_message = ""
+    episode = bot.new_episode()
+    for attempt in range(1, bot.attempts + 1):
+        logger.info(f"\x1b[36m -- Attempt {attempt} to generate SQL query\x1b[0m")
+        tracer.log_prompt(user_prompt, attempt=attempt)
+        yield "attempt", attempt
+
+        with span("generate", attempt=attempt, streamed=stream_tokens):
+            if stream_tokens:
+                json_result = yield from relay_tokens(
+                    bot.think_stream(user_prompt, episode, db_schema)
+                )
+            else:
+                json_result = bot(user_prompt, episode, db_schema)
+        tokens = episode.steps[-1]
+        logger.info(
+            f"\x1b[35m Tokens: {tokens['prefill_tokens']} prefilled, "
+            f"{tokens['reused_tokens']} reused, {tokens['decode_tokens']} decoded\x1b[0m"
+        )
+        decision = json.loads(json_result)["Decision"]
+
+        if "Final_Answer" in decision:
+            thought = decision["Final_Thought"]
+            sql_query = prepare_sql(decision["Final_Answer"])
+            logger.info(f"\x1b[34m Final thought: {thought} \x1b[0m")
+            logger.info(f"\x1b[34m Final Answer: {sql_query} \x1b[0m")
+            yield (
+                "step",
+                {"final_thought": thought, "final_answer": sql_query, "tokens": tokens},
+            )
+            logger.info(f"Episode token accounting: {episode.stats()}")
+
+            is_valid, error_message = validate_sql(sql_query)
+            if is_valid:
+                yield (
+                    "done",
+                    {
+                        "sql_query": sql_query,
+                        "attempts": attempt,
+                        "actions": len(previous_actions),
+                    },
+                )
+                return
+            logger.warning("SQL Query failed validation: %s", error_message)
+            break
+
+        scratchpad = decision["Scratchpad"]
+        thought = decision["Thought"]
+        action = decision["Action"]
+        action_input = decision["Action_Input"]
+        logger.info(f"\x1b[34m Scratchpad: {scratchpad} \x1b[0m")
+        logger.info(f"\x1b[34m Thought: {thought} \x1b[0m")
+        logger.info(
+            f"\x1b[36m  -- running action: {action} with inputs: {action_input}\x1b[0m"
+        )
+        latency_ms = 0.0
+        if action + ": " + str(action_input) in previous_actions:
+            observation = (
+                "You already run that action. **TRY A DIFFERENT ACTION INPUT.**"
+            )
+        else:
+            observation, latency_ms = run_action(action, prepare_sql(action_input))
+        logger.info(f"\x1b[33m Observation: {observation} \x1b[0m")
+        logger.info(f"\x1b[35m Action latency: {latency_ms:.1f} ms\x1b[0m")
+        previous_actions.append(action + ": " + str(action_input))
+        yield (
+            "step",
+            {
+                "scratchpad": scratchpad,
+                "thought": thought,
+                "action": action,
+                "action_input": action_input,
+                "observation": observation,
+                "latency_ms": latency_ms,
+                "tokens": tokens,
+            },
+        )
+
+        user_prompt = extend_user_prompt(
+            user_prompt, scratchpad, thought, action, action_input, observation
+        )
+
+    logger.error("All attempts failed. Error message: %s", error_message)
+    yield (
+        "failed",
+        {
+            "sql_query": sql_query,
+            "message": error_message,
+            "attempts": attempt,
+            "actions": len(previous_actions),
+        },
+    )
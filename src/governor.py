@@ -0,0 +1,128 @@
+import sqlite3
+import time
+
+from src.sql_check import SqlSyntaxError, tokenize
+
+# SQLite VM instructions between two budget checks
+PROGRESS_INTERVAL = 1000
+
+
+class QueryBudgetExceeded(sqlite3.OperationalError):
+    pass
+
+
+class ExecutionGovernor:
+    """
+    Wall-clock and VM-step budget of one query, enforced with SQLite's
+    progress handler: every `interval` VM instructions the handler checks the
+    budgets and interrupts the statement once one is exhausted.
+
+    Only the time spent inside SQLite counts: the clock runs from `attach`
+    and between `resume` and `pause`, so that for a streamed result the time
+    spent rendering rows between two fetches is not charged to the query.
+    """
+
+    def __init__(
+        self,
+        max_seconds: float | None = None,
+        max_steps: int | None = None,
+        interval: int = PROGRESS_INTERVAL,
+    ):
+        self.max_seconds = max_seconds
+        self.max_steps = max_steps
+        self.interval = interval
+
+        self.steps = 0
+        self.elapsed = 0.0
+        self.exceeded = None
+        self._start = None
+
+    def attach(self, conn):
+        conn.set_progress_handler(self._progress, self.interval)
+        self.resume()
+
+    def detach(self, conn):
+        conn.set_progress_handler(None, 0)
+        self.pause()
+
+    def resume(self):
+        """Count the time again, e.g. before fetching the next rows."""
+        if self._start is None:
+            self._start = time.perf_counter()
+
+    def pause(self):
+        """Stop counting the time, e.g. while the fetched rows are rendered."""
+        if self._start is not None:
+            self.elapsed += time.perf_counter() - self._start
+            self._start = None
+
+    def _elapsed(self):
+        if self._start is None:
+            return self.elapsed
+        return self.elapsed + time.perf_counter() - self._start
+
+    def _progress(self):
+        self.steps += self.interval
+        if self.max_steps is not None and self.steps > self.max_steps:
+            self.exceeded = "steps"
+            return 1
+        if self.max_seconds is not None and self._elapsed() > self.max_seconds:
+            self.exceeded = "time"
+            return 1
+        return 0
+
+    def translate(self, error: Exception) -> Exception:
+        """The budget error when `error` is the interrupt raised by the handler."""
+        if self.exceeded is None or not isinstance(error, sqlite3.OperationalError):
+            return error
+        if self.exceeded == "time":
+            budget = f"its {self.max_seconds:g} s time budget"
+        else:
+            budget = f"its budget of {self.max_steps} VM steps"
+        return QueryBudgetExceeded(
+            f"query interrupted after exceeding {budget}, "
+            "add filters or aggregate the rows to make it cheaper"
+        )
+
+    def cost(self):
+        return {
+            "elapsed_ms": round(1000 * self._elapsed(), 3),
+            "vm_steps": self.steps,
+            "exceeded": self.exceeded,
+        }
+
+
+def describe_cost(cost) -> str:
+    """One line summary of a cost report, for an agent Observation."""
+    text = f"{cost['elapsed_ms']:.1f} ms, ~{cost['vm_steps']} VM steps"
+    if "rows" in cost:
+        text += f", {cost['rows']} rows"
+        if cost.get("limited"):
+            text += " (preview limit reached)"
+    return text
+
+
+def limit_query(sql_query: str, limit: int) -> str:
+    """
+    The query returning at most `limit` rows: a LIMIT clause is appended, or
+    the query wrapped when it already has its own top-level LIMIT.
+    """
+    try:
+        tokens = tokenize(sql_query)
+    except SqlSyntaxError:
+        return sql_query
+    while tokens and tokens[-1].value == ";":
+        tokens.pop()
+    if not tokens:
+        return sql_query
+
+    body = sql_query[: tokens[-1].start + len(tokens[-1].value)]
+    depth = 0
+    for token in tokens:
+        if token.value == "(":
+            depth += 1
+        elif token.value == ")":
+            depth -= 1
+        elif depth == 0 and token.kind == "word" and token.value.lower() == "limit":
+            return f"SELECT * FROM (\n{body}\n) LIMIT {int(limit)}"
+    return f"{body}\nLIMIT {int(limit)}"
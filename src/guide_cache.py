@@ -0,0 +1,65 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+from importlib.metadata import version
+
+from outlines.fsm.guide import RegexGuide
+
+logger = logging.getLogger(__name__)
+
+GUIDE_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "text-to-sql-proto", "guides"
+)
+# Pickled guides are only read back by the outlines version that wrote them
+OUTLINES_VERSION = version("outlines")
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """Hash of what the FSM index depends on: the vocabulary and EOS token."""
+    vocabulary = sorted(tokenizer.vocabulary.items(), key=lambda item: item[1])
+    payload = json.dumps([vocabulary, tokenizer.eos_token_id]).encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+
+def guide_cache_key(regex_str: str, tokenizer) -> str:
+    payload = f"{OUTLINES_VERSION}\n{regex_str}".encode()
+    regex_hash = hashlib.sha256(payload).hexdigest()[:16]
+    return f"{regex_hash}-{tokenizer_fingerprint(tokenizer)}"
+
+
+def load_regex_guide(regex_str: str, tokenizer, cache_dir: str = GUIDE_CACHE_DIR):
+    """
+    Return the compiled `RegexGuide` of `regex_str` for `tokenizer`.
+
+    Building the FSM index over the whole vocabulary is the expensive part of
+    regex-guided generation, so the compiled guide is pickled in `cache_dir`
+    and loaded from there on the next process start. A file that cannot be
+    loaded is a cache miss: the guide is rebuilt and the file overwritten.
+    Pass `cache_dir=None` to disable the on-disk cache.
+    """
+    if cache_dir is None:
+        return RegexGuide(regex_str, tokenizer)
+
+    path = os.path.join(cache_dir, guide_cache_key(regex_str, tokenizer) + ".pkl")
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception:
+        # Truncated file, or classes of outlines moved or renamed since
+        logger.warning("Rebuilding the unreadable regex guide %s", path, exc_info=True)
+
+    guide = RegexGuide(regex_str, tokenizer)
+
+    # Write atomically: several workers may compile the same guide at once
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        pickle.dump(guide, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+    return guide
@@ -0,0 +1,246 @@
+import copy
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import torch
+from outlines.models.transformers import Transformers
+from transformers import DynamicCache
+
+# Episode of the `episode(...)` block running in this context. A context
+# variable rather than a thread-local: a streamed step can be resumed by
+# another thread, e.g. the executor of app_async, with the same context
+_current_episode: ContextVar["Episode | None"] = ContextVar("episode", default=None)
+
+
+def common_prefix_length(a: list[int], b: list[int]) -> int:
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class PromptCache:
+    """
+    Past key-values of a token prefix shared by many prompts.
+
+    `prime` runs the prefill of the invariant part of the prompt (system
+    instructions + db schema) once. `lookup` then hands out a private copy of
+    that cache cropped to the longest common prefix with the new prompt, so the
+    model only has to prefill the tokens that differ (question, errors, ...).
+    Comparing token ids rather than strings keeps the result identical to a
+    full prefill even when the tokenizer merges tokens across the boundary.
+    """
+
+    def __init__(self, model, min_reuse: int = 1):
+        self.model = model
+        self.min_reuse = min_reuse
+        self.token_ids: list[int] = []
+        self.past_key_values = None
+
+        self.hits = 0
+        self.misses = 0
+        self.reused_tokens = 0
+        self.prefilled_tokens = 0
+
+    def prime(self, token_ids: list[int]):
+        input_ids = torch.tensor([token_ids], device=self.model.device)
+        with torch.inference_mode():
+            output = self.model(
+                input_ids, past_key_values=DynamicCache(), use_cache=True
+            )
+        self.token_ids = list(token_ids)
+        self.past_key_values = output.past_key_values
+
+    def store(self, token_ids: list[int], past_key_values):
+        """Replace the cached prefix, e.g. by the transcript of an episode."""
+        self.token_ids = list(token_ids)
+        self.past_key_values = past_key_values
+
+    def lookup(self, input_ids: torch.Tensor, copy_cache: bool = True):
+        """
+        Return `(past_key_values, n_reused)` for a prompt of shape (1, seq_len).
+
+        `past_key_values` is None when nothing can be reused (batched input,
+        see `lookup_batch`, empty cache or diverging prefix). With
+        `copy_cache=False` the caller takes ownership of the cached tensors,
+        which the next generation extends in place: only do this when the
+        cache is `store`d again after.
+        """
+        seq_len = input_ids.shape[-1]
+        if (
+            self.past_key_values is None
+            or input_ids.ndim != 2
+            or input_ids.shape[0] != 1
+        ):
+            self.misses += 1
+            self.prefilled_tokens += input_ids.numel()
+            return None, 0
+
+        # At least one token must be left to prefill so the model emits logits
+        n_reused = common_prefix_length(self.token_ids, input_ids[0, :-1].tolist())
+        if n_reused < self.min_reuse:
+            self.misses += 1
+            self.prefilled_tokens += seq_len
+            return None, 0
+
+        past_key_values = self.past_key_values
+        if copy_cache:
+            past_key_values = copy.deepcopy(past_key_values)
+        if n_reused < past_key_values.get_seq_length():
+            past_key_values.crop(n_reused)
+
+        self.hits += 1
+        self.reused_tokens += n_reused
+        self.prefilled_tokens += seq_len - n_reused
+        return past_key_values, n_reused
+
+    def lookup_batch(self, rows: list[list[int]]):
+        """
+        Return `(past_key_values, n_reused)` for the token ids of a batch of
+        prompts, without padding: a copy of the cache cropped to the prefix
+        they all share with it, repeated for each row. None when that prefix
+        is shorter than `min_reuse`.
+        """
+        n_tokens = sum(len(row) for row in rows)
+        if self.past_key_values is None:
+            self.misses += 1
+            self.prefilled_tokens += n_tokens
+            return None, 0
+
+        # At least one token of each row must be left to prefill
+        n_reused = min(common_prefix_length(self.token_ids, row[:-1]) for row in rows)
+        if n_reused < self.min_reuse:
+            self.misses += 1
+            self.prefilled_tokens += n_tokens
+            return None, 0
+
+        past_key_values = copy.deepcopy(self.past_key_values)
+        if n_reused < past_key_values.get_seq_length():
+            past_key_values.crop(n_reused)
+        past_key_values.batch_repeat_interleave(len(rows))
+
+        self.hits += 1
+        self.reused_tokens += n_reused * len(rows)
+        self.prefilled_tokens += n_tokens - n_reused * len(rows)
+        return past_key_values, n_reused
+
+    def stats(self):
+        return {
+            "cached_tokens": len(self.token_ids),
+            "hits": self.hits,
+            "misses": self.misses,
+            "reused_tokens": self.reused_tokens,
+            "prefilled_tokens": self.prefilled_tokens,
+        }
+
+
+class Episode:
+    """
+    KV state and token accounting of one multi-step ReAct episode.
+
+    After each step the cache holds the transcript so far (prompt + decoded
+    tokens), so the next step only prefills the newly appended block.
+    """
+
+    def __init__(self, model):
+        self.cache = PromptCache(model)
+        self.steps = []
+        self._last_state = None
+
+    def start_step(self, prefill_tokens: int, reused_tokens: int):
+        self.steps.append(
+            {
+                "prefill_tokens": prefill_tokens,
+                "reused_tokens": reused_tokens,
+                "decode_tokens": 0,
+            }
+        )
+
+    def record_decode(self):
+        self.steps[-1]["decode_tokens"] += 1
+
+    def record_state(self, input_ids, past_key_values):
+        self._last_state = (input_ids, past_key_values)
+
+    def end_step(self):
+        if self._last_state is None:
+            return
+        input_ids, past_key_values = self._last_state
+        if not isinstance(past_key_values, DynamicCache):
+            past_key_values = DynamicCache.from_legacy_cache(past_key_values)
+        self.cache.store(input_ids[0].tolist(), past_key_values)
+        self._last_state = None
+
+    def stats(self):
+        return {
+            "steps": len(self.steps),
+            "prefill_tokens": sum(step["prefill_tokens"] for step in self.steps),
+            "reused_tokens": sum(step["reused_tokens"] for step in self.steps),
+            "decode_tokens": sum(step["decode_tokens"] for step in self.steps),
+        }
+
+
+class PromptCachedTransformers(Transformers):
+    """
+    outlines `Transformers` model whose first forward pass of every sequence
+    resumes from a cache instead of prefilling the whole prompt: the episode
+    transcript when running inside `episode(...)`, else the static prefix.
+    """
+
+    def __init__(self, model, tokenizer):
+        super().__init__(model, tokenizer)
+        self.prompt_cache = PromptCache(model)
+
+    @contextmanager
+    def episode(self, episode: Episode):
+        previous = _current_episode.get()
+        _current_episode.set(episode)
+        try:
+            yield episode
+        finally:
+            # A generator closed late, e.g. by the garbage collector, must not
+            # switch the episode of whatever runs at that point
+            if _current_episode.get() is episode:
+                _current_episode.set(previous)
+
+    def forward(self, input_ids, attention_mask, past_key_values=None):
+        episode = _current_episode.get()
+        single = input_ids.ndim == 2 and input_ids.shape[0] == 1
+
+        if past_key_values is None:
+            cached, n_reused = None, 0
+            if episode is not None and single and episode.cache.token_ids:
+                cached, n_reused = episode.cache.lookup(input_ids, copy_cache=False)
+            if cached is None:
+                cached, n_reused = self.prompt_cache.lookup(input_ids)
+            if episode is not None:
+                episode.start_step(input_ids.shape[-1] - n_reused, n_reused)
+
+            if cached is not None:
+                with torch.inference_mode():
+                    output = self.model(
+                        input_ids[..., n_reused:],
+                        attention_mask=attention_mask,
+                        return_dict=True,
+                        output_attentions=False,
+                        output_hidden_states=False,
+                        past_key_values=cached,
+                    )
+                # outlines re-orders the kv cache as a tuple of tuples
+                logits = output.logits
+                kv_cache = output.past_key_values.to_legacy_cache()
+            else:
+                logits, kv_cache = super().forward(input_ids, attention_mask)
+        else:
+            if episode is not None:
+                episode.record_decode()
+            logits, kv_cache = super().forward(
+                input_ids, attention_mask, past_key_values
+            )
+
+        if episode is not None and single:
+            # kv_cache now covers every token of input_ids
+            episode.record_state(input_ids, kv_cache)
+        return logits, kv_cache
@@ -0,0 +1,120 @@
+import logging
+import os
+import threading
+import time
+import weakref
+from collections.abc import Callable
+
+logger = logging.getLogger(__name__)
+
+LOADING_MODES = ("lazy", "background", "preload")
+
+# Every loader of the process, reset in the child after a fork
+_loaders = weakref.WeakSet()
+
+
+class LazyLoader:
+    """
+    Builds an expensive object, like a chat bot and its model, once: on first
+    use, or ahead of it in a background warm-up thread so that the process
+    starts serving (and answering health checks) right away.
+
+    Callers of `get` block until the object is ready. A failed load is
+    reported by `status` and retried by the next `get`.
+
+    A process forked while the object loads (e.g. a worker of `gunicorn
+    --preload`) does not wait for the load of its parent, whose thread it does
+    not have: it loads its own. An object already loaded is kept, shared
+    copy-on-write.
+    """
+
+    def __init__(self, factory: Callable, name: str = "model"):
+        self.factory = factory
+        self.name = name
+        self._lock = threading.Lock()
+        self._value = None
+        self._state = "cold"
+        self._error = None
+        self._load_seconds = None
+        self._thread = None
+        _loaders.add(self)
+
+    def _after_fork(self):
+        # The lock may be held by a thread of the parent, which is gone here
+        self._lock = threading.Lock()
+        warming_up = self._thread is not None and self._value is None
+        self._thread = None
+        if self._state == "loading":
+            self._state = "cold"
+        if warming_up:
+            self.warm_up()
+
+    def start(self, mode: str = "lazy"):
+        """Apply a loading mode: "lazy", "background" or "preload"."""
+        if mode not in LOADING_MODES:
+            raise ValueError(f"Unknown loading mode {mode!r}, use {LOADING_MODES}")
+        if mode == "background":
+            self.warm_up()
+        elif mode == "preload":
+            self.get()
+
+    def warm_up(self) -> threading.Thread:
+        """Start loading in a daemon thread, if not already loading or loaded."""
+        with self._lock:
+            if self._thread is None and self._value is None:
+                self._thread = threading.Thread(
+                    target=self._warm_up, name=f"{self.name}-warm-up", daemon=True
+                )
+                self._thread.start()
+            return self._thread
+
+    def _warm_up(self):
+        try:
+            self.get()
+        except Exception:
+            logger.exception("Warm-up of the %s failed", self.name)
+
+    def get(self):
+        value = self._value
+        if value is not None:
+            return value
+        with self._lock:
+            if self._value is None:
+                self._state = "loading"
+                start = time.perf_counter()
+                try:
+                    self._value = self.factory()
+                except Exception as e:
+                    self._state = "failed"
+                    self._error = repr(e)
+                    raise
+                self._load_seconds = time.perf_counter() - start
+                self._state = "ready"
+                self._error = None
+                logger.info("Loaded the %s in %.1fs", self.name, self._load_seconds)
+            return self._value
+
+    def peek(self) -> object | None:
+        """The object if it is loaded, without loading it."""
+        return self._value
+
+    @property
+    def ready(self) -> bool:
+        return self._value is not None
+
+    def status(self):
+        return {
+            "name": self.name,
+            "ready": self.ready,
+            "state": self._state,
+            "load_seconds": self._load_seconds,
+            "error": self._error,
+        }
+
+
+def _after_fork_in_child():
+    for loader in list(_loaders):
+        loader._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,405 @@
+import errno
+import itertools
+import logging
+import os
+import pickle
+import queue
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+from typing import NamedTuple
+
+from src.batching import BatchScheduler
+from src.loader import LazyLoader
+
+logger = logging.getLogger(__name__)
+
+# ReAct episodes (and their KV caches) kept by the server, least recently used
+# dropped first
+MAX_EPISODES = 64
+# Calls served at once, across all the workers
+MAX_CALLS = 64
+# Calls whose result is streamed as "token" replies first
+STREAM_METHODS = ("think_stream",)
+# Bot methods the workers may call, besides the ones of the server itself
+BOT_METHODS = ("think", "think_candidates") + STREAM_METHODS
+
+
+class EpisodeRef(NamedTuple):
+    """Stands for a server-side episode in the arguments of a call."""
+
+    id: int
+
+
+class ModelServer:
+    """
+    One chat bot served to the HTTP worker processes over
+    multiprocessing.connection, so that the model is loaded once while the
+    workers do the SQLite, validation and rendering work on every core.
+
+    Workers send (call_id, method, args); the server replies (call_id, kind,
+    value) with kind "token" (streams only), "episode" (updated ReAct episode
+    accounting), then "result" or "error". Calls run in threads, as requests
+    do in a single process, and `think_batch` prompts of every worker are
+    batched together by one BatchScheduler. ReAct episodes hold the KV cache
+    and stay here: workers get an id.
+    """
+
+    def __init__(
+        self,
+        factory: Callable,
+        max_batch_size: int = 8,
+        max_wait_ms: float = 20,
+        max_episodes: int = MAX_EPISODES,
+        max_calls: int = MAX_CALLS,
+    ):
+        self.loader = LazyLoader(factory, "chat bot")
+        self.scheduler = BatchScheduler(
+            lambda prompts: self.loader.get().think_batch(prompts),
+            max_batch_size,
+            max_wait_ms,
+        )
+        self.max_episodes = max_episodes
+
+        self._executor = ThreadPoolExecutor(max_calls, thread_name_prefix="model-call")
+        self._episodes = OrderedDict()
+        self._episode_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._connections = 0
+        self._calls = 0
+        self._errors = 0
+
+    def serve_forever(self, listener: Listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception:
+                # e.g. a client with the wrong authkey
+                logger.exception("Rejected a model server connection")
+                continue
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        send_lock = threading.Lock()
+
+        def send(message):
+            with send_lock:
+                conn.send(message)
+
+        with self._lock:
+            self._connections += 1
+        try:
+            while True:
+                try:
+                    call_id, method, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                self._executor.submit(self._run, send, call_id, method, args)
+        finally:
+            conn.close()
+            with self._lock:
+                self._connections -= 1
+
+    def _run(self, send, call_id, method, args):
+        with self._lock:
+            self._calls += 1
+        try:
+            refs = [arg for arg in args if isinstance(arg, EpisodeRef)]
+            args = [
+                self._episode(arg) if isinstance(arg, EpisodeRef) else arg
+                for arg in args
+            ]
+            value = self._dispatch(method, args)
+            if method in STREAM_METHODS:
+                while True:
+                    try:
+                        token = next(value)
+                    except StopIteration as stop:
+                        value = stop.value
+                        break
+                    send((call_id, "token", token))
+            for ref in refs:
+                episode = self._episode(ref)
+                send((call_id, "episode", (ref.id, episode.steps, episode.stats())))
+            send((call_id, "result", value))
+        except Exception as e:  # noqa: BLE001 - sent back to the worker
+            with self._lock:
+                self._errors += 1
+            try:
+                send((call_id, "error", _picklable(e)))
+            except OSError:
+                pass
+
+    def _dispatch(self, method: str, args):
+        if method == "stats":
+            return self.stats()
+        bot = self.loader.get()
+        if method == "describe":
+            return {"attempts": bot.attempts}
+        if method == "think_batch":
+            futures = [self.scheduler.submit(prompt) for prompt in args[0]]
+            return [future.result() for future in futures]
+        if method == "new_episode":
+            with self._lock:
+                episode_id = next(self._episode_ids)
+                self._episodes[episode_id] = bot.new_episode()
+                while len(self._episodes) > self.max_episodes:
+                    self._episodes.popitem(last=False)
+            return episode_id
+        if method == "stopping_stats":
+            return bot.stopping_stats.stats()
+        if method in BOT_METHODS:
+            return getattr(bot, method)(*args)
+        raise ValueError(f"Unknown model server method {method!r}")
+
+    def _episode(self, ref: EpisodeRef):
+        with self._lock:
+            episode = self._episodes.get(ref.id)
+            if episode is None:
+                raise KeyError(f"Episode {ref.id} expired, start a new one")
+            self._episodes.move_to_end(ref.id)
+            return episode
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "pid": os.getpid(),
+                "connections": self._connections,
+                "calls": self._calls,
+                "errors": self._errors,
+                "episodes": len(self._episodes),
+            }
+        stats["loader"] = self.loader.status()
+        stats["batching"] = self.scheduler.stats()
+        return stats
+
+
+def _picklable(error: Exception) -> Exception:
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:  # noqa: BLE001 - whatever fails to round-trip
+        return RuntimeError(repr(error))
+
+
+def start_model_server(
+    factory: Callable,
+    address: tuple[str, int],
+    authkey: bytes,
+    loading: str = "background",
+    **options,
+) -> int | None:
+    """
+    Fork a process serving `factory()` on the TCP `address`, unless one
+    already does (e.g. started by another worker). Returns its pid, or None.
+
+    The server lives as long as the process that started it, e.g. the master
+    of `gunicorn --preload`. It is forked before any model is loaded, so
+    CUDA is only ever initialized in the server.
+    """
+    try:
+        listener = Listener(address, authkey=authkey)
+    except OSError as e:
+        if e.errno != errno.EADDRINUSE:
+            raise
+        logger.info("Model server already listening on %s", address)
+        return None
+
+    parent_pid = os.getpid()
+    pid = os.fork()
+    if pid:
+        listener.close()
+        logger.info("Started the model server (pid %d) on %s", pid, address)
+        return pid
+
+    try:
+        server = ModelServer(factory, **options)
+        if loading != "lazy":
+            server.loader.warm_up()
+        threading.Thread(
+            target=_exit_with_parent, args=(parent_pid,), daemon=True
+        ).start()
+        server.serve_forever(listener)
+    except BaseException:
+        logger.exception("Model server failed")
+    finally:
+        os._exit(0)
+
+
+def _exit_with_parent(parent_pid: int):
+    while os.getppid() == parent_pid:
+        time.sleep(1.0)
+    os._exit(0)
+
+
+class ModelClient:
+    """
+    Connection of one worker process to the ModelServer, shared by its
+    threads: replies are routed to their call by a reader thread. It is
+    reopened in a forked process, and after the server went away.
+    """
+
+    def __init__(self, address: tuple[str, int], authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._pending = {}  # call_id -> queue of (kind, value)
+        self._call_ids = itertools.count()
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            # Connections must not be shared across a fork
+            self._conn = Client(self.address, authkey=self.authkey)
+            self._pid = os.getpid()
+            self._pending = {}
+            threading.Thread(target=self._read, args=(self._conn,), daemon=True).start()
+        return self._conn
+
+    def _read(self, conn):
+        while True:
+            try:
+                call_id, kind, value = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                replies = self._pending.get(call_id)
+                if kind in ("result", "error"):
+                    self._pending.pop(call_id, None)
+            if replies is not None:
+                replies.put((kind, value))
+
+        with self._lock:
+            if self._conn is not conn:
+                return
+            self._conn = None
+            pending, self._pending = self._pending, {}
+        for replies in pending.values():
+            replies.put(("error", ConnectionError("Lost the model server")))
+
+    def stream(self, method: str, *args, episodes=None):
+        """
+        Yield the "token" replies of the call and return its result. The
+        accounting of `episodes` (id -> RemoteEpisode) is updated in place.
+        """
+        replies = queue.SimpleQueue()
+        with self._lock:
+            conn = self._connection()
+            call_id = next(self._call_ids)
+            self._pending[call_id] = replies
+            conn.send((call_id, method, args))
+
+        while True:
+            kind, value = replies.get()
+            if kind == "token":
+                yield value
+            elif kind == "episode":
+                episode_id, steps, stats = value
+                episodes[episode_id].update(steps, stats)
+            elif kind == "result":
+                return value
+            else:
+                raise value
+
+    def call(self, method: str, *args, episodes=None):
+        stream = self.stream(method, *args, episodes=episodes)
+        while True:
+            try:
+                next(stream)
+            except StopIteration as stop:
+                return stop.value
+
+
+class RemoteEpisode:
+    """Worker-side view of a server-side ReAct episode: its token accounting."""
+
+    def __init__(self, episode_id: int):
+        self.id = episode_id
+        self.steps = []
+        self._stats = {}
+
+    def update(self, steps, stats):
+        self.steps = steps
+        self._stats = stats
+
+    def stats(self):
+        return self._stats
+
+
+class RemoteStats:
+    def __init__(self, client: ModelClient, method: str):
+        self.client = client
+        self.method = method
+
+    def stats(self):
+        return self.client.call(self.method)
+
+
+class RemoteBot:
+    """
+    The chat bot of a worker process when the model runs in the model
+    server: the SimpleChatBot and ReactChatBot calls of the apps are
+    forwarded to it. Building it waits for the server to load the model.
+    """
+
+    def __init__(self, address: tuple[str, int], authkey: bytes):
+        self.client = ModelClient(address, authkey)
+        self.attempts = self.client.call("describe")["attempts"]
+        self.stopping_stats = RemoteStats(self.client, "stopping_stats")
+
+    def _call(self, method, args, stream=False):
+        # Episodes travel as their id, their accounting comes back with the reply
+        episodes = {arg.id: arg for arg in args if isinstance(arg, RemoteEpisode)}
+        args = [
+            EpisodeRef(arg.id) if isinstance(arg, RemoteEpisode) else arg
+            for arg in args
+        ]
+        call = self.client.stream if stream else self.client.call
+        return call(method, *args, episodes=episodes)
+
+    def __call__(self, *args):
+        return self.think(*args)
+
+    def think(self, *args):
+        return self._call("think", args)
+
+    def think_stream(self, *args):
+        return self._call("think_stream", args, stream=True)
+
+    def think_batch(self, prompts):
+        return self.client.call("think_batch", prompts)
+
+    def think_candidates(self, prompt: str, n: int, temperature: float = 0.7):
+        return self.client.call("think_candidates", prompt, n, temperature)
+
+    def new_episode(self) -> RemoteEpisode:
+        return RemoteEpisode(self.client.call("new_episode"))
+
+    def server_stats(self):
+        return self.client.call("stats")
+
+
+class RemoteBotLoader(LazyLoader):
+    """
+    LazyLoader of the RemoteBot of a worker process. There is nothing to warm
+    up in the workers nor in the process starting the model server, which
+    loads the model itself: until the RemoteBot is built, `status` reports the
+    loader of the server, so that readiness probes follow the model.
+    """
+
+    def __init__(self, address: tuple[str, int], authkey: bytes):
+        super().__init__(lambda: RemoteBot(address, authkey), "model server")
+        self._client = ModelClient(address, authkey)
+
+    def status(self):
+        if self.ready:
+            return super().status()
+        try:
+            status = self._client.call("stats")["loader"]
+        except (OSError, EOFError) as e:
+            return dict(super().status(), error=repr(e))
+        return dict(status, name=self.name)
@@ -0,0 +1,224 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Read-only tuning: the database is never written by the app, so we can afford
+# a large page cache and memory-mapped I/O shared by every pooled connection.
+# These suit a pool used on its own: the databases of the app get cache_size and
+# mmap_size from the memory budget of src/databases.py instead.
+DEFAULT_PRAGMAS = {
+    "query_only": "ON",
+    "mmap_size": 268435456,  # 256 MiB
+    "cache_size": -65536,  # 64 MiB (negative value is in KiB)
+    "temp_store": "MEMORY",
+}
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class PoolClosedError(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Bounded pool of read-only SQLite connections.
+
+    Connections are opened lazily (up to `size`) with `mode=ro` and the tuned
+    PRAGMAs above, then handed back and forth between threads. When all
+    connections are busy, `acquire` blocks up to `timeout` seconds.
+
+    Once the pool is closed, `acquire` raises PoolClosedError, and connections
+    still checked out are closed when they are released instead of going back
+    to the pool.
+    """
+
+    def __init__(
+        self, db_path: str, size: int = 8, timeout: float = 30.0, pragmas=None
+    ):
+        self.db_path = db_path
+        # SQLite connections must not be used across a fork
+        self.pid = os.getpid()
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._acquired = 0
+        self._reused = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+        self._in_use = 0
+        self._closed = False
+        # Version of self.pragmas each open connection was set up with
+        self._pragmas_version = 0
+        self._versions = {}
+
+    def _connect(self):
+        uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        try:
+            self._set_up(conn)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _set_up(self, conn):
+        """Run the current PRAGMAs on `conn`, unless it already has them."""
+        with self._lock:
+            if self._versions.get(conn) == self._pragmas_version:
+                return
+            pragmas, version = dict(self.pragmas), self._pragmas_version
+        for name, value in pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value};")
+        with self._lock:
+            self._versions[conn] = version
+
+    def set_pragmas(self, **pragmas):
+        """
+        Change PRAGMAs of the pooled connections, e.g. a smaller cache_size to
+        shrink their page caches: idle connections now, the checked out ones
+        when they are released.
+        """
+        with self._lock:
+            self.pragmas.update(pragmas)
+            self._pragmas_version += 1
+        idle = []
+        while True:
+            try:
+                idle.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for conn in idle:
+            self._set_up(conn)
+            self._put_back(conn)
+
+    def _put_back(self, conn):
+        with self._lock:
+            closed = self._closed
+            if closed:
+                self._created -= 1
+                self._versions.pop(conn, None)
+            else:
+                self._idle.put(conn)
+        if closed:
+            conn.close()
+
+    def _check_open(self):
+        if self._closed:
+            raise PoolClosedError(f"Connection pool of {self.db_path} is closed")
+
+    def acquire(self):
+        start = time.perf_counter()
+        reused = True
+        waited = False
+        with self._lock:
+            self._check_open()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self._check_open()
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+
+            if can_create:
+                reused = False
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                waited = True
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise PoolTimeoutError(
+                        f"No SQLite connection available after {self.timeout}s "
+                        f"(pool size: {self.size})"
+                    )
+
+        wait_time = time.perf_counter() - start
+        with self._lock:
+            # Closed while we were connecting or waiting: nobody would close it
+            closed = self._closed
+            if closed:
+                self._created -= 1
+                self._versions.pop(conn, None)
+            else:
+                self._acquired += 1
+                self._in_use += 1
+                if reused:
+                    self._reused += 1
+                if waited:
+                    self._waits += 1
+                self._wait_time += wait_time
+                self._max_wait_time = max(self._max_wait_time, wait_time)
+        if closed:
+            conn.close()
+            self._check_open()
+
+        return conn
+
+    def release(self, conn):
+        # Leave the connection as we found it for the next borrower
+        conn.text_factory = str
+        if conn.in_transaction:
+            conn.rollback()
+
+        with self._lock:
+            self._in_use -= 1
+        if not self._closed:
+            self._set_up(conn)
+        self._put_back(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            acquired = self._acquired
+            return {
+                "db_path": self.db_path,
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "acquired": acquired,
+                "reused": self._reused,
+                "reuse_rate": self._reused / acquired if acquired else 0.0,
+                "waits": self._waits,
+                "avg_wait_ms": 1000 * self._wait_time / acquired if acquired else 0.0,
+                "max_wait_ms": 1000 * self._max_wait_time,
+            }
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+                self._versions.pop(conn, None)
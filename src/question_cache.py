@@ -0,0 +1,161 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_question(question: str) -> str:
+    """
+    Canonical form of a user question used as cache key.
+
+    Case, whitespace and trailing punctuation are ignored, but quoted literals
+    ('ALFKI', "Order Details") are kept verbatim since they end up in the SQL.
+    """
+    question = unicodedata.normalize("NFKC", question).strip()
+    parts = re.split(r"""('[^']*'|"[^"]*")""", question)
+    normalized = []
+    for idx, part in enumerate(parts):
+        if idx % 2 == 0:
+            part = re.sub(r"\s+", " ", part.lower())
+        normalized.append(part)
+    return "".join(normalized).strip().rstrip(".?!; ")
+
+
+def schema_fingerprint(db_schema: str) -> str:
+    return hashlib.sha256(db_schema.encode("utf-8")).hexdigest()[:16]
+
+
+class QuestionCache:
+    """
+    LRU/TTL cache mapping a normalized question to its last validated SQL.
+
+    Entries are tied to the fingerprint of the db schema they were validated
+    against: `set_schema` drops everything as soon as the schema changes.
+    When `path` is given, entries are also persisted in a SQLite file so they
+    survive restarts.
+    """
+
+    def __init__(
+        self,
+        db_schema: str,
+        max_entries: int = 1024,
+        ttl: float | None = 24 * 3600,
+        path: str | None = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.fingerprint = schema_fingerprint(db_schema)
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+        self._conn = None
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS question_cache ("
+                "schema_fingerprint TEXT NOT NULL, "
+                "question TEXT NOT NULL, "
+                "sql_query TEXT NOT NULL, "
+                "created_at REAL NOT NULL, "
+                "PRIMARY KEY (schema_fingerprint, question))"
+            )
+            self._conn.commit()
+            self._load()
+
+    def _load(self):
+        self._conn.execute(
+            "DELETE FROM question_cache WHERE schema_fingerprint != ?",
+            (self.fingerprint,),
+        )
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT question, sql_query, created_at FROM question_cache "
+            "WHERE schema_fingerprint = ? ORDER BY created_at DESC LIMIT ?",
+            (self.fingerprint, self.max_entries),
+        ).fetchall()
+        for question, sql_query, created_at in reversed(rows):
+            if not self._is_expired(created_at):
+                self._entries[question] = (sql_query, created_at)
+
+    def _is_expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def set_schema(self, db_schema: str) -> bool:
+        """Invalidate every entry if `db_schema` differs. Return True if it did."""
+        fingerprint = schema_fingerprint(db_schema)
+        with self._lock:
+            if fingerprint == self.fingerprint:
+                return False
+            self.fingerprint = fingerprint
+            self._entries.clear()
+            self._invalidations += 1
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM question_cache")
+                self._conn.commit()
+        return True
+
+    def get(self, question: str) -> str | None:
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._is_expired(entry[1]):
+                if entry is not None:
+                    self._delete(key)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def put(self, question: str, sql_query: str):
+        key = normalize_question(question)
+        created_at = time.time()
+        with self._lock:
+            self._entries[key] = (sql_query, created_at)
+            self._entries.move_to_end(key)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO question_cache VALUES (?, ?, ?, ?)",
+                    (self.fingerprint, key, sql_query, created_at),
+                )
+                self._conn.commit()
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._delete(oldest)
+
+    def _delete(self, key: str):
+        del self._entries[key]
+        if self._conn is not None:
+            self._conn.execute(
+                "DELETE FROM question_cache "
+                "WHERE schema_fingerprint = ? AND question = ?",
+                (self.fingerprint, key),
+            )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "invalidations": self._invalidations,
+                "schema_fingerprint": self.fingerprint,
+                "persistent": self._conn is not None,
+            }
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -1,16 +1,23 @@
+from contextlib import nullcontext
 from enum import Enum
-from pydantic import BaseModel, Field
 from typing import Union
-import torch
+
 import outlines
 from outlines import samplers
-from outlines import generate
-from outlines.integrations.utils import convert_json_schema_to_str
 from outlines.fsm.json_schema import build_regex_from_schema
+from outlines.generate.api import SequenceGenerator
+from outlines.integrations.utils import convert_json_schema_to_str
+from pydantic import BaseModel, Field
+
+from src.backends import Backend, TransformersBackend
+from src.guide_cache import GUIDE_CACHE_DIR, load_regex_guide
+from src.kv_cache import Episode, PromptCachedTransformers
+from src.tracing import span
 
 
 class Action(str, Enum):
     verify = "verify"
+    preview = "preview"
 
 
 class Reason_and_Act(BaseModel):
@@ -41,8 +48,17 @@ class Decision(BaseModel):
 
 
 class ReactChatBot:
-    def __init__(self, dialect: str, db_schema: str, attempts: int = 5):
+    def __init__(
+        self,
+        dialect: str,
+        db_schema: str,
+        attempts: int = 5,
+        use_prompt_cache: bool = True,
+        guide_cache_dir: str = GUIDE_CACHE_DIR,
+        backend: Backend | None = None,
+    ):
         self.attempts = attempts
+        self.dialect = dialect
         self.schema = Decision.model_json_schema()
         schema_str = convert_json_schema_to_str(json_schema=self.schema)
         self.react_regex_str = build_regex_from_schema(schema_str)
@@ -50,24 +66,117 @@ class ReactChatBot:
 
         self.react_prompt = generate_react_prompt(self.schema, dialect, db_schema)
 
-        self.model = outlines.models.transformers(
-            "mistralai/Mistral-7B-Instruct-v0.3",
-            model_kwargs={"device_map": "auto", "torch_dtype": torch.bfloat16},
-        )
+        if backend is None:
+            backend = TransformersBackend()
+        self.backend = backend
+        # Other engines get the JSON schema and constrain decoding themselves
+        self.native = isinstance(backend, TransformersBackend)
+        if not self.native:
+            return
 
-    def __call__(self, user_prompt: str):
-        return self.think(user_prompt)
+        self.model = PromptCachedTransformers(backend.model, backend.tokenizer)
 
-    def think(self, user_prompt: str):
-        full_prompt = generate_full_prompt(self.react_prompt, user_prompt)
+        # Every step of every episode starts with the same system prompt
+        if use_prompt_cache:
+            self.model.prompt_cache.prime(
+                backend.tokenizer(self.react_prompt)["input_ids"]
+            )
 
-        generator = generate.regex(self.model, self.react_regex_str, samplers.greedy())
-        # generator = generate.regex(
-        #     self.model, self.react_regex_str, samplers.multinomial()
+        # Compiling the Decision regex into an FSM index over the vocabulary is
+        # slow: do it once per process (and once per machine thanks to the
+        # on-disk cache) instead of at every step.
+        guide = load_regex_guide(
+            self.react_regex_str, self.model.tokenizer, guide_cache_dir
+        )
+        self.generator = SequenceGenerator(
+            guide, self.model, samplers.greedy(), self.model.device
+        )
+        # self.generator = SequenceGenerator(
+        #     guide, self.model, samplers.multinomial(), self.model.device
         # )
-        result = generator(full_prompt, max_tokens=4096)
+
+    def __call__(
+        self, user_prompt: str, episode: Episode | None = None, db_schema=None
+    ):
+        return self.think(user_prompt, episode, db_schema)
+
+    def new_episode(self):
+        """Per-question state letting each step only prefill what was appended."""
+        return Episode(self.model.model if self.native else None)
+
+    def _full_prompt(self, user_prompt: str, db_schema=None):
+        react_prompt = self.react_prompt
+        if db_schema is not None:
+            # Schema pruned for this question: the prompt cache still serves
+            # the system instructions preceding it.
+            react_prompt = generate_react_prompt(self.schema, self.dialect, db_schema)
+        return generate_full_prompt(react_prompt, user_prompt)
+
+    def think(self, user_prompt: str, episode: Episode | None = None, db_schema=None):
+        if not self.native:
+            stream = self.think_stream(user_prompt, episode, db_schema)
+            while True:
+                try:
+                    next(stream)
+                except StopIteration as stop:
+                    return stop.value
+
+        full_prompt = self._full_prompt(user_prompt, db_schema)
+        with span("guided_generation") as generation:
+            if episode is None:
+                return self.generator(full_prompt, max_tokens=4096)
+
+            with self.model.episode(episode):
+                result = self.generator(full_prompt, max_tokens=4096)
+            episode.end_step()
+            generation.set(**_step_attrs(episode))
         return result
 
+    def think_stream(
+        self, user_prompt: str, episode: Episode | None = None, db_schema=None
+    ):
+        """
+        Yield the Decision JSON token by token; the generator returns the
+        complete JSON once generation is over.
+        """
+        full_prompt = self._full_prompt(user_prompt, db_schema)
+        if not self.native:
+            return (yield from self._backend_stream(full_prompt, episode))
+
+        context = self.model.episode(episode) if episode is not None else nullcontext()
+        result = ""
+        with span("guided_generation") as generation:
+            with context:
+                for piece in self.generator.stream(full_prompt, max_tokens=4096):
+                    result += piece
+                    yield piece
+            if episode is not None:
+                episode.end_step()
+                generation.set(**_step_attrs(episode))
+        return result
+
+    def _backend_stream(self, full_prompt: str, episode: Episode | None = None):
+        if episode is not None:
+            # No KV cache shared with the engine: the whole prompt is prefilled
+            episode.start_step(self.backend.count_tokens(full_prompt), 0)
+        result = ""
+        with span("guided_generation") as generation:
+            for piece in self.backend.stream(
+                full_prompt, max_tokens=4096, json_schema=self.schema
+            ):
+                result += piece
+                yield piece
+            if episode is not None:
+                episode.steps[-1]["decode_tokens"] = self.backend.count_tokens(result)
+                generation.set(**_step_attrs(episode))
+        return result
+
+
+def _step_attrs(episode: Episode):
+    """Token counts of the episode's last step, `tokens` being the decoded ones."""
+    step = episode.steps[-1]
+    return dict(step, tokens=step["decode_tokens"])
+
 
 @outlines.prompt
 def generate_react_prompt(schema: str, dialect: str, db_schema: str):
@@ -99,12 +208,17 @@ def generate_react_prompt(schema: str, dialect: str, db_schema: str):
         verify:
             e.g. Verify a SQL query: "SELECT * FROM table;"
             Verify a {{ dialect }} query for and returns a boolean and a string
-                - If the query is valid -> True, ""
+                - If the query is valid -> True, "cost of running it (time, VM steps, rows)"
                 - If the quer is invalid -> False, "error message"            
+        preview:
+            e.g. Preview the results of a SQL query: "SELECT * FROM table;"
+            Run a {{ dialect }} query on a sample of its rows and returns
+                - If the query is valid -> the row count, the distinct values per column and the first rows
+                - If the query is invalid -> False, "error message"
     The SQL query MUST have in-line comments to explain what each clause does.
     Some tips to always keep in mind:
     tip1) If the SQL query resulted in errors or not correct results, rewrite the SQL query and try again.
-    tip2) You should always execute the SQL query by calling the verify action to make sure the results are correct.
+    tip2) You should always execute the SQL query by calling the preview action to make sure the results are correct.
     DO NOT TRY TO GUESS THE ANSWER.
     """
 
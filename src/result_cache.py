@@ -0,0 +1,218 @@
+import os
+import pickle
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from src.sql_check import SQL_KEYWORDS, SqlSyntaxError, tokenize
+
+# Words ending the result column list of the outer SELECT
+RESULT_COLUMNS_END = {
+    "except", "from", "group", "having", "intersect", "limit", "order",
+    "union", "where", "window",
+}  # fmt: skip
+
+
+def canonical_sql(sql_query: str) -> str:
+    """
+    Form of a query shared by its spellings: comments, whitespace, the case
+    of keywords and the trailing semicolon are ignored. Identifiers, aliases
+    and string literals are kept as written, and so is the whole result
+    column list, which SQLite names the columns after: `count(*) AS Total`
+    and `COUNT(*) AS total` are different results.
+    """
+    try:
+        tokens = tokenize(sql_query)
+    except SqlSyntaxError:
+        return re.sub(r"\s+", " ", sql_query).strip().rstrip(";").strip()
+    while tokens and tokens[-1].value == ";":
+        tokens.pop()
+
+    words = []
+    depth = 0
+    result_columns = None  # None: before the outer SELECT, then True/False
+    for token in tokens:
+        if token.value == "(":
+            depth += 1
+        elif token.value == ")":
+            depth -= 1
+        keyword = token.kind == "word" and token.value.lower() in SQL_KEYWORDS
+        if keyword and depth == 0:
+            if result_columns is None and token.value.lower() == "select":
+                words.append("select")
+                result_columns = True
+                continue
+            if result_columns and token.value.lower() in RESULT_COLUMNS_END:
+                result_columns = False
+        if keyword and not result_columns:
+            words.append(token.value.lower())
+        else:
+            words.append(token.value)
+    return " ".join(words)
+
+
+class DataVersion:
+    """
+    Detects changes to a SQLite file made by any writer: `PRAGMA
+    data_version` on a connection of our own (it changes when another
+    connection commits), plus the size and mtime of the database and WAL
+    files for a replaced file.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _file_signature(self):
+        signature = []
+        for path in (self.db_path, self.db_path + "-wal"):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                signature.append(None)
+            else:
+                signature.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    def current(self):
+        with self._lock:
+            if self._conn is None or self._pid != os.getpid():
+                # Connections must not be used across a fork
+                uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+                self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                self._pid = os.getpid()
+            data_version = self._conn.execute("PRAGMA data_version;").fetchone()[0]
+        return data_version, self._file_signature()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class ResultCache:
+    """
+    LRU of processed result pages keyed by canonical SQL, offset and limit.
+
+    Rows are stored column by column, pickled, so an entry weighs about what
+    its values do and `max_bytes` bounds the cache exactly; pages heavier
+    than `max_entry_bytes` are not cached. Every lookup first checks the
+    `version` of the data (see DataVersion) and drops the whole cache when it
+    changed.
+    """
+
+    def __init__(
+        self,
+        version: DataVersion,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_entry_bytes: int | None = None,
+    ):
+        self.version = version
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = (
+            max_bytes // 4 if max_entry_bytes is None else max_entry_bytes
+        )
+
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._data_version = None
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    @staticmethod
+    def key(sql_query: str, offset: int, limit: int):
+        return canonical_sql(sql_query), offset, limit
+
+    def _check_version(self):
+        version = self.version.current()
+        if version != self._data_version:
+            if self._data_version is not None and self._entries:
+                self._invalidations += 1
+            self._entries.clear()
+            self._size = 0
+            self._data_version = version
+
+    def get(self, key) -> dict | None:
+        """The page stored under `key`: rows, columns and the page attributes."""
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+        page = pickle.loads(entry)
+        page["rows"] = [list(row) for row in zip(*page.pop("values"))]
+        return page
+
+    def put(self, key, rows, columns, data_version=None, **attrs) -> bool:
+        """
+        Store a page; `attrs` are given back by `get`. `data_version` is the
+        version the query started on: the page is dropped if the data changed
+        while it ran. Returns True if cached.
+        """
+        entry = self._encode(rows, columns, attrs)
+        if len(entry) > self.max_entry_bytes:
+            return False
+        with self._lock:
+            self._check_version()
+            if data_version is not None and data_version != self._data_version:
+                return False
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._entries[key] = entry
+            self._size += len(entry)
+            self._evict()
+        return True
+
+    def resize(self, max_bytes: int, max_entry_bytes: int | None = None):
+        """Change the budget, evicting the least recently used pages beyond it."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self.max_entry_bytes = (
+                max_bytes // 4 if max_entry_bytes is None else max_entry_bytes
+            )
+            self._evict()
+
+    def _evict(self):
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self._evictions += 1
+
+    @staticmethod
+    def _encode(rows, columns, attrs) -> bytes:
+        values = [tuple(row[idx] for row in rows) for idx in range(len(columns))]
+        return pickle.dumps(
+            dict(attrs, columns=columns, values=values), pickle.HIGHEST_PROTOCOL
+        )
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= len(entry)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+            }
@@ -0,0 +1,254 @@
+import dataclasses
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from dataclasses import dataclass, field
+
+
+@dataclass
+class Column:
+    name: str
+    type: str
+    not_null: bool = False
+    default: str | None = None
+    primary_key: bool = False
+
+
+@dataclass
+class ForeignKey:
+    column: str
+    ref_table: str
+    ref_column: str | None
+
+
+@dataclass
+class Index:
+    name: str
+    columns: list[str]
+    unique: bool = False
+
+
+@dataclass
+class Table:
+    name: str
+    columns: list[Column] = field(default_factory=list)
+    foreign_keys: list[ForeignKey] = field(default_factory=list)
+    indexes: list[Index] = field(default_factory=list)
+    row_count: int | None = None
+
+    @property
+    def primary_key(self) -> list[str]:
+        return [column.name for column in self.columns if column.primary_key]
+
+    def column(self, name: str) -> Column | None:
+        name = name.lower()
+        for column in self.columns:
+            if column.name.lower() == name:
+                return column
+        return None
+
+
+@dataclass
+class Schema:
+    tables: list[Table] = field(default_factory=list)
+    version: int | None = None
+
+    def table(self, name: str) -> Table | None:
+        """Case-insensitive lookup, as SQLite resolves identifiers."""
+        name = name.lower()
+        for table in self.tables:
+            if table.name.lower() == name:
+                return table
+        return None
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            tables=[
+                Table(
+                    name=table["name"],
+                    columns=[Column(**c) for c in table["columns"]],
+                    foreign_keys=[ForeignKey(**fk) for fk in table["foreign_keys"]],
+                    indexes=[Index(**idx) for idx in table["indexes"]],
+                    row_count=table["row_count"],
+                )
+                for table in data["tables"]
+            ],
+            version=data["version"],
+        )
+
+
+_TABLES_FILTER = "m.type = 'table' AND m.name NOT LIKE 'sqlite_%'"
+
+
+def introspect(conn) -> Schema:
+    """
+    Build the schema model with one query per kind of metadata, using the
+    pragma table-valued functions instead of one PRAGMA per table.
+    """
+    tables = {}
+    for (name,) in conn.execute(
+        f"SELECT m.name FROM sqlite_master AS m WHERE {_TABLES_FILTER}"
+    ):
+        tables[name] = Table(name=name)
+
+    for table_name, name, data_type, not_null, default, pk in conn.execute(
+        'SELECT m.name, p.name, p.type, p."notnull", p.dflt_value, p.pk '
+        "FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p "
+        f"WHERE {_TABLES_FILTER}"
+    ):
+        tables[table_name].columns.append(
+            Column(name, data_type, bool(not_null), default, bool(pk))
+        )
+
+    for table_name, ref_table, column, ref_column in conn.execute(
+        'SELECT m.name, f."table", f."from", f."to" '
+        "FROM sqlite_master AS m JOIN pragma_foreign_key_list(m.name) AS f "
+        f"WHERE {_TABLES_FILTER}"
+    ):
+        tables[table_name].foreign_keys.append(
+            ForeignKey(column, ref_table, ref_column)
+        )
+
+    indexes = {}
+    for table_name, index_name, unique, column in conn.execute(
+        'SELECT m.name, il.name, il."unique", ii.name '
+        "FROM sqlite_master AS m JOIN pragma_index_list(m.name) AS il "
+        "JOIN pragma_index_info(il.name) AS ii "
+        f"WHERE {_TABLES_FILTER} ORDER BY m.name, il.name, ii.seqno"
+    ):
+        if (table_name, index_name) not in indexes:
+            index = Index(index_name, [], bool(unique))
+            indexes[(table_name, index_name)] = index
+            tables[table_name].indexes.append(index)
+        indexes[(table_name, index_name)].columns.append(column)
+
+    for table_name, row_count in estimate_row_counts(conn, tables).items():
+        tables[table_name].row_count = row_count
+
+    version = conn.execute("PRAGMA schema_version;").fetchone()[0]
+    return Schema(list(tables.values()), version)
+
+
+def estimate_row_counts(conn, tables):
+    """
+    Row counts from ANALYZE statistics when available, else max(rowid),
+    which SQLite answers from the b-tree without scanning the table.
+    """
+    counts = {}
+    has_stats = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+    ).fetchone()
+    if has_stats:
+        for table_name, stat in conn.execute("SELECT tbl, stat FROM sqlite_stat1"):
+            if table_name in tables and table_name not in counts:
+                counts[table_name] = int(stat.split()[0])
+
+    for table_name in tables:
+        if table_name in counts:
+            continue
+        quoted = table_name.replace('"', '""')
+        try:
+            row = conn.execute(f'SELECT max(rowid) FROM "{quoted}"').fetchone()
+            counts[table_name] = row[0] or 0
+        except sqlite3.OperationalError:
+            # WITHOUT ROWID tables
+            counts[table_name] = None
+    return counts
+
+
+def render_schema(schema: Schema) -> str:
+    """Prompt representation of the schema."""
+    text = ""
+    for table in schema.tables:
+        text += f'Table: "{table.name}"\n'
+        text += "Columns:\n"
+        for column in table.columns:
+            text += f"  - {column.name} ({column.type})"
+            if column.primary_key:
+                text += " [PRIMARY KEY]"
+            if column.not_null and not column.primary_key:
+                text += " NOT NULL"
+            if column.default is not None:
+                text += f" DEFAULT {column.default}"
+            text += "\n"
+
+        if table.foreign_keys:
+            text += "Foreign Keys:\n"
+            for fk in table.foreign_keys:
+                text += f"  - FOREIGN KEY ({fk.column}) REFERENCES {fk.ref_table}({fk.ref_column})\n"
+
+        text += "\n"
+    return text
+
+
+class SchemaCache:
+    """
+    Schema model of one database file, cached in memory and on disk.
+
+    Entries are keyed on `PRAGMA schema_version` and the file mtime, so a
+    restart on an unchanged database loads the JSON dump instead of
+    introspecting, while any DDL (or write, for the row counts) rebuilds it.
+    """
+
+    def __init__(self, db_path: str, cache_dir: str | None = None):
+        self.db_path = db_path
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._key = None
+        self._schema = None
+
+    def _cache_path(self):
+        path_hash = hashlib.sha256(
+            os.path.abspath(self.db_path).encode("utf-8")
+        ).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{path_hash}.json")
+
+    def _current_key(self, conn):
+        version = conn.execute("PRAGMA schema_version;").fetchone()[0]
+        try:
+            mtime = os.stat(self.db_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        return [version, mtime]
+
+    def get(self, conn) -> Schema:
+        key = self._current_key(conn)
+        with self._lock:
+            if key == self._key:
+                return self._schema
+
+            schema = self._load(key)
+            if schema is None:
+                schema = introspect(conn)
+                self._save(key, schema)
+            self._key = key
+            self._schema = schema
+            return schema
+
+    def _load(self, key):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._cache_path()) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("key") != key:
+            return None
+        return Schema.from_dict(data["schema"])
+
+    def _save(self, key, schema):
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"key": key, "schema": schema.to_dict()}, f)
+        os.replace(tmp_path, self._cache_path())
@@ -0,0 +1,232 @@
+import math
+import re
+import threading
+from collections import defaultdict
+from collections.abc import Callable
+
+from src.schema import Schema, Table, render_schema
+
+STOPWORDS = {
+    "a", "all", "an", "and", "any", "are", "as", "at", "be", "by", "did", "do",
+    "does", "each", "every", "find", "for", "from", "get", "give", "have", "how",
+    "in", "is", "it", "list", "many", "me", "much", "of", "on", "or", "per",
+    "show", "that", "the", "their", "them", "there", "these", "this", "those",
+    "to", "was", "were", "what", "when", "where", "which", "who", "whose",
+    "with",
+}  # fmt: skip
+
+TABLE_NAME_WEIGHT = 3.0
+COLUMN_NAME_WEIGHT = 1.0
+FK_DECAY = 0.5
+
+
+def approx_token_count(text: str) -> int:
+    """Cheap tokenizer-free estimate (~4 characters per token)."""
+    return (len(text) + 3) // 4
+
+
+def _stem(word: str) -> str:
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def identifier_terms(name: str) -> list[str]:
+    """Split `OrderDetails`, `order_details` or `Order Details` into stems."""
+    name = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", name)
+    return [_stem(word) for word in re.findall(r"[a-z0-9]+", name.lower())]
+
+
+def question_terms(question: str) -> list[str]:
+    words = re.findall(r"[a-z0-9]+", question.lower())
+    return [_stem(word) for word in words if word not in STOPWORDS]
+
+
+class SchemaLinker:
+    """
+    Select the part of the schema relevant to a question.
+
+    Tables are scored lexically: every question term found in a table name or
+    in one of its column names adds its IDF weight (names are the "documents"),
+    table-name hits counting more. Each matched table then passes a decayed
+    share of its score to its foreign-key neighbours so join tables and
+    lookup tables come along. Tables are added by decreasing score while the
+    rendered schema fits in `max_tokens`; a table that does not fit in full
+    is kept with only its key and matched columns.
+
+    When no term matches anything the full schema is returned.
+    """
+
+    def __init__(
+        self,
+        schema: Schema,
+        max_tokens: int | None = None,
+        count_tokens: Callable[[str], int] = approx_token_count,
+        fk_hops: int = 1,
+    ):
+        self.schema = schema
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+        self.fk_hops = fk_hops
+
+        self._table_terms = {}
+        self._column_terms = {}
+        document_frequency = defaultdict(int)
+        n_documents = 0
+        for table in schema.tables:
+            self._table_terms[table.name] = set(identifier_terms(table.name))
+            documents = [self._table_terms[table.name]]
+            for column in table.columns:
+                terms = set(identifier_terms(column.name))
+                self._column_terms[(table.name, column.name)] = terms
+                documents.append(terms)
+            for terms in documents:
+                n_documents += 1
+                for term in terms:
+                    document_frequency[term] += 1
+        self._idf = {
+            term: math.log(1 + n_documents / df)
+            for term, df in document_frequency.items()
+        }
+
+        self._neighbours = defaultdict(set)
+        for table in schema.tables:
+            for fk in table.foreign_keys:
+                ref_table = schema.table(fk.ref_table)
+                if ref_table is not None and ref_table.name != table.name:
+                    self._neighbours[table.name].add(ref_table.name)
+                    self._neighbours[ref_table.name].add(table.name)
+
+        self._full_schema_tokens = count_tokens(render_schema(schema))
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._full_tokens = 0
+        self._linked_tokens = 0
+        self._fallbacks = 0
+
+    def score(self, question: str) -> dict[str, float]:
+        """Relevance of every table to `question` (0 for unrelated tables)."""
+        terms = set(question_terms(question))
+        scores = {}
+        for table in self.schema.tables:
+            score = 0.0
+            for term in terms & self._table_terms[table.name]:
+                score += TABLE_NAME_WEIGHT * self._idf[term]
+            for term in terms:
+                if any(
+                    term in self._column_terms[(table.name, column.name)]
+                    for column in table.columns
+                ):
+                    score += COLUMN_NAME_WEIGHT * self._idf[term]
+            scores[table.name] = score
+
+        frontier = {name: score for name, score in scores.items() if score > 0}
+        for _ in range(self.fk_hops):
+            spread = defaultdict(float)
+            for name, score in frontier.items():
+                for neighbour in self._neighbours[name]:
+                    if scores[neighbour] == 0:
+                        # Summed, so tables bridging several matches rank higher
+                        spread[neighbour] += FK_DECAY * score
+            for name, score in spread.items():
+                scores[name] = score
+            frontier = spread
+        return scores
+
+    def matched_columns(self, question: str, table: Table) -> list[str]:
+        terms = set(question_terms(question))
+        return [
+            column.name
+            for column in table.columns
+            if terms & self._column_terms[(table.name, column.name)]
+        ]
+
+    def link(self, question: str) -> Schema:
+        scores = self.score(question)
+        ranked = sorted(
+            (table for table in self.schema.tables if scores[table.name] > 0),
+            key=lambda table: -scores[table.name],
+        )
+        if not ranked:
+            self._record(self.schema, fallback=True)
+            return self.schema
+
+        selected = {}
+        used_tokens = 0
+        for table in ranked:
+            candidates = [table, self._reduce(question, table)]
+            for candidate in candidates:
+                cost = self.count_tokens(render_schema(Schema([candidate])))
+                if self.max_tokens is None or used_tokens + cost <= self.max_tokens:
+                    break
+            else:
+                if selected:
+                    continue
+                # Always keep the best match, even over budget
+                candidate = candidates[-1]
+                cost = self.count_tokens(render_schema(Schema([candidate])))
+            selected[table.name] = candidate
+            used_tokens += cost
+
+        tables = []
+        for table in self.schema.tables:
+            if table.name in selected:
+                tables.append(self._drop_dangling_keys(selected[table.name], selected))
+        linked = Schema(tables, self.schema.version)
+        self._record(linked)
+        return linked
+
+    def _reduce(self, question: str, table: Table) -> Table:
+        """Keep primary/foreign key columns and those matching the question."""
+        keep = set(self.matched_columns(question, table))
+        keep.update(table.primary_key)
+        keep.update(fk.column for fk in table.foreign_keys)
+        return Table(
+            name=table.name,
+            columns=[column for column in table.columns if column.name in keep],
+            foreign_keys=table.foreign_keys,
+            indexes=table.indexes,
+            row_count=table.row_count,
+        )
+
+    def _drop_dangling_keys(self, table: Table, selected) -> Table:
+        selected = {name.lower() for name in selected}
+        foreign_keys = [
+            fk for fk in table.foreign_keys if fk.ref_table.lower() in selected
+        ]
+        if len(foreign_keys) == len(table.foreign_keys):
+            return table
+        return Table(
+            table.name, table.columns, foreign_keys, table.indexes, table.row_count
+        )
+
+    def _record(self, linked: Schema, fallback: bool = False):
+        full_tokens = self._full_schema_tokens
+        linked_tokens = (
+            full_tokens if fallback else self.count_tokens(render_schema(linked))
+        )
+        with self._lock:
+            self._calls += 1
+            self._full_tokens += full_tokens
+            self._linked_tokens += linked_tokens
+            self._fallbacks += int(fallback)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tables": len(self.schema.tables),
+                "max_tokens": self.max_tokens,
+                "calls": self._calls,
+                "fallbacks": self._fallbacks,
+                "avg_full_tokens": self._full_tokens / self._calls
+                if self._calls
+                else 0.0,
+                "avg_linked_tokens": self._linked_tokens / self._calls
+                if self._calls
+                else 0.0,
+                "token_reduction": 1 - self._linked_tokens / self._full_tokens
+                if self._full_tokens
+                else 0.0,
+            }
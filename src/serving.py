@@ -0,0 +1,202 @@
+import logging
+from collections.abc import Callable
+
+from src.fewshot import ExampleStore
+from src.model_server import RemoteBot
+from src.question_cache import QuestionCache
+from src.schema import render_schema
+from src.schema_linking import SchemaLinker
+from src.simple import get_base_prompt
+from src.tracing import span, tracer
+from src.utils import (
+    database_stats,
+    get_blob_store,
+    get_database,
+    pool_stats,
+    result_cache_stats,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseStates:
+    """
+    Settings of the state an app keeps for each database, and its `build`
+    for Database.state. Without `examples`, validated answers are not kept as
+    few-shot examples (the ReAct agent does not use them).
+    """
+
+    def __init__(
+        self,
+        dialect: str,
+        question_cache_path: str | None = None,
+        examples: bool = True,
+        fewshot_k: int = 0,
+        fewshot_method: str = "hashed",
+        fewshot_path: str | None = None,
+        fewshot_seed_paths: dict[str, str] | None = None,
+        schema_pruning: bool = False,
+        schema_token_budget: int = 2048,
+    ):
+        self.dialect = dialect
+        self.question_cache_path = question_cache_path
+        self.examples = examples
+        self.fewshot_k = fewshot_k
+        self.fewshot_method = fewshot_method
+        self.fewshot_path = fewshot_path
+        self.fewshot_seed_paths = fewshot_seed_paths or {}
+        self.schema_pruning = schema_pruning
+        self.schema_token_budget = schema_token_budget
+
+    def __call__(self, database) -> "DatabaseState":
+        return DatabaseState(database, self)
+
+    def current(self) -> "DatabaseState":
+        """DatabaseState of the database of the current `use_database` block."""
+        return get_database().state(self)
+
+
+class DatabaseState:
+    """Schema prompt, question cache, examples and schema linker of a database."""
+
+    def __init__(self, database, settings: DatabaseStates):
+        self.database = database
+        self.settings = settings
+        self.schema_version = database.schema_version()
+        self.db_schema = render_schema(database.schema())
+        # Persisted caches get a file per database, e.g. question_cache.northwind.db
+        self.question_cache = QuestionCache(
+            self.db_schema, path=database.file_for(settings.question_cache_path)
+        )
+        self.example_store = None
+        if settings.examples:
+            self.example_store = ExampleStore(
+                self.db_schema,
+                settings.fewshot_method,
+                path=database.file_for(settings.fewshot_path),
+            )
+            self.seed_examples()
+        self.schema_linker = SchemaLinker(
+            database.schema(), settings.schema_token_budget
+        )
+
+    def seed_examples(self):
+        seed_path = self.settings.fewshot_seed_paths.get(self.database.name)
+        if seed_path is not None:
+            self.example_store.load_json(seed_path)
+
+    def refresh(self):
+        """Re-scan the schema if it changed on disk, dropping stale cached SQL."""
+        version = self.database.schema_version()
+        if version != self.schema_version:
+            logger.info(
+                "Schema of %s changed, invalidating question cache", self.database.name
+            )
+            self.schema_version = version
+            self.db_schema = render_schema(self.database.schema())
+            self.question_cache.set_schema(self.db_schema)
+            if self.example_store is not None and self.example_store.set_schema(
+                self.db_schema
+            ):
+                self.seed_examples()
+            self.schema_linker = SchemaLinker(
+                self.database.schema(), self.settings.schema_token_budget
+            )
+
+    def prompt_schema(self, user_input):
+        if not self.settings.schema_pruning:
+            return self.db_schema
+        return render_schema(self.schema_linker.link(user_input))
+
+    def base_prompt_for(self, user_input):
+        examples = []
+        if self.example_store is not None and self.settings.fewshot_k:
+            with span("fewshot_search") as search:
+                examples = self.example_store.search(
+                    user_input, self.settings.fewshot_k
+                )
+                search.set(examples=len(examples))
+        return get_base_prompt(
+            self.settings.dialect, self.prompt_schema(user_input), user_input, examples
+        )
+
+    def answer_events(self, user_input: str, flow: str, events: Callable):
+        """
+        The (event, data) pairs answering `user_input`: "done" with the cached
+        SQL of a repeated question, else those of `events()`, a flow of
+        src/flows.py. Its valid answers are cached, and become examples.
+        """
+        self.refresh()
+        sql_query = self.question_cache.get(user_input)
+        if sql_query is not None:
+            logger.info(f"\x1b[33m Question cache hit: {sql_query}\x1b[0m")
+            tracer.count("questions", flow=flow, outcome="cache_hit")
+            yield "done", {"sql_query": sql_query, "cached": True}
+            return
+
+        for event, data in events():
+            if event == "done":
+                self.question_cache.put(user_input, data["sql_query"])
+                if self.example_store is not None:
+                    self.example_store.put(user_input, data["sql_query"])
+                tracer.count("questions", flow=flow, outcome="valid")
+            elif event == "failed":
+                tracer.count("questions", flow=flow, outcome="failed")
+            yield event, data
+
+    def close(self):
+        self.question_cache.close()
+        if self.example_store is not None:
+            self.example_store.close()
+
+
+def failure_display(data) -> str:
+    """HTML error of a "failed" event."""
+    return (
+        f"Failed to generate a valid SQL query after {data['attempts']} attempts.<br><br>"
+        f"<strong>Last attempted SQL query:</strong><br><pre>{data['sql_query']}</pre><br>"
+        f"<strong>Error message:</strong><br>{data['message']}"
+    )
+
+
+def blob_response(digest: str, if_none_match: str | None = None):
+    """(body, status, headers) answering GET /blob/<digest>."""
+    entry = get_blob_store().get(digest)
+    if entry is None:
+        return b"Not Found", 404, {"Content-Type": "text/plain"}
+
+    etag = f'"{digest}"'
+    headers = {
+        "ETag": etag,
+        # The URL is the content hash: the bytes behind it can never change
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if if_none_match == etag:
+        return b"", 304, headers
+    data, mime_type = entry
+    return data, 200, dict(headers, **{"Content-Type": mime_type})
+
+
+def stats_sources(states: DatabaseStates, bot_loader) -> dict[str, Callable]:
+    """
+    Functions returning the stats served as JSON by GET /stats/<name>, run in
+    the `use_database` block of the `db` query parameter. Apps add their own.
+    """
+
+    def model_server_stats():
+        bot = bot_loader.peek()
+        return bot.server_stats() if isinstance(bot, RemoteBot) else {}
+
+    sources = {
+        "databases": database_stats,
+        "pool": pool_stats,
+        "blobs": lambda: get_blob_store().stats(),
+        "result_cache": result_cache_stats,
+        "question_cache": lambda: states.current().question_cache.stats(),
+        "schema_linking": lambda: states.current().schema_linker.stats(),
+        "model_server": model_server_stats,
+        "traces": tracer.traces,
+    }
+    if states.examples:
+        sources["fewshot"] = lambda: states.current().example_store.stats()
+    return sources
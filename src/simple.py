@@ -1,41 +1,287 @@
-from typing import List
 import re
-import torch
+import threading
+import time
+from contextvars import copy_context
+from typing import List
+
 import outlines
-from transformers import AutoTokenizer, AutoModelForCausalLM
+import torch
+from transformers import StoppingCriteriaList, TextIteratorStreamer
+
+from src.backends import Backend, TransformersBackend
+from src.kv_cache import PromptCache
+from src.stopping import SqlBlockStoppingCriteria, StoppingStats, sql_block_complete
+from src.tracing import span, tracer
+
+MAX_LENGTH = 4096
+# Generation budget of the text backends, which count new tokens only
+MAX_NEW_TOKENS = 1024
 
 
 class SimpleChatBot:
-    def __init__(self, dialect: str, db_schema: str, attempts: int, logger):
+    def __init__(
+        self,
+        dialect: str,
+        db_schema: str,
+        attempts: int,
+        logger,
+        use_prompt_cache: bool = True,
+        backend: Backend | None = None,
+    ):
         self.attempts = attempts
         self.logger = logger
+        self.stopping_stats = StoppingStats()
 
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            # "mistralai/Mamba-Codestral-7B-v0.1",
-            "mistralai/Mistral-7B-Instruct-v0.3",
-            padding_side="left",
-        )
+        if backend is None:
+            backend = TransformersBackend()
+        self.backend = backend
+        # Other engines only complete text: no prompt cache nor batching
+        self.native = isinstance(backend, TransformersBackend)
+        if not self.native:
+            return
 
-        self.model = AutoModelForCausalLM.from_pretrained(
-            # "mistralai/Mamba-Codestral-7B-v0.1",
-            "mistralai/Mistral-7B-Instruct-v0.3",
-            device_map="auto",
-            torch_dtype=torch.bfloat16,
-        )
+        self.tokenizer = backend.tokenizer
+        self.model = backend.model
+
+        # The system instructions and the db schema are the same for every
+        # question and every retry: prefill them once and resume from there.
+        self.prompt_cache = PromptCache(self.model)
+        if use_prompt_cache:
+            prefix = get_base_prompt(dialect, db_schema, "")
+            self.prompt_cache.prime(self.tokenizer(prefix)["input_ids"])
 
     def __call__(self, user_prompt: str):
         return self.think(user_prompt)
 
+    def count_tokens(self, text: str) -> int:
+        return self.backend.count_tokens(text)
+
     def think(self, prompt: str):
+        if not self.native:
+            return self._extract_sql_from_output(self._complete(prompt))
+
         with torch.inference_mode():
-            model_inputs = self.tokenizer(prompt, return_tensors="pt").to("cuda")
-            generated_ids = self.model.generate(**model_inputs, max_length=4096)
-            completion = self.tokenizer.batch_decode(
-                generated_ids, skip_special_tokens=True
-            )[0]
+            model_inputs = self._tokenize(prompt)
+            past_key_values, reused = self.prompt_cache.lookup(
+                model_inputs["input_ids"]
+            )
+            stopping = self._stopping_criteria(model_inputs)
+            generated_ids = self.model.generate(
+                **model_inputs,
+                past_key_values=past_key_values,
+                max_length=MAX_LENGTH,
+                stopping_criteria=StoppingCriteriaList([stopping]),
+            )
+            new_ids = self._new_tokens(stopping, generated_ids, reused)
+            completion = self.tokenizer.decode(new_ids[0], skip_special_tokens=True)
             sql_query = self._extract_sql_from_output(completion)
         return sql_query
 
+    def think_stream(self, prompt: str):
+        """
+        Yield the completion piece by piece as it is decoded; the generator
+        returns the extracted SQL query once generation is over.
+        """
+        if not self.native:
+            completion = yield from self._stream(prompt)
+            return self._extract_sql_from_output(completion)
+
+        model_inputs = self._tokenize(prompt)
+        past_key_values, reused = self.prompt_cache.lookup(model_inputs["input_ids"])
+        stopping = self._stopping_criteria(model_inputs)
+        streamer = TextIteratorStreamer(
+            self.tokenizer, skip_prompt=True, skip_special_tokens=True
+        )
+
+        def generate():
+            with torch.inference_mode():
+                generated_ids = self.model.generate(
+                    **model_inputs,
+                    past_key_values=past_key_values,
+                    max_length=MAX_LENGTH,
+                    stopping_criteria=StoppingCriteriaList([stopping]),
+                    streamer=streamer,
+                )
+            self._new_tokens(stopping, generated_ids, reused)
+
+        # The copied context keeps the spans of the thread in the request's trace
+        thread = threading.Thread(
+            target=copy_context().run, args=(generate,), daemon=True
+        )
+        thread.start()
+        completion = ""
+        for piece in streamer:
+            completion += piece
+            yield piece
+        thread.join()
+        return self._extract_sql_from_output(completion)
+
+    def think_batch(self, prompts: list[str]):
+        """Generate the SQL queries of several prompts in one padded batch."""
+        if len(prompts) == 1 or not self.native:
+            # Nothing to batch with, or an engine that cannot batch
+            return [self.think(prompt) for prompt in prompts]
+
+        with torch.inference_mode():
+            model_inputs = self._tokenize(prompts, padding=True)
+            past_key_values, reused = self._reuse_batch_prefix(model_inputs)
+            stopping = self._stopping_criteria(model_inputs)
+            generated_ids = self.model.generate(
+                **model_inputs,
+                past_key_values=past_key_values,
+                max_length=MAX_LENGTH,
+                pad_token_id=self.tokenizer.pad_token_id,
+                stopping_criteria=StoppingCriteriaList([stopping]),
+            )
+            new_ids = self._new_tokens(stopping, generated_ids, reused)
+            completions = self.tokenizer.batch_decode(new_ids, skip_special_tokens=True)
+        return [self._extract_sql_from_output(c) for c in completions]
+
+    def think_candidates(self, prompt: str, n: int, temperature: float = 0.7):
+        """Sample `n` SQL queries for one prompt in a single batched generate call."""
+        if not self.native:
+            return [
+                self._extract_sql_from_output(self._complete(prompt, temperature))
+                for _ in range(n)
+            ]
+
+        with torch.inference_mode():
+            model_inputs = self._tokenize(prompt)
+            past_key_values, reused = self.prompt_cache.lookup(
+                model_inputs["input_ids"]
+            )
+            if past_key_values is not None:
+                # generate expands the inputs to n rows, not the cache
+                past_key_values.batch_repeat_interleave(n)
+            stopping = self._stopping_criteria(model_inputs)
+            generated_ids = self.model.generate(
+                **model_inputs,
+                past_key_values=past_key_values,
+                do_sample=True,
+                temperature=temperature,
+                num_return_sequences=n,
+                max_length=MAX_LENGTH,
+                pad_token_id=self.tokenizer.pad_token_id,
+                stopping_criteria=StoppingCriteriaList([stopping]),
+            )
+            new_ids = self._new_tokens(stopping, generated_ids, reused)
+            completions = self.tokenizer.batch_decode(new_ids, skip_special_tokens=True)
+        return [self._extract_sql_from_output(c) for c in completions]
+
+    def _stream(self, prompt: str, temperature: float = 0.0):
+        """
+        Stream a completion from a text backend, stopping once the sql block
+        is complete; returns the whole completion.
+        """
+        completion = ""
+        start = first_piece_at = time.perf_counter()
+        pieces = self.backend.stream(prompt, MAX_NEW_TOKENS, temperature)
+        try:
+            for piece in pieces:
+                if not completion:
+                    first_piece_at = time.perf_counter()
+                completion += piece
+                yield piece
+                if sql_block_complete(completion.lower()):
+                    break
+        finally:
+            pieces.close()
+        generated = self.backend.count_tokens(completion)
+        # The engine prefills the prompt before the first piece comes out
+        tracer.record(
+            "prefill",
+            first_piece_at - start,
+            start,
+            tokens=self.backend.count_tokens(prompt),
+            reused_tokens=0,
+        )
+        tracer.record(
+            "decode",
+            time.perf_counter() - first_piece_at,
+            first_piece_at,
+            tokens=generated,
+        )
+        if sql_block_complete(completion.lower()):
+            self.stopping_stats.record_generated(generated, MAX_NEW_TOKENS)
+        else:
+            self.stopping_stats.record_generated(generated)
+        return completion
+
+    def _complete(self, prompt: str, temperature: float = 0.0):
+        stream = self._stream(prompt, temperature)
+        while True:
+            try:
+                next(stream)
+            except StopIteration as stop:
+                return stop.value
+
+    def _tokenize(self, prompt, **kwargs):
+        with span("tokenize") as tokenizing:
+            model_inputs = self.tokenizer(prompt, return_tensors="pt", **kwargs)
+            tokenizing.set(tokens=model_inputs["input_ids"].numel())
+        return model_inputs.to(self.model.device)
+
+    def _reuse_batch_prefix(self, model_inputs):
+        """
+        The prompt cache repeated for each row of a left-padded batch, whose
+        rows are moved in place to resume from it: the shared prefix first,
+        then the padding, then the rest of each prompt. The attention mask
+        skips the padding, and positions follow the mask, so each row is
+        decoded as if it were alone.
+        """
+        input_ids = model_inputs["input_ids"]
+        attention_mask = model_inputs["attention_mask"]
+        rows = [
+            ids[mask.bool()].tolist() for ids, mask in zip(input_ids, attention_mask)
+        ]
+        past_key_values, reused = self.prompt_cache.lookup_batch(rows)
+        if past_key_values is None:
+            return None, 0
+
+        width = input_ids.shape[1]
+        pad_id = self.tokenizer.pad_token_id
+        padded_ids, padded_mask = [], []
+        for row in rows:
+            padding = width - len(row)
+            padded_ids.append(row[:reused] + [pad_id] * padding + row[reused:])
+            padded_mask.append([1] * reused + [0] * padding + [1] * (len(row) - reused))
+        model_inputs["input_ids"] = torch.tensor(padded_ids, device=input_ids.device)
+        model_inputs["attention_mask"] = torch.tensor(
+            padded_mask, device=attention_mask.device
+        )
+        return past_key_values, reused
+
+    def _stopping_criteria(self, model_inputs):
+        prompt_length = model_inputs["input_ids"].shape[1]
+        return SqlBlockStoppingCriteria(self.tokenizer, prompt_length)
+
+    def _new_tokens(self, stopping, generated_ids, reused: int = 0):
+        """
+        Ids following the prompt: only those are decoded, so the fences of the
+        prompt itself are never mistaken for the answer. Also records the
+        prefill and decode spans of the generation, split at the first step.
+        """
+        new_ids = generated_ids[:, stopping.prompt_length :]
+        pad_id = self.tokenizer.pad_token_id
+        self.stopping_stats.record(stopping, new_ids, MAX_LENGTH, pad_id)
+
+        now = time.perf_counter()
+        first_step_at = stopping.first_step_at or now
+        tracer.record(
+            "prefill",
+            first_step_at - stopping.started_at,
+            stopping.started_at,
+            tokens=new_ids.shape[0] * (stopping.prompt_length - reused),
+            reused_tokens=reused,
+        )
+        tracer.record(
+            "decode",
+            now - first_step_at,
+            first_step_at,
+            tokens=int((new_ids != pad_id).sum()),
+        )
+        return new_ids
+
     def _extract_sql_from_output(self, generated_text):
         self.logger.debug("Extracting SQL from model output")
 
@@ -46,18 +292,19 @@ class SimpleChatBot:
             generated_text = generated_text[
                 sql_start + len("**Generated SQL Query:**") :
             ].strip()
-            matches = re.search(pattern, generated_text, re.DOTALL | re.IGNORECASE)
-            if matches:
-                sql_code = matches.group(1).strip()
-                return sql_code
-            else:
-                return generated_text
+
+        # Completions are decoded without the prompt: the marker is usually
+        # absent and the first sql block is the answer
+        matches = re.search(pattern, generated_text, re.DOTALL | re.IGNORECASE)
+        if matches:
+            sql_code = matches.group(1).strip()
+            return sql_code
         else:
             return generated_text
 
 
 @outlines.prompt
-def get_base_prompt(dialect: str, db_schema: str, user_input: str):
+def get_base_prompt(dialect: str, db_schema: str, user_input: str, examples=()):
     """
     You are an agent designed to interact with a SQL database to find a correct SQL query for the given question.
     Given an input question, generate a syntactically correct {{ dialect }} query.
@@ -78,6 +325,17 @@ def get_base_prompt(dialect: str, db_schema: str, user_input: str):
     **Database Schema:**
 
     {{ db_schema }}
+    {% if examples|length > 0 %}
+
+    **Fewshot Examples:**
+    {% for example in examples %}
+
+    Question: {{ example.question }}
+    ```sql
+    {{ example.sql_query }}
+    ```
+    {% endfor %}
+    {% endif %}
 
     **User Question:**
 
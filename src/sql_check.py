@@ -0,0 +1,410 @@
+import difflib
+import itertools
+import re
+from collections import namedtuple
+
+from src.schema import Schema
+
+Token = namedtuple("Token", ["kind", "value", "start"])
+
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<space>\s+)
+    | (?P<comment>--[^\n]*|/\*.*?(?:\*/|\Z))
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<quoted>"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])
+    | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    | (?P<param>[?:@$][A-Za-z0-9_]*)
+    | (?P<punct>\|\||<<|>>|<=|>=|==|!=|<>|[-+*/%&|~<>=(),.;])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+WRITE_KEYWORDS = {
+    "alter", "analyze", "attach", "begin", "commit", "create", "delete",
+    "detach", "drop", "end", "insert", "pragma", "reindex", "release",
+    "replace", "rollback", "savepoint", "update", "vacuum",
+}  # fmt: skip
+
+# Words that can follow a table reference and are not its alias
+CLAUSE_KEYWORDS = {
+    "as", "cross", "except", "full", "group", "having", "indexed", "inner",
+    "intersect", "join", "left", "limit", "natural", "not", "offset", "on",
+    "order", "outer", "right", "union", "using", "where", "window",
+}  # fmt: skip
+
+# Keywords of SQLite (https://sqlite.org/lang_keywords.html)
+SQL_KEYWORDS = {
+    "abort", "action", "add", "after", "all", "alter", "always", "analyze",
+    "and", "as", "asc", "attach", "autoincrement", "before", "begin",
+    "between", "by", "cascade", "case", "cast", "check", "collate", "column",
+    "commit", "conflict", "constraint", "create", "cross", "current",
+    "current_date", "current_time", "current_timestamp", "database",
+    "default", "deferrable", "deferred", "delete", "desc", "detach",
+    "distinct", "do", "drop", "each", "else", "end", "escape", "except",
+    "exclude", "exclusive", "exists", "explain", "fail", "filter", "first",
+    "following", "for", "foreign", "from", "full", "generated", "glob",
+    "group", "groups", "having", "if", "ignore", "immediate", "in", "index",
+    "indexed", "initially", "inner", "insert", "instead", "intersect", "into",
+    "is", "isnull", "join", "key", "last", "left", "like", "limit", "match",
+    "materialized", "natural", "no", "not", "nothing", "notnull", "null",
+    "nulls", "of", "offset", "on", "or", "order", "others", "outer", "over",
+    "partition", "plan", "pragma", "preceding", "primary", "query", "raise",
+    "range", "recursive", "references", "regexp", "reindex", "release",
+    "rename", "replace", "restrict", "returning", "right", "rollback", "row",
+    "rows", "savepoint", "select", "set", "table", "temp", "temporary",
+    "then", "ties", "to", "transaction", "trigger", "unbounded", "union",
+    "unique", "update", "using", "vacuum", "values", "view", "virtual",
+    "when", "where", "window", "with", "without",
+}  # fmt: skip
+
+# Words ending the comma-separated table list of a FROM clause
+FROM_LIST_END = {
+    "except", "group", "having", "intersect", "limit", "order", "select",
+    "union", "where", "window",
+}  # fmt: skip
+
+_PLAIN_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+class SqlSyntaxError(ValueError):
+    pass
+
+
+def tokenize(sql_query: str) -> list[Token]:
+    """Significant tokens of the query (no whitespace nor comments)."""
+    tokens = []
+    pos = 0
+    while pos < len(sql_query):
+        match = _TOKEN_RE.match(sql_query, pos)
+        if match is None:
+            raise SqlSyntaxError(f'unrecognized token: "{sql_query[pos:]}"')
+        if match.lastgroup not in ("space", "comment"):
+            tokens.append(Token(match.lastgroup, match.group(), pos))
+        pos = match.end()
+    return tokens
+
+
+def identifier_name(token: Token) -> str:
+    if token.kind == "quoted":
+        quote = token.value[0]
+        inner = token.value[1:-1]
+        return inner if quote == "[" else inner.replace(quote * 2, quote)
+    return token.value
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _is_identifier(token: Token) -> bool:
+    return token.kind in ("word", "quoted")
+
+
+def _is_word(token: Token, *words) -> bool:
+    return token.kind == "word" and token.value.lower() in words
+
+
+class SqlChecker:
+    """
+    In-process static analysis of a generated query against the schema, run
+    before SQLite sees it:
+
+    - unquoted references to identifiers containing spaces (`Order Details`,
+      `order_details`, `OrderDetails`) are quoted;
+    - write statements and multiple statements are rejected;
+    - table names, and columns qualified by a table or alias, are resolved
+      with a suggestion for the closest known name. Names in a database
+      other than `main`, and the columns of table-valued functions such as
+      json_each(), are left to SQLite.
+
+    Unqualified columns are left to SQLite: without a full parser they cannot
+    be told apart from result aliases reliably, and a false positive would
+    cost a whole generation.
+    """
+
+    def __init__(self, schema: Schema):
+        self.schema = schema
+        self._tables = {table.name.lower(): table for table in schema.tables}
+
+        names = {table.name for table in schema.tables}
+        names.update(column.name for table in schema.tables for column in table.columns)
+        self._columns = {
+            column.name.lower() for table in schema.tables for column in table.columns
+        }
+        lowered = {name.lower() for name in names}
+        self._sequences = {}
+        self._single_words = {}
+        for name in names:
+            if _PLAIN_IDENTIFIER.fullmatch(name):
+                continue
+            words = re.findall(r"[A-Za-z0-9_]+", name)
+            if not words:
+                continue
+            self._sequences[tuple(word.lower() for word in words)] = name
+            for variant in ("".join(words), "_".join(words)):
+                if variant.lower() not in lowered:
+                    self._single_words[variant.lower()] = name
+
+    def quote_identifiers(self, sql_query: str) -> str:
+        """Quote the unquoted spellings of identifiers that need quotes."""
+        try:
+            tokens = tokenize(sql_query)
+        except SqlSyntaxError:
+            return sql_query
+
+        replacements = []
+        idx = 0
+        while idx < len(tokens):
+            replaced = self._match_identifier(sql_query, tokens, idx)
+            if replaced is None:
+                idx += 1
+                continue
+            length, name = replaced
+            start = tokens[idx].start
+            last = tokens[idx + length - 1]
+            replacements.append((start, last.start + len(last.value), name))
+            idx += length
+
+        for start, end, name in reversed(replacements):
+            sql_query = sql_query[:start] + quote_identifier(name) + sql_query[end:]
+        return sql_query
+
+    def _match_identifier(self, sql_query, tokens, idx):
+        if tokens[idx].kind != "word":
+            return None
+
+        for sequence, name in self._sequences.items():
+            if len(sequence) < 2 or idx + len(sequence) > len(tokens):
+                continue
+            candidate = tokens[idx : idx + len(sequence)]
+            if all(
+                token.kind == "word" and token.value.lower() == word
+                for token, word in zip(candidate, sequence)
+            ) and all(
+                # Words of the name are only separated by whitespace
+                sql_query[a.start + len(a.value) : b.start].isspace()
+                for a, b in itertools.pairwise(candidate)
+            ):
+                return len(sequence), name
+
+        name = self._single_words.get(tokens[idx].value.lower())
+        if name is not None:
+            return 1, name
+        return None
+
+    def check(self, sql_query: str) -> tuple[str, list[str]]:
+        """Return the query with identifiers quoted, and the errors found."""
+        sql_query = self.quote_identifiers(sql_query)
+        try:
+            tokens = tokenize(sql_query)
+        except SqlSyntaxError as e:
+            return sql_query, [str(e)]
+
+        statements = [[]]
+        for token in tokens:
+            if token.value == ";":
+                statements.append([])
+            else:
+                statements[-1].append(token)
+        statements = [statement for statement in statements if statement]
+        if not statements:
+            return sql_query, ["incomplete input"]
+        if len(statements) > 1:
+            return sql_query, ["You can only execute one statement at a time."]
+
+        [tokens] = statements
+        errors = self._check_read_only(tokens)
+        if errors:
+            return sql_query, errors
+        return sql_query, self._check_references(tokens)
+
+    def _check_read_only(self, tokens):
+        for idx, token in enumerate(tokens):
+            if token.kind != "word" or token.value.lower() not in WRITE_KEYWORDS:
+                continue
+            if idx > 0 and (
+                # CASE ... END, replace(), t.update, or a column named so
+                token.value.lower() == "end"
+                or (idx + 1 < len(tokens) and tokens[idx + 1].value == "(")
+                or tokens[idx - 1].value == "."
+                or token.value.lower() in self._columns
+            ):
+                continue
+            return [
+                (
+                    "Only read-only SELECT queries are allowed, "
+                    f"found {token.value.upper()}"
+                )
+            ]
+        return []
+
+    def _check_references(self, tokens):
+        errors = []
+        aliases = {}
+        ctes = set()
+        table_tokens = set()
+
+        for idx, token in enumerate(tokens):
+            # WITH name [(columns)] AS (...)
+            if _is_identifier(token) and idx > 0:
+                previous = tokens[idx - 1]
+                if previous.value == "," or _is_word(previous, "with", "recursive"):
+                    after = idx + 1
+                    if after < len(tokens) and tokens[after].value == "(":
+                        after = self._closing(tokens, after) + 1
+                    if (
+                        after + 1 < len(tokens)
+                        and _is_word(tokens[after], "as")
+                        and tokens[after + 1].value == "("
+                    ):
+                        ctes.add(identifier_name(token).lower())
+
+        depth = 0
+        from_depths = []
+        for idx, token in enumerate(tokens):
+            if token.value == "(":
+                depth += 1
+            elif token.value == ")":
+                depth -= 1
+                while from_depths and from_depths[-1] > depth:
+                    from_depths.pop()
+
+            starts_ref = _is_word(token, "from", "join") or (
+                token.value == "," and from_depths and from_depths[-1] == depth
+            )
+            if _is_word(token, "from"):
+                from_depths.append(depth)
+            elif (
+                _is_identifier(token)
+                and from_depths
+                and from_depths[-1] == depth
+                and token.value.lower() in FROM_LIST_END
+            ):
+                # Commas after these no longer separate tables, e.g. the
+                # columns of the next SELECT of a UNION
+                from_depths.pop()
+            if not starts_ref or idx + 1 >= len(tokens):
+                continue
+
+            ref = idx + 1
+            if tokens[ref].value == "(":
+                # Subquery: only its alias is known
+                end = self._closing(tokens, ref)
+                alias = self._alias(tokens, end + 1)
+                if alias is not None:
+                    aliases[alias] = None
+                continue
+            if not _is_identifier(tokens[ref]):
+                continue
+
+            end = ref
+            database = None
+            if end + 2 < len(tokens) and tokens[end + 1].value == ".":
+                database = identifier_name(tokens[ref]).lower()
+                end += 2
+            name = identifier_name(tokens[end])
+            if end + 1 < len(tokens) and tokens[end + 1].value == "(":
+                # Table-valued function, e.g. json_each(): its columns are unknown
+                aliases[name.lower()] = None
+                alias = self._alias(tokens, self._closing(tokens, end + 1) + 1)
+                if alias is not None:
+                    aliases[alias] = None
+                continue
+            table_tokens.update(range(ref, end + 1))
+
+            if database in (None, "main"):
+                table = self._tables.get(name.lower())
+                if table is None and name.lower() not in ctes:
+                    errors.append(f"no such table: {name}" + self._suggest(name))
+            else:
+                # temp or an attached database, not in the schema
+                table = None
+            alias = self._alias(tokens, end + 1)
+            aliases[name.lower()] = table
+            if alias is not None:
+                aliases[alias] = table
+
+        for idx in range(len(tokens) - 2):
+            qualifier, dot, column = tokens[idx : idx + 3]
+            if (
+                idx in table_tokens
+                or dot.value != "."
+                or not _is_identifier(qualifier)
+                or not _is_identifier(column)
+                or (idx > 0 and tokens[idx - 1].value == ".")
+                or (idx + 3 < len(tokens) and tokens[idx + 3].value == "(")
+            ):
+                continue
+            owner = identifier_name(qualifier).lower()
+            if (
+                idx + 4 < len(tokens)
+                and tokens[idx + 3].value == "."
+                and _is_identifier(tokens[idx + 4])
+            ):
+                # database.table.column
+                if owner != "main":
+                    continue
+                qualifier, column = column, tokens[idx + 4]
+                owner = identifier_name(qualifier).lower()
+                table = self._tables.get(owner)
+                if table is None:
+                    name = identifier_name(qualifier)
+                    errors.append(f"no such table: main.{name}" + self._suggest(name))
+                    continue
+            elif owner in aliases:
+                table = aliases[owner]
+            elif owner in ctes:
+                continue
+            else:
+                table = self._tables.get(owner)
+                if table is None:
+                    errors.append(
+                        f"no such column: {identifier_name(qualifier)}."
+                        f"{identifier_name(column)}"
+                    )
+                    continue
+            column_name = identifier_name(column)
+            if table is not None and table.column(column_name) is None:
+                errors.append(
+                    f"no such column: {identifier_name(qualifier)}.{column_name}"
+                    + self._suggest(column_name, [c.name for c in table.columns])
+                )
+        return errors
+
+    def _alias(self, tokens, idx):
+        if idx < len(tokens) and _is_word(tokens[idx], "as"):
+            idx += 1
+        if idx >= len(tokens) or not _is_identifier(tokens[idx]):
+            return None
+        if tokens[idx].kind == "word" and tokens[idx].value.lower() in CLAUSE_KEYWORDS:
+            return None
+        return identifier_name(tokens[idx]).lower()
+
+    def _closing(self, tokens, idx):
+        depth = 0
+        for end in range(idx, len(tokens)):
+            if tokens[end].value == "(":
+                depth += 1
+            elif tokens[end].value == ")":
+                depth -= 1
+                if depth == 0:
+                    return end
+        return len(tokens) - 1
+
+    def _suggest(self, name, candidates=None):
+        if candidates is None:
+            candidates = [table.name for table in self.schema.tables]
+        by_lower = {candidate.lower(): candidate for candidate in candidates}
+        matches = difflib.get_close_matches(name.lower(), list(by_lower), n=1)
+        if not matches:
+            # `Order` for `Order Details`: the model forgot the quotes
+            matches = [
+                lowered
+                for lowered in by_lower
+                if lowered.startswith(name.lower() + " ")
+            ][:1]
+        if not matches:
+            return ""
+        return f" (did you mean {quote_identifier(by_lower[matches[0]])}?)"
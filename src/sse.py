@@ -0,0 +1,19 @@
+import json
+
+
+def format_event(event: str, data) -> str:
+    """One server-sent event; `data` is sent as JSON."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def relay_tokens(tokens):
+    """
+    Forward the pieces of a streaming generation as ("token", piece) events
+    and return whatever the generation itself returns, for `yield from`.
+    """
+    while True:
+        try:
+            piece = next(tokens)
+        except StopIteration as stop:
+            return stop.value
+        yield "token", piece
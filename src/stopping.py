@@ -0,0 +1,113 @@
+import threading
+import time
+
+import torch
+from transformers import StoppingCriteria
+
+SQL_BLOCK_OPEN = "```sql"
+SQL_BLOCK_CLOSE = "```"
+
+
+def sql_block_complete(text: str) -> bool:
+    """Whether `text` (lowercased) contains a complete ```sql ... ``` block."""
+    block_at = text.find(SQL_BLOCK_OPEN)
+    if block_at == -1:
+        return False
+    return text.find(SQL_BLOCK_CLOSE, block_at + len(SQL_BLOCK_OPEN)) != -1
+
+
+class SqlBlockStoppingCriteria(StoppingCriteria):
+    """
+    Stop each sequence as soon as it has emitted a complete ```sql ... ```
+    block, since nothing after it is used.
+
+    Decoding is incremental: until the opening fence shows up only the last
+    `window` tokens are decoded at each step, then only the tokens from the
+    fence onwards, so the cost does not grow with the length of the prose
+    around the query.
+
+    Being called after every step, it also timestamps the first one: the end
+    of the prefill.
+    """
+
+    def __init__(self, tokenizer, prompt_length: int, window: int = 16):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.window = window
+        self._block_start = {}
+        # row -> number of generated tokens when the block was complete
+        self.stopped_at = {}
+        self.started_at = time.perf_counter()
+        self.first_step_at = None
+
+    def _decode(self, token_ids):
+        return self.tokenizer.decode(token_ids, skip_special_tokens=True).lower()
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_step_at is None:
+            self.first_step_at = time.perf_counter()
+        length = input_ids.shape[1]
+        is_done = []
+        for row in range(input_ids.shape[0]):
+            if row not in self.stopped_at:
+                self._check(row, input_ids[row], length)
+            is_done.append(row in self.stopped_at)
+        return torch.tensor(is_done, dtype=torch.bool, device=input_ids.device)
+
+    def _check(self, row, token_ids, length):
+        start = self._block_start.get(row)
+        if start is None:
+            window_start = max(self.prompt_length, length - self.window)
+            if SQL_BLOCK_OPEN not in self._decode(token_ids[window_start:]):
+                return
+            start = self._block_start[row] = window_start
+
+        if sql_block_complete(self._decode(token_ids[start:])):
+            self.stopped_at[row] = length - self.prompt_length
+
+
+class StoppingStats:
+    """Generated tokens per request, and how many the early stop saved."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._stopped_early = 0
+        self._generated_tokens = 0
+        self._tokens_saved = 0
+
+    def record(self, criteria: SqlBlockStoppingCriteria, new_ids, max_length, pad_id):
+        """
+        `new_ids` are the generated ids of the batch; the savings are counted
+        against the `max_length` budget the generation would otherwise have.
+        """
+        budget = max_length - criteria.prompt_length
+        for row in range(new_ids.shape[0]):
+            if row in criteria.stopped_at:
+                self.record_generated(criteria.stopped_at[row], budget)
+            else:
+                self.record_generated(int((new_ids[row] != pad_id).sum()))
+
+    def record_generated(self, generated: int, budget=None):
+        """One request; `budget` is given when it was stopped early."""
+        with self._lock:
+            self._requests += 1
+            self._generated_tokens += generated
+            if budget is not None:
+                self._stopped_early += 1
+                self._tokens_saved += budget - generated
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "stopped_early": self._stopped_early,
+                "avg_generated_tokens": self._generated_tokens / self._requests
+                if self._requests
+                else 0.0,
+                "avg_tokens_saved": self._tokens_saved / self._requests
+                if self._requests
+                else 0.0,
+                "tokens_saved": self._tokens_saved,
+                "generated_tokens": self._generated_tokens,
+            }
@@ -0,0 +1,238 @@
+import json
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = "text_to_sql"
+# Upper bounds of the duration histograms, in seconds
+BUCKETS = (
+    0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0
+)  # fmt: skip
+# Finished traces kept for /stats/traces
+RECENT_TRACES = 100
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+
+
+class Trace:
+    """Spans recorded while answering one request, flat and in start order."""
+
+    def __init__(self, name: str, attrs: dict):
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self._previous = None
+
+    def add(self, name: str, start: float, duration: float, attrs: dict):
+        self.spans.append((name, start, duration, attrs))
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": None if self.duration is None else 1000 * self.duration,
+            **self.attrs,
+            "spans": [
+                {
+                    "name": name,
+                    "start_ms": 1000 * (start - self.start),
+                    "duration_ms": 1000 * duration,
+                    **attrs,
+                }
+                for name, start, duration, attrs in self.spans
+            ],
+        }
+
+
+class Span:
+    """Times a `with` block; `set` adds attributes known only at the end."""
+
+    __slots__ = ("attrs", "name", "start", "tracer")
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: dict):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.start = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            self.attrs["error"] = exc_type.__name__
+        self.tracer.record(
+            self.name, time.perf_counter() - self.start, self.start, **self.attrs
+        )
+
+
+class _TraceScope:
+    def __init__(self, tracer: "Tracer", trace: Trace):
+        self.tracer = tracer
+        self.trace = trace
+
+    def __enter__(self):
+        self.trace._previous = _current_trace.get()
+        _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, exc_type, exc, tb):
+        trace = self.trace
+        trace.duration = time.perf_counter() - trace.start
+        # GeneratorExit: the consumer stopped early, e.g. once it had the answer
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            trace.attrs["error"] = exc_type.__name__
+        # A generator closed late, e.g. by the garbage collector, must not
+        # clobber the trace of whatever runs at that point
+        if _current_trace.get() is trace:
+            _current_trace.set(trace._previous)
+        self.tracer.finish(trace)
+
+
+class Tracer:
+    """
+    Spans of the hot path (tokenization, prefill, decode, guided generation,
+    validation, execution, rendering) aggregated into duration histograms and
+    token counters, rendered in the Prometheus text format by `metrics`.
+
+    Inside `trace`, spans are also attached to the request's trace, which
+    follows the request through asyncio tasks and threads started with a
+    copied context. Recording a span is a couple of dict updates under a lock:
+    cheap enough to stay on in production.
+
+    With `prompt_sample_rate`, that fraction of the prompts is logged.
+    """
+
+    def __init__(self, prompt_sample_rate: float = 0.0, recent: int = RECENT_TRACES):
+        self.prompt_sample_rate = prompt_sample_rate
+        self._lock = threading.Lock()
+        self._buckets = defaultdict(lambda: [0] * (len(BUCKETS) + 1))
+        self._sums = defaultdict(float)
+        self._tokens = defaultdict(int)
+        self._counters = defaultdict(int)
+        self._recent = deque(maxlen=recent)
+
+    def span(self, name: str, **attrs) -> Span:
+        return Span(self, name, attrs)
+
+    def trace(self, name: str, **attrs) -> _TraceScope:
+        """Make the spans recorded in the `with` block part of one trace."""
+        return _TraceScope(self, Trace(name, attrs))
+
+    def current_trace(self) -> Trace | None:
+        return _current_trace.get()
+
+    def record(self, name: str, duration: float, start: float | None = None, **attrs):
+        """A span that was timed by the caller; a `tokens` attribute is summed."""
+        with self._lock:
+            self._buckets[name][bisect_left(BUCKETS, duration)] += 1
+            self._sums[name] += duration
+            tokens = attrs.get("tokens")
+            if tokens:
+                self._tokens[name] += tokens
+        trace = _current_trace.get()
+        if trace is not None:
+            if start is None:
+                start = time.perf_counter() - duration
+            trace.add(name, start, duration, attrs)
+
+    def count(self, name: str, amount: int = 1, **labels):
+        """Increment the counter `name` with these labels."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += amount
+
+    def finish(self, trace: Trace):
+        self.record(trace.name, trace.duration)
+        with self._lock:
+            self._recent.append(trace)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Trace: %s", json.dumps(trace.to_dict(), default=str))
+
+    def log_prompt(self, prompt: str, **attrs) -> bool:
+        """Log the prompt with probability `prompt_sample_rate`."""
+        if not self.prompt_sample_rate or random.random() >= self.prompt_sample_rate:
+            return False
+        logger.info("Sampled prompt %s:\n---\n%s\n---", attrs, prompt)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.attrs["prompt_logged"] = True
+        return True
+
+    def traces(self):
+        """The most recent finished traces, newest first."""
+        with self._lock:
+            recent = list(self._recent)
+        return [trace.to_dict() for trace in reversed(recent)]
+
+    def metrics(self) -> str:
+        """Everything recorded so far, in the Prometheus text exposition format."""
+        with self._lock:
+            buckets = {name: list(counts) for name, counts in self._buckets.items()}
+            sums = dict(self._sums)
+            tokens = dict(self._tokens)
+            counters = dict(self._counters)
+
+        histogram = f"{METRICS_PREFIX}_span_seconds"
+        lines = [
+            f"# HELP {histogram} Duration of the traced operations.",
+            f"# TYPE {histogram} histogram",
+        ]
+        for name in sorted(buckets):
+            label = f'span="{_escape(name)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), buckets[name]):
+                cumulative += count
+                lines.append(f'{histogram}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f"{histogram}_sum{{{label}}} {sums[name]}")
+            lines.append(f"{histogram}_count{{{label}}} {cumulative}")
+
+        counter = f"{METRICS_PREFIX}_tokens_total"
+        lines.append(f"# HELP {counter} Tokens processed by the traced operations.")
+        lines.append(f"# TYPE {counter} counter")
+        for name in sorted(tokens):
+            lines.append(f'{counter}{{span="{_escape(name)}"}} {tokens[name]}')
+
+        for name in sorted({name for name, _ in counters}):
+            counter = f"{METRICS_PREFIX}_{name}_total"
+            lines.append(f"# TYPE {counter} counter")
+            for (key, labels), value in sorted(counters.items()):
+                if key != name:
+                    continue
+                label = ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels)
+                lines.append(
+                    f"{counter}{{{label}}} {value}" if label else f"{counter} {value}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def traced_iter(name: str, iterable, **attrs):
+    """
+    Yield from `iterable`, timing the whole iteration as one span, e.g. a
+    streamed template (and the fetching of the rows it renders).
+    """
+    with tracer.span(name, **attrs):
+        yield from iterable
+
+
+# Process-wide tracer fed by src/ and the apps
+tracer = Tracer()
+span = tracer.span
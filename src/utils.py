@@ -1,124 +1,445 @@
-import re
+import os
 import sqlite3
-import base64
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 
+from src.blobs import BlobStore
+from src.databases import Database, DatabaseRegistry
+from src.governor import ExecutionGovernor, QueryBudgetExceeded, limit_query
+from src.result_cache import ResultCache
+from src.schema import render_schema
+from src.tracing import span, tracer
 
 DB_PATH = "northwind-SQLite3/dist/northwind.db"
+POOL_SIZE = 8
+
+# Databases served, by name, picked per request with `use_database` (the apps
+# route on a `db` parameter); the first one is the default
+DATABASES = {"northwind": DB_PATH}
+# Open databases beyond which the least recently used one is closed
+MAX_OPEN_DATABASES = 16
+
+# Result budgets: rows are fetched in batches and never fully materialized
+FETCH_BATCH_SIZE = 256
+PAGE_SIZE = 100
+MAX_RESULT_ROWS = 10000
+MAX_RESULT_BYTES = 16 * 1024 * 1024
+
+# Execution budgets of a single query, see ExecutionGovernor
+QUERY_TIME_BUDGET = 5.0
+QUERY_STEP_BUDGET = 200_000_000
+PREVIEW_ROWS = 5
+PREVIEW_TIME_BUDGET = 1.0
+
+# Picture columns are served by the apps from this URL instead of inline, out
+# of a directory shared by the worker processes
+BLOB_URL_PREFIX = "/blob/"
+BLOB_CACHE_BYTES = 64 * 1024 * 1024
+BLOB_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "text-to-sql-proto", "blobs"
+)
+
+# Memory of the open databases, shared evenly: pages of results already read
+# (until the data changes), SQLite page caches and memory-mapped I/O
+MEMORY_BUDGET = 256 * 1024 * 1024
+
+SCHEMA_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "text-to-sql-proto", "schema"
+)
+
+databases = DatabaseRegistry(
+    DATABASES, POOL_SIZE, MEMORY_BUDGET, MAX_OPEN_DATABASES, SCHEMA_CACHE_DIR
+)
+_blob_store = BlobStore(BLOB_CACHE_DIR, BLOB_CACHE_BYTES)
+_current_database: ContextVar[str | None] = ContextVar("database", default=None)
+
+
+def get_database(name: str | None = None) -> Database:
+    """
+    The database `name`, by default the one of the current `use_database`
+    block, else the default one. Raises UnknownDatabaseError.
+    """
+    return databases.get(name if name is not None else _current_database.get())
+
+
+@contextmanager
+def use_database(name: str | None):
+    """
+    Run the `with` block on the database `name` (None: the current one, else
+    the default one). It follows the request through asyncio tasks and
+    threads started with a copied context.
+    """
+    database = get_database(name)
+    previous = _current_database.get()
+    _current_database.set(database.name)
+    try:
+        yield database
+    finally:
+        # A generator closed late, e.g. by the garbage collector, must not
+        # switch the database of whatever runs at that point
+        if _current_database.get() == database.name:
+            _current_database.set(previous)
+
+
+def database_names():
+    return databases.names()
+
+
+def database_stats():
+    return databases.stats()
+
+
+def get_pool():
+    """Read-only connection pool of the current database."""
+    return get_database().pool
+
+
+def pool_stats():
+    return get_pool().stats()
+
+
+def get_blob_store():
+    return _blob_store
+
+
+def get_result_cache():
+    """ResultCache of the current database, watching its data for changes."""
+    return get_database().result_cache
+
+
+def result_cache_stats():
+    return get_result_cache().stats()
+
+
+def get_schema_version():
+    return get_database().schema_version()
+
+
+def get_schema():
+    """Structured schema of the current database."""
+    return get_database().schema()
+
+
+def get_sql_checker():
+    return get_database().sql_checker()
+
+
+def prepare_sql(sql_query: str):
+    """
+    Quote the identifiers the model left bare, e.g. Order Details or
+    order_details for "Order Details".
+    """
+    return get_sql_checker().quote_identifiers(sql_query)
 
 
 def scan_db_schema():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    schema = ""
-
-    # Get all table names
-    cursor.execute(
-        "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%';"
-    )
-    tables = cursor.fetchall()
-
-    for table in tables:
-        table_name = table[0]
-        schema += f'Table: "{table_name}"\n'
-        schema += "Columns:\n"
-
-        # Get column details
-        cursor.execute(f"PRAGMA table_info('{table_name}');")
-        columns = cursor.fetchall()
-        for column in columns:
-            # cid = column[0]
-            name = column[1]
-            data_type = column[2]
-            not_null = bool(column[3])
-            default_value = column[4]
-            is_pk = bool(column[5])
-
-            schema += f"  - {name} ({data_type})"
-            if is_pk:
-                schema += " [PRIMARY KEY]"
-            if not_null and not is_pk:
-                schema += " NOT NULL"
-            if default_value is not None:
-                schema += f" DEFAULT {default_value}"
-            schema += "\n"
-
-        # Get foreign key constraints
-        cursor.execute(f"PRAGMA foreign_key_list('{table_name}');")
-        foreign_keys = cursor.fetchall()
-        if foreign_keys:
-            schema += "Foreign Keys:\n"
-            for fk in foreign_keys:
-                # id = fk[0]
-                # seq = fk[1]
-                fk_table = fk[2]
-                fk_from = fk[3]
-                fk_to = fk[4]
-                # on_update = fk[5]
-                # on_delete = fk[6]
-                # match = fk[7]
-                schema += (
-                    f"  - FOREIGN KEY ({fk_from}) REFERENCES {fk_table}({fk_to})\n"
-                )
-
-        schema += "\n"
-
-    conn.close()
-    return schema
+    return render_schema(get_schema())
 
 
 def validate_sql(sql_query: str):
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("EXPLAIN QUERY PLAN " + sql_query)
-        conn.close()
-        return True, ""
-    except Exception as e:
-        return False, str(e)
-
-
-def execute_sql(sql_query):
-    conn = sqlite3.connect(DB_PATH)
-    conn.text_factory = bytes  # Ensure that BLOB data is returned as bytes
-    cursor = conn.cursor()
-    cursor.execute(sql_query)
-    results = cursor.fetchall()
-    columns_info = cursor.description
-    conn.close()
-
-    if columns_info:
-        columns = [description[0] for description in columns_info]
-
-        processed_results = []
-        for row in results:
-            processed_row = []
-            for idx, value in enumerate(row):
-                column_name = columns[idx]
-                if isinstance(value, bytes):
-                    if column_name.lower() == "picture":
-                        base64_str = base64.b64encode(value).decode("utf-8")
-                        mime_type = "image/jpeg"
-                        data_uri = f"data:{mime_type};base64,{base64_str}"
-                        processed_row.append(data_uri)
-                    else:
-                        decoded_value = value.decode("utf-8", "ignore")
-                        processed_row.append(decoded_value)
-                else:
-                    processed_row.append(value)
-            processed_results.append(processed_row)
-
-        return processed_results, columns
-
-    return results, []
-
-
-def hardcoded_check_order_details_table_name(sql_query):
     """
-    Very good examples of Mistral limitation:
-    - I do not easily force Mistral to output the proper name table Order Details enclosed in '"'
-    - So I need to monkey patch it, in case it is used in the query
+    Static check against the schema first, so that most invalid queries are
+    rejected with a precise message without touching SQLite, then the query
+    plan.
+    """
+    with span("validate_sql") as validation:
+        _, errors = get_sql_checker().check(sql_query)
+        if errors:
+            validation.set(valid=False, stage="static")
+            return False, "; ".join(errors)
+        try:
+            with get_pool().connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("EXPLAIN QUERY PLAN " + sql_query)
+                cursor.close()
+            validation.set(valid=True)
+            return True, ""
+        except sqlite3.Error as e:
+            validation.set(valid=False, stage="plan")
+            return False, str(e)
+
+
+def _process_row(row, columns):
+    processed_row = []
+    for idx, value in enumerate(row):
+        column_name = columns[idx]
+        if isinstance(value, bytes):
+            if column_name.lower() == "picture":
+                digest = get_blob_store().put(value, "image/jpeg")
+                processed_row.append(BLOB_URL_PREFIX + digest)
+            else:
+                decoded_value = value.decode("utf-8", "ignore")
+                processed_row.append(decoded_value)
+        else:
+            processed_row.append(value)
+    return processed_row
+
+
+def _row_size(row):
+    return sum(len(value) if isinstance(value, str) else 8 for value in row)
+
+
+class ResultStream:
+    """
+    Rows of a query, fetched `batch_size` at a time while being iterated.
+
+    Only the rows of the requested page (`offset`, `limit`) are processed and
+    iteration stops once they weigh more than `max_bytes`, so memory stays
+    bounded whatever the size of the result. The pooled connection is held
+    until the stream is exhausted or closed.
+
+    The query runs under `governor` (by default the QUERY_TIME_BUDGET and
+    QUERY_STEP_BUDGET budgets), charged only for the time spent executing and
+    fetching. When it is interrupted the stream ends early with the reason in
+    `budget_exceeded`.
+
+    With `cache`, a page read to its end is stored in the result cache, see
+    `stream_sql`.
+    """
+
+    cached = False
+
+    def __init__(
+        self,
+        sql_query: str,
+        offset: int = 0,
+        limit: int = MAX_RESULT_ROWS,
+        batch_size: int = FETCH_BATCH_SIZE,
+        max_bytes: int = MAX_RESULT_BYTES,
+        governor: ExecutionGovernor | None = None,
+        cache: bool = False,
+    ):
+        if governor is None:
+            governor = ExecutionGovernor(QUERY_TIME_BUDGET, QUERY_STEP_BUDGET)
+        self.governor = governor
+        self.offset = offset
+        self.limit = limit
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+
+        self.rows_read = 0
+        self.bytes_read = 0
+        self.has_more = False
+        self.truncated = False
+        self.budget_exceeded = None
+        self.columns = []
+        # Bound now: the stream may be read after the request's block ended
+        database = get_database()
+        self._cache_key = None
+        if cache:
+            self._result_cache = database.result_cache
+            self._cache_key = ResultCache.key(sql_query, offset, limit)
+            self._data_version = self._result_cache.version.current()
+
+        self._start = time.perf_counter()
+        self._pool = database.pool
+        self._cursor = None
+        self._conn = self._pool.acquire()
+        try:
+            # Ensure that BLOB data is returned as bytes
+            self._conn.text_factory = bytes
+            self.governor.attach(self._conn)
+            self._cursor = self._conn.cursor()
+            self._cursor.execute(sql_query)
+        except Exception as e:
+            error = self.governor.translate(e)
+            if isinstance(error, QueryBudgetExceeded):
+                self.budget_exceeded = str(error)
+            self.close()
+            if self.budget_exceeded is None:
+                raise
+            return
+
+        self.governor.pause()
+        columns_info = self._cursor.description
+        self.columns = [d[0] for d in columns_info] if columns_info else []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        if self._cache_key is None:
+            yield from self._rows()
+            return
+
+        rows = []
+        for row in self._rows():
+            rows.append(row)
+            yield row
+        # Only reached when the page was read to its end
+        if self.budget_exceeded is None:
+            self._result_cache.put(
+                self._cache_key,
+                rows,
+                self.columns,
+                data_version=self._data_version,
+                rows_read=self.rows_read,
+                bytes_read=self.bytes_read,
+                has_more=self.has_more,
+                truncated=self.truncated,
+                blobs=_blob_digests(rows),
+            )
+
+    def _rows(self):
+        if self._conn is None or not self.columns:
+            self.close()
+            return
+
+        try:
+            to_skip = self.offset
+            while to_skip > 0:
+                skipped = len(self._fetch(min(to_skip, self.batch_size)))
+                if skipped == 0:
+                    return
+                to_skip -= skipped
+
+            while True:
+                rows = self._fetch(self.batch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    if self.rows_read >= self.limit:
+                        self.has_more = True
+                        return
+                    if self.bytes_read >= self.max_bytes:
+                        self.has_more = True
+                        self.truncated = True
+                        return
+                    processed_row = _process_row(row, self.columns)
+                    self.rows_read += 1
+                    self.bytes_read += _row_size(processed_row)
+                    yield processed_row
+        finally:
+            self.close()
+
+    def _fetch(self, size):
+        self.governor.resume()
+        try:
+            return self._cursor.fetchmany(size)
+        except Exception as e:
+            error = self.governor.translate(e)
+            if not isinstance(error, QueryBudgetExceeded):
+                raise
+            self.budget_exceeded = str(error)
+            return []
+        finally:
+            self.governor.pause()
+
+    def cost(self):
+        """Time and VM steps spent so far, and rows produced."""
+        return dict(self.governor.cost(), rows=self.rows_read)
+
+    def close(self):
+        if self._conn is not None:
+            if self._cursor is not None:
+                self._cursor.close()
+            self.governor.detach(self._conn)
+            self._pool.release(self._conn)
+            self._conn = None
+            tracer.record(
+                "execute_sql",
+                time.perf_counter() - self._start,
+                self._start,
+                rows=self.rows_read,
+                budget_exceeded=self.budget_exceeded is not None,
+            )
+
+
+def _blob_digests(rows):
+    return [
+        value[len(BLOB_URL_PREFIX) :]
+        for row in rows
+        for value in row
+        if isinstance(value, str) and value.startswith(BLOB_URL_PREFIX)
+    ]
+
+
+class ResultPage:
+    """Fully read page, with the same attributes as the stream it came from."""
+
+    cached = False
+
+    def __init__(self, stream: ResultStream):
+        with stream:
+            self.rows = list(stream)
+        self.columns = stream.columns
+        self.rows_read = stream.rows_read
+        self.bytes_read = stream.bytes_read
+        self.has_more = stream.has_more
+        self.truncated = stream.truncated
+        self.budget_exceeded = stream.budget_exceeded
+
+    @classmethod
+    def from_cache(cls, entry: dict):
+        page = cls.__new__(cls)
+        entry.pop("blobs")
+        page.__dict__.update(entry, budget_exceeded=None, cached=True)
+        return page
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+def cached_page(sql_query: str, offset: int, limit: int) -> ResultPage | None:
+    """
+    The page from the result cache, unless the data changed since or one of
+    the pictures it links to was evicted from the blob store.
     """
-    pattern = r"(?i)\border(?:_?[dD]etails|[A-Z]etails)\b"
-    replacement = '"Order Details"'
+    result_cache = get_result_cache()
+    key = ResultCache.key(sql_query, offset, limit)
+    entry = result_cache.get(key)
+    if entry is None:
+        return None
+    if not all(digest in get_blob_store() for digest in entry["blobs"]):
+        result_cache.invalidate(key)
+        return None
+    return ResultPage.from_cache(entry)
+
+
+def stream_sql(sql_query: str, page: int = 0, page_size: int = PAGE_SIZE):
+    """Page of the results: from the result cache, else streamed from SQLite."""
+    offset = page * page_size
+    cached = cached_page(sql_query, offset, page_size)
+    if cached is not None:
+        return cached
+    return ResultStream(sql_query, offset=offset, limit=page_size, cache=True)
+
+
+def fetch_page(sql_query: str, page: int = 0, page_size: int = PAGE_SIZE):
+    """Like stream_sql but reads the page right away, e.g. in a worker thread."""
+    results = stream_sql(sql_query, page, page_size)
+    return results if isinstance(results, ResultPage) else ResultPage(results)
 
-    return re.sub(pattern, replacement, sql_query)
+
+def execute_sql(sql_query, offset: int = 0, limit: int = MAX_RESULT_ROWS):
+    cached = cached_page(sql_query, offset, limit)
+    if cached is not None:
+        return cached.rows, cached.columns
+    with ResultStream(sql_query, offset=offset, limit=limit, cache=True) as stream:
+        rows = list(stream)
+    if stream.budget_exceeded:
+        raise QueryBudgetExceeded(stream.budget_exceeded)
+    return rows, stream.columns
+
+
+def preview_sql(sql_query: str, limit: int = PREVIEW_ROWS):
+    """
+    First `limit` rows of the query, which SQLite is told about through an
+    injected LIMIT so it can stop early, and the cost report of the run.
+    Previews get the tighter PREVIEW_TIME_BUDGET.
+    Raises QueryBudgetExceeded when the query blows its budget.
+    """
+    governor = ExecutionGovernor(PREVIEW_TIME_BUDGET, QUERY_STEP_BUDGET)
+    with ResultStream(
+        limit_query(sql_query, limit), limit=limit, governor=governor
+    ) as stream:
+        rows = list(stream)
+    if stream.budget_exceeded:
+        raise QueryBudgetExceeded(stream.budget_exceeded)
+    cost = stream.cost()
+    cost["limited"] = len(rows) >= limit
+    return rows, stream.columns, cost
@@ -0,0 +1,68 @@
+import sqlite3
+
+import pytest
+
+from src import utils
+from src.actions import ActionStats, preview, summarize_rows, verify
+from src.databases import DatabaseRegistry
+
+
+@pytest.fixture
+def shop_db(tmp_path, monkeypatch):
+    path = tmp_path / "shop.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE customers (id INTEGER PRIMARY KEY, country TEXT)")
+    conn.executemany(
+        "INSERT INTO customers VALUES (?, ?)",
+        [(i, ["FR", "DE", "UK"][i % 3]) for i in range(100)],
+    )
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(utils, "databases", DatabaseRegistry({"shop": str(path)}))
+
+
+def test_summarize_rows():
+    rows = [[1, "FR"], [2, "FR"], [3, "x" * 100]]
+    cost = {"elapsed_ms": 1.25, "vm_steps": 3000, "limited": True}
+    summary = summarize_rows(rows, ["id", "country"], cost)
+    assert summary.splitlines() == [
+        "Rows: at least 3, Cost: 1.2 ms, ~3000 VM steps",
+        "Columns: id (3 distinct), country (2 distinct)",
+        "First rows:",
+        "1 | FR",
+        "2 | FR",
+        "3 | " + "x" * 37 + "...",
+    ]
+
+
+def test_preview(shop_db):
+    summary = preview("SELECT country FROM customers WHERE id < 10 ORDER BY id;")
+    assert summary.startswith("Rows: 10,")
+    assert "country (3 distinct)" in summary
+    assert "First rows:\nFR\nDE\nUK" in summary
+
+    assert preview("SELECT * FROM customer").startswith(
+        'Validity: False, Error: no such table: customer (did you mean "customers"?)'
+    )
+
+
+def test_verify(shop_db):
+    assert verify("SELECT * FROM customers").startswith("Validity: True, Cost:")
+    assert verify("SELECT nope FROM customers").startswith("Validity: False")
+
+
+def test_action_stats(shop_db):
+    stats = ActionStats()
+    observation, latency_ms = stats.run("preview", "SELECT COUNT(*) FROM customers")
+    assert "100" in observation
+    assert latency_ms > 0
+    stats.run("verify", "SELECT 1")
+    stats.record_question(2)
+    stats.record_question(4)
+
+    result = stats.stats()
+    assert result["questions"] == 2
+    assert result["avg_steps_per_question"] == 3
+    assert result["actions"]["preview"]["calls"] == 1
+    assert result["actions"]["verify"]["p95_ms"] > 0
@@ -0,0 +1,86 @@
+import asyncio
+
+import httpx
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from src.asgi import AdmissionControl, BodySizeLimit, Overloaded, overloaded
+
+
+def test_overload_is_rejected_with_429():
+    """Test that requests beyond in-flight + queue capacity fail fast."""
+
+    admission = AdmissionControl(max_in_flight=1, max_queue_depth=1)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def slow(request):
+            async with admission.slot():
+                await release.wait()
+                return PlainTextResponse("done")
+
+        app = Starlette(
+            routes=[Route("/", slow)], exception_handlers={Overloaded: overloaded}
+        )
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            first = asyncio.create_task(client.get("/"))
+            second = asyncio.create_task(client.get("/"))
+            await asyncio.sleep(0.05)
+            assert admission.stats()["in_flight"] == 1
+            assert admission.stats()["waiting"] == 1
+
+            rejected = await client.get("/")
+            assert rejected.status_code == 429
+            assert rejected.headers["retry-after"] == "1"
+
+            release.set()
+            assert (await first).text == "done"
+            assert (await second).text == "done"
+        assert admission.stats()["rejected"] == 1
+
+    asyncio.run(main())
+
+
+def test_streamed_response_holds_its_slot():
+    admission = AdmissionControl(max_in_flight=1, max_queue_depth=0)
+    in_flight = []
+
+    async def events():
+        for idx in range(3):
+            in_flight.append(admission.stats()["in_flight"])
+            yield f"{idx}\n"
+
+    async def stream(request):
+        return await admission.hold(StreamingResponse(events()))
+
+    app = Starlette(
+        routes=[Route("/stream", stream)], exception_handlers={Overloaded: overloaded}
+    )
+    with TestClient(app) as client:
+        assert client.get("/stream").text == "0\n1\n2\n"
+    assert in_flight == [1, 1, 1]
+    assert admission.stats()["in_flight"] == 0
+
+
+def test_request_body_size_limit():
+    async def echo(request):
+        return PlainTextResponse(await request.body())
+
+    app = Starlette(
+        routes=[Route("/", echo, methods=["POST"])],
+        middleware=[Middleware(BodySizeLimit, max_bytes=8)],
+    )
+    with TestClient(app) as client:
+        assert client.post("/", content=b"12345678").text == "12345678"
+        assert client.post("/", content=b"123456789").status_code == 413
+
+        # Without Content-Length: stopped while reading
+        chunks = iter([b"12345", b"67890"])
+        assert client.post("/", content=chunks).status_code == 413
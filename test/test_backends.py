@@ -0,0 +1,127 @@
+import json
+import logging
+
+import pytest
+import torch
+
+from src import backends
+from src.backends import (
+    Backend,
+    RecordingBackend,
+    ReplayBackend,
+    TransformersBackend,
+    create_backend,
+    prompt_key,
+)
+from src.react import ReactChatBot
+from src.simple import SimpleChatBot
+
+COMPLETION = "Sure!\n```sql\nSELECT name FROM users;\n```\nThis query selects..."
+
+
+class FakeBackend(Backend):
+    def __init__(self, completion):
+        self.completion = completion
+        self.calls = []
+        self.pieces_sent = 0
+
+    def stream(self, prompt, max_tokens=1024, temperature=0.0, json_schema=None):
+        self.calls.append((prompt, json_schema))
+        for piece in self.completion.split(" "):
+            self.pieces_sent += 1
+            yield piece + " "
+
+
+def test_transformers_backend_on_cpu(tiny_model, tiny_tokenizer):
+    backend = TransformersBackend(model=tiny_model, tokenizer=tiny_tokenizer)
+    assert backend.device in ("cpu", "cuda")
+
+    model_inputs = tiny_tokenizer("How many users?", return_tensors="pt")
+    with torch.inference_mode():
+        generated_ids = tiny_model.generate(**model_inputs, max_new_tokens=20)
+    expected = tiny_tokenizer.decode(
+        generated_ids[0, model_inputs["input_ids"].shape[1] :],
+        skip_special_tokens=True,
+    )
+    assert backend.complete("How many users?", max_tokens=20) == expected
+
+
+def test_simple_bot_on_text_backend():
+    backend = FakeBackend(COMPLETION)
+    bot = SimpleChatBot(
+        "sqlite3", "users (id)", 1, logging.getLogger(), backend=backend
+    )
+
+    assert bot.think("prompt") == "SELECT name FROM users;"
+    # Generation stopped at the closing fence
+    assert backend.pieces_sent < len(COMPLETION.split(" "))
+    assert bot.stopping_stats.stats()["stopped_early"] == 1
+    assert bot.think_batch(["a", "b"]) == ["SELECT name FROM users;"] * 2
+
+
+def test_react_bot_on_text_backend():
+    decision = {"Decision": {"Final_Thought": "ok", "Final_Answer": "SELECT 1"}}
+    backend = FakeBackend(json.dumps(decision))
+    bot = ReactChatBot("sqlite3", "users (id)", backend=backend)
+
+    episode = bot.new_episode()
+    assert json.loads(bot("question", episode)) == decision
+    prompt, json_schema = backend.calls[0]
+    assert prompt.endswith("question")
+    assert json_schema == bot.schema
+    assert episode.steps[0]["prefill_tokens"] > 0
+    assert episode.steps[0]["decode_tokens"] > 0
+
+
+def test_record_and_replay(tmp_path):
+    path = str(tmp_path / "replay.json")
+    recording = RecordingBackend(FakeBackend(COMPLETION), path)
+    recorded_bot = SimpleChatBot(
+        "sqlite3", "", 1, logging.getLogger(), backend=recording
+    )
+    sql_query = recorded_bot.think("prompt took 12.5 ms")
+
+    replay = create_backend("replay", path=path)
+    assert isinstance(replay, ReplayBackend)
+    replayed_bot = SimpleChatBot("sqlite3", "", 1, logging.getLogger(), backend=replay)
+    # Timings are not part of the key
+    assert replayed_bot.think("prompt took 3.0 ms") == sql_query
+    with pytest.raises(KeyError):
+        replayed_bot.think("another prompt")
+
+
+def test_json_schema_keeps_the_order_of_properties(
+    tiny_model, tiny_tokenizer, monkeypatch
+):
+    schema = {
+        "type": "object",
+        "properties": {"Thought": {"type": "string"}, "Action": {"type": "string"}},
+        "required": ["Thought", "Action"],
+    }
+    reordered = dict(schema, properties=dict(reversed(schema["properties"].items())))
+    assert prompt_key("prompt", schema) != prompt_key("prompt", reordered)
+
+    regexes = []
+
+    def load_regex_guide(regex_str, tokenizer, cache_dir):
+        regexes.append(regex_str)
+        raise RuntimeError("stop before building the guide")
+
+    monkeypatch.setattr(backends, "load_regex_guide", load_regex_guide)
+    backend = TransformersBackend(model=tiny_model, tokenizer=tiny_tokenizer)
+    with pytest.raises(RuntimeError):
+        backend._json_generator(schema)
+    assert regexes[0].index("Thought") < regexes[0].index("Action")
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        create_backend("vllm")
+
+
+def test_backend_must_implement_stream():
+    class NoStream(Backend):
+        pass
+
+    with pytest.raises(TypeError, match="stream"):
+        NoStream()
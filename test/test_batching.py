@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+
+import pytest
+
+from src.batching import BatchScheduler, percentile
+
+
+class StubModel:
+    """Fake batched generation: upper-cases prompts and records batch sizes."""
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.batch_sizes = []
+
+    def generate_batch(self, prompts):
+        self.batch_sizes.append(len(prompts))
+        time.sleep(self.delay)
+        return [prompt.upper() for prompt in prompts]
+
+
+def test_percentile():
+    assert percentile([], 0.5) == 0.0
+    assert percentile([3, 1, 2], 0.5) == 2
+    assert percentile(list(range(101)), 0.95) == 95
+
+
+def test_concurrent_prompts_are_batched_and_routed():
+    """Test that each caller gets its own completion back."""
+
+    model = StubModel()
+    scheduler = BatchScheduler(model.generate_batch, max_batch_size=4, max_wait_ms=50)
+
+    results = {}
+
+    def worker(idx):
+        results[idx] = scheduler(f"select {idx}")
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    scheduler.close()
+
+    assert results == {i: f"SELECT {i}" for i in range(8)}
+    assert max(model.batch_sizes) > 1
+    assert max(model.batch_sizes) <= 4
+
+    stats = scheduler.stats()
+    assert stats["requests"] == 8
+    assert stats["batches"] == len(model.batch_sizes)
+    assert stats["avg_batch_size"] > 1
+    assert stats["p95_latency_ms"] >= stats["p50_latency_ms"] > 0
+
+
+def test_errors_are_propagated_to_every_caller():
+    def generate_batch(prompts):
+        raise RuntimeError("CUDA out of memory")
+
+    scheduler = BatchScheduler(generate_batch, max_batch_size=2, max_wait_ms=50)
+    futures = [scheduler.submit("a"), scheduler.submit("b")]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="out of memory"):
+            future.result()
+    scheduler.close()
+
+    assert scheduler.stats()["failed_batches"] >= 1
+
+
+def test_close_serves_pending_prompts():
+    model = StubModel(delay=0)
+    scheduler = BatchScheduler(model.generate_batch, max_batch_size=2, max_wait_ms=0)
+    futures = [scheduler.submit(str(i)) for i in range(5)]
+    scheduler.close()
+
+    assert [future.result(timeout=1) for future in futures] == [
+        str(i) for i in range(5)
+    ]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_forked_process_gets_its_own_worker():
+    scheduler = BatchScheduler(lambda prompts: prompts, max_wait_ms=0)
+    assert scheduler("parent") == "parent"
+
+    pid = os.fork()
+    if pid == 0:
+        # The worker thread of the parent does not exist in the child
+        ok = scheduler.submit("child").result(timeout=5) == "child"
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    scheduler.close()
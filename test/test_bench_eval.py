@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from benchmarks.bench_eval import (
+    StubBackend,
+    evaluate,
+    load_gold,
+    summarize,
+    trace_costs,
+)
+from src.backends import RecordingBackend, ReplayBackend
+from src.tracing import Trace
+
+
+@pytest.mark.parametrize("flow", ["simple", "react"])
+def test_evaluate_with_stub(flow):
+    gold = load_gold()[:4]
+    results = evaluate(gold, flow, StubBackend(gold, error_rate=0.5), attempts=5)
+
+    report = summarize(results)
+    assert report["questions"] == 4
+    assert report["execution_accuracy"] == 1.0
+    # Corrupted first attempts are retried
+    assert report["avg_attempts"] > (2 if flow == "react" else 1)
+    assert report["avg_prefill_tokens"] > 0
+    assert report["avg_decode_tokens"] > 0
+    assert report["avg_db_time_ms"] > 0
+    json.dumps(report)
+
+
+def test_replay(tmp_path):
+    gold = load_gold()[:2]
+    path = str(tmp_path / "replay.json")
+    recording = RecordingBackend(StubBackend(gold), path)
+    recorded = evaluate(gold, "react", recording, attempts=5)
+    replayed = evaluate(gold, "react", ReplayBackend(path), attempts=5)
+    assert [r["sql_query"] for r in replayed] == [r["sql_query"] for r in recorded]
+
+
+def test_costs_are_the_bot_accounting():
+    trace = Trace("question", {})
+    trace.add("prefill", 0.0, 0.01, {"tokens": 20, "reused_tokens": 480})
+    trace.add("decode", 0.01, 0.1, {"tokens": 30})
+    trace.add("guided_generation", 0.2, 0.1, {"prefill_tokens": 5, "decode_tokens": 7})
+    trace.add("validate_sql", 0.3, 0.002, {"valid": True})
+    trace.add("execute_sql", 0.4, 0.003, {"rows": 1})
+
+    costs = trace_costs(trace)
+    assert costs["prefill_tokens"] == 25
+    assert costs["reused_tokens"] == 480
+    assert costs["decode_tokens"] == 37
+    assert round(costs["db_time_ms"], 3) == 5.0
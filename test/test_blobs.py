@@ -0,0 +1,52 @@
+import os
+
+from src.blobs import BlobStore
+
+# A blob file holds its mime type line, then the data
+ENTRY_SIZE = len(b"image/jpeg\n") + 4
+
+
+def test_identical_blobs_share_one_entry(tmp_path):
+    store = BlobStore(str(tmp_path))
+    key = store.put(b"image", "image/jpeg")
+
+    assert store.put(b"image", "image/jpeg") == key
+    assert store.get(key) == (b"image", "image/jpeg")
+    assert key in store
+    assert store.stats()["entries"] == 1
+
+
+def test_blobs_are_shared_through_the_directory(tmp_path):
+    key = BlobStore(str(tmp_path)).put(b"image", "image/png")
+
+    # e.g. another worker process
+    other = BlobStore(str(tmp_path))
+    assert other.get(key) == (b"image", "image/png")
+    assert other.get("0" * 32) is None
+    assert other.get("../../etc/passwd") is None
+    assert other.stats()["misses"] == 2
+
+
+def test_lru_eviction_by_size(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=2 * ENTRY_SIZE + 1)
+    a = store.put(b"aaaa", "image/jpeg")
+    b = store.put(b"bbbb", "image/jpeg")
+    store.get(a)
+    c = store.put(b"cccc", "image/jpeg")
+
+    assert store.get(a) is not None
+    assert store.get(b) is None
+    assert store.get(c) is not None
+
+    stats = store.stats()
+    assert stats["bytes"] == 2 * ENTRY_SIZE
+    assert stats["evictions"] == 1
+
+
+def test_oversized_blob_is_not_cached(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=2)
+    key = store.put(b"too large", "image/jpeg")
+
+    assert store.get(key) is None
+    assert store.stats()["bytes"] == 0
+    assert os.listdir(tmp_path) == []
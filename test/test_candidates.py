@@ -0,0 +1,92 @@
+import logging
+import threading
+
+import pytest
+import torch
+
+from src import simple
+from src.backends import TransformersBackend
+from src.candidates import select_candidate
+
+VALID = {"SELECT a FROM t", "SELECT a FROM t ORDER BY a", "SELECT b FROM t"}
+RESULTS = {
+    "SELECT a FROM t": "rows-a",
+    "SELECT a FROM t ORDER BY a": "rows-a",
+    "SELECT b FROM t": "rows-b",
+}
+
+
+def _validate(sql_query):
+    if sql_query in VALID:
+        return True, ""
+    return False, f"no such table in {sql_query}"
+
+
+def test_first_valid():
+    candidates = ["SELECT x", "SELECT b FROM t", "SELECT a FROM t", "SELECT x"]
+    sql_query, is_valid, errors = select_candidate(
+        candidates, "first_valid", validate=_validate
+    )
+    assert (sql_query, is_valid) == ("SELECT b FROM t", True)
+    # Duplicated invalid candidates are only reported once
+    assert errors == [{"sql_query": "SELECT x", "message": "no such table in SELECT x"}]
+
+
+def test_consistency_votes_on_results():
+    candidates = [
+        "SELECT b FROM t",
+        "SELECT a FROM t",
+        "SELECT a FROM t ORDER BY a",
+        "SELECT b FROM t",
+        "SELECT a FROM t",
+    ]
+    sql_query, is_valid, _ = select_candidate(
+        candidates, "consistency", validate=_validate, fingerprint=RESULTS.get
+    )
+    # rows-a has 3 votes against 2 for rows-b
+    assert (sql_query, is_valid) == ("SELECT a FROM t", True)
+
+
+def test_all_invalid():
+    sql_query, is_valid, errors = select_candidate(
+        ["SELECT x", "SELECT y"], validate=_validate
+    )
+    assert (sql_query, is_valid) == ("SELECT x", False)
+    assert len(errors) == 2
+
+
+def test_candidates_are_validated_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+
+    def validate(sql_query):
+        # Deadlocks unless the three validations run at the same time
+        barrier.wait()
+        return True, ""
+
+    sql_query, is_valid, _ = select_candidate(["a", "b", "c"], validate=validate)
+    assert (sql_query, is_valid) == ("a", True)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        select_candidate(["SELECT 1"], "best")
+
+
+def test_think_candidates_with_prompt_cache(tiny_model, tiny_tokenizer, monkeypatch):
+    """Test that the prompt cache expanded to n rows samples the same candidates."""
+
+    backend = TransformersBackend(model=tiny_model, tokenizer=tiny_tokenizer)
+    monkeypatch.setattr(simple, "MAX_LENGTH", 960)
+    prompt = simple.get_base_prompt("sqlite3", "users (id)", "How many users?")
+
+    candidates = []
+    for use_prompt_cache in [False, True]:
+        bot = simple.SimpleChatBot(
+            "sqlite3", "users (id)", 1, logging.getLogger(), use_prompt_cache, backend
+        )
+        torch.manual_seed(0)
+        candidates.append(bot.think_candidates(prompt, 3))
+
+    assert len(candidates[0]) == 3
+    assert candidates[0] == candidates[1]
+    assert bot.prompt_cache.hits == 1
@@ -0,0 +1,105 @@
+import sqlite3
+import threading
+from contextvars import copy_context
+
+import pytest
+
+from src import utils
+from src.databases import DatabaseRegistry, UnknownDatabaseError
+from src.utils import execute_sql, get_database, use_database, validate_sql
+
+
+def _create(path, table, rows):
+    conn = sqlite3.connect(path)
+    conn.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY)")
+    conn.executemany(f"INSERT INTO {table} VALUES (?)", [(i,) for i in range(rows)])
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    """Two tenants with different schemas: shop (3 orders), zoo (5 animals)."""
+
+    registry = DatabaseRegistry(
+        {
+            "shop": _create(tmp_path / "shop.db", "orders", 3),
+            "zoo": _create(tmp_path / "zoo.db", "animals", 5),
+        },
+        pool_size=1,
+        memory_budget=1024 * 1024,
+    )
+    monkeypatch.setattr(utils, "databases", registry)
+    yield registry
+    registry.close()
+
+
+def test_requests_are_routed_to_their_database(registry):
+    assert get_database().name == "shop"
+    assert execute_sql("SELECT COUNT(*) FROM orders")[0] == [[3]]
+
+    with use_database("zoo"):
+        assert execute_sql("SELECT COUNT(*) FROM animals")[0] == [[5]]
+        assert not validate_sql("SELECT * FROM orders")[0]
+        assert [table.name for table in utils.get_schema().tables] == ["animals"]
+
+        # Threads started with a copied context stay on the same database
+        seen = []
+        thread = threading.Thread(
+            target=copy_context().run, args=(lambda: seen.append(get_database().name),)
+        )
+        thread.start()
+        thread.join()
+        assert seen == ["zoo"]
+
+    assert get_database().name == "shop"
+    with pytest.raises(UnknownDatabaseError, match="'farm'"), use_database("farm"):
+        pass
+
+
+def test_databases_are_opened_lazily_and_share_the_budget(registry):
+    assert registry.stats()["open"] == []
+
+    shop = registry.get("shop")
+    assert shop.result_cache.max_bytes == 512 * 1024
+    with shop.pool.connection() as conn:
+        assert conn.execute("PRAGMA cache_size").fetchone()[0] == -256
+        assert conn.execute("PRAGMA mmap_size").fetchone()[0] == 256 * 1024
+
+    # The SQLite caches shrink with the result cache, also on busy connections
+    busy = shop.pool.acquire()
+    zoo = registry.get("zoo")
+    assert shop.result_cache.max_bytes == zoo.result_cache_bytes == 256 * 1024
+    shop.pool.release(busy)
+    assert busy.execute("PRAGMA cache_size").fetchone()[0] == -128
+    assert busy.execute("PRAGMA mmap_size").fetchone()[0] == 128 * 1024
+    assert shop.pool is not zoo.pool
+    assert registry.get("shop") is shop
+
+
+def test_least_recently_used_database_is_closed(registry):
+    registry.max_open = 1
+    closed = []
+
+    class State:
+        def __init__(self, database):
+            self.name = database.name
+
+        def close(self):
+            closed.append(self.name)
+
+    shop = registry.get("shop")
+    assert shop.state(State) is shop.state(State)
+    with use_database("shop"):
+        execute_sql("SELECT * FROM orders")
+
+    registry.get("zoo")
+    assert closed == ["shop"]
+    stats = registry.stats()
+    assert [database["name"] for database in stats["open"]] == ["zoo"]
+    assert stats["closed"] == 1
+
+    # Reopened on its next use, with fresh caches
+    assert registry.get("shop") is not shop
+    assert registry.get("shop").file_for("cache.db") == "cache.shop.db"
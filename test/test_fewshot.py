@@ -0,0 +1,81 @@
+import pytest
+
+from src.fewshot import ExampleStore, hashed_embedding
+from src.schema_linking import question_terms
+from src.simple import get_base_prompt
+
+DB_SCHEMA = "Customers (CustomerID, Country)"
+EXAMPLES = [
+    ("How many customers are there in each country?", "SELECT Country, COUNT(*) ..."),
+    ("List the products that are discontinued.", "SELECT ProductName ..."),
+    ("What is the total freight of the orders shipped in 1997?", "SELECT SUM ..."),
+]
+
+
+def _store(**kwargs):
+    store = ExampleStore(DB_SCHEMA, **kwargs)
+    for question, sql_query in EXAMPLES:
+        store.put(question, sql_query)
+    return store
+
+
+@pytest.mark.parametrize("method", ["hashed", "bm25"])
+def test_search_ranks_similar_questions_first(method):
+    store = _store(method=method)
+
+    examples = store.search("Number of customers per country", k=2)
+    assert examples[0].sql_query == "SELECT Country, COUNT(*) ..."
+    assert examples[0].score > 0
+    assert store.search("zebra giraffe", k=2) == []
+
+
+@pytest.mark.parametrize("method", ["hashed", "bm25"])
+def test_put_replaces_the_same_question(method):
+    store = _store(method=method)
+    store.put("list the products that are discontinued?", "SELECT 1")
+
+    assert len(store) == 3
+    assert store.search("discontinued products", k=1)[0].sql_query == "SELECT 1"
+
+
+def test_index_grows_incrementally():
+    store = ExampleStore(DB_SCHEMA)
+    for idx in range(40):
+        store.put(f"orders of employee {idx} shipped late", f"SELECT {idx}")
+    assert len(store) == 40
+    assert store.search("orders of employee 37 shipped late", k=1)[0].sql_query == (
+        "SELECT 37"
+    )
+
+
+def test_hashed_embedding_is_a_stable_unit_vector():
+    terms = question_terms("Total freight per shipper")
+    vector = hashed_embedding(terms)
+    assert vector.tolist() == hashed_embedding(terms).tolist()
+    assert abs(float(vector @ vector) - 1.0) < 1e-6
+
+
+def test_persistence_and_schema_change(tmp_path):
+    path = str(tmp_path / "fewshot.db")
+    _store(path=path).close()
+
+    store = ExampleStore(DB_SCHEMA, path=path)
+    assert len(store) == 3
+    assert store.search("customers in each country", k=1)
+
+    assert store.set_schema(DB_SCHEMA + "\nOrders (OrderID)")
+    assert len(store) == 0
+    store.close()
+    assert len(ExampleStore(DB_SCHEMA, path=path)) == 0
+
+
+def test_examples_go_after_the_schema():
+    examples = _store().search("customers in each country", k=1)
+    prompt = get_base_prompt("sqlite3", DB_SCHEMA, "Customers per country?", examples)
+
+    assert prompt.index(DB_SCHEMA) < prompt.index("**Fewshot Examples:**")
+    assert prompt.index("SELECT Country, COUNT(*) ...") < prompt.index(
+        "**User Question:**"
+    )
+    # Without examples the prompt is unchanged, and so is its cached prefix
+    assert "Fewshot Examples" not in get_base_prompt("sqlite3", DB_SCHEMA, "q")
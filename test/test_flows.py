@@ -0,0 +1,41 @@
+from src.flows import simple_events
+
+
+def test_simple_flow_retries_with_the_errors():
+    prompts = []
+    answers = iter(["SELECT * FROM Customer", "SELECT * FROM Customers"])
+
+    def generate(prompt):
+        prompts.append(prompt)
+        yield "SELECT"
+        return next(answers)
+
+    events = list(simple_events("Question", generate, attempts=3))
+    assert [event for event, _ in events] == [
+        "attempt",
+        "token",
+        "sql",
+        "invalid",
+        "attempt",
+        "token",
+        "sql",
+        "done",
+    ]
+    assert events[-1][1] == {"sql_query": "SELECT * FROM Customers", "attempts": 2}
+    assert "no such table: Customer" in prompts[1]
+
+
+def test_simple_flow_keeps_one_candidate_error_per_attempt():
+    prompts = []
+
+    def generate(prompt):
+        prompts.append(prompt)
+        return ["SELECT * FROM Customer", "SELECT * FROM Order"]
+
+    def select(candidates):
+        errors = [{"sql_query": sql, "message": "no such table"} for sql in candidates]
+        return candidates[0], False, errors
+
+    events = list(simple_events("Question", generate, 2, select))
+    assert events[-1][0] == "failed"
+    assert prompts[1].count("**Returned Error:**") == 1
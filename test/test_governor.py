@@ -0,0 +1,68 @@
+import sqlite3
+import time
+
+import pytest
+
+from src.governor import ExecutionGovernor, QueryBudgetExceeded, limit_query
+
+
+@pytest.mark.parametrize(
+    "sql_query, expected",
+    [
+        ("SELECT * FROM t;", "SELECT * FROM t\nLIMIT 5"),
+        ("SELECT * FROM t -- all rows\n", "SELECT * FROM t\nLIMIT 5"),
+        (
+            "SELECT * FROM t LIMIT 100",
+            "SELECT * FROM (\nSELECT * FROM t LIMIT 100\n) LIMIT 5",
+        ),
+        (
+            "SELECT * FROM (SELECT * FROM t LIMIT 100)",
+            "SELECT * FROM (SELECT * FROM t LIMIT 100)\nLIMIT 5",
+        ),
+    ],
+)
+def test_limit_query(sql_query, expected):
+    assert limit_query(sql_query, 5) == expected
+
+
+def test_governor_interrupts_and_detaches():
+    conn = sqlite3.connect(":memory:")
+    runaway = (
+        "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) "
+        "SELECT COUNT(*) FROM n"
+    )
+
+    governor = ExecutionGovernor(max_seconds=0.05)
+    governor.attach(conn)
+    with pytest.raises(sqlite3.OperationalError) as excinfo:
+        conn.execute(runaway).fetchall()
+    governor.detach(conn)
+
+    error = governor.translate(excinfo.value)
+    assert isinstance(error, QueryBudgetExceeded)
+    assert "0.05 s time budget" in str(error)
+    assert governor.cost()["vm_steps"] > 0
+
+    # Detached: the connection is usable again
+    assert conn.execute("SELECT 1").fetchone() == (1,)
+
+
+def test_time_between_fetches_is_not_counted():
+    conn = sqlite3.connect(":memory:")
+    governor = ExecutionGovernor(max_seconds=0.05, interval=1)
+    governor.attach(conn)
+    cursor = conn.execute(
+        "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100) "
+        "SELECT i FROM n"
+    )
+    assert cursor.fetchmany(10)
+    governor.pause()
+
+    # e.g. the page being rendered
+    time.sleep(0.1)
+
+    governor.resume()
+    assert len(cursor.fetchall()) == 90
+    governor.detach(conn)
+    assert governor.exceeded is None
+    assert governor.cost()["elapsed_ms"] < 50
@@ -0,0 +1,66 @@
+import os
+import pickle
+
+import pytest
+from outlines.models.transformers import TransformerTokenizer
+
+from src import guide_cache
+from src.guide_cache import guide_cache_key, load_regex_guide
+
+REGEX = r'\{"Answer": "[a-z ]{1,10}"\}'
+
+
+def test_guide_is_compiled_once_and_loaded_from_disk(
+    tiny_tokenizer, tmp_path, monkeypatch
+):
+    tokenizer = TransformerTokenizer(tiny_tokenizer)
+
+    guide = load_regex_guide(REGEX, tokenizer, cache_dir=str(tmp_path))
+    assert os.listdir(tmp_path) == [guide_cache_key(REGEX, tokenizer) + ".pkl"]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the guide should have been loaded from disk")
+
+    monkeypatch.setattr(guide_cache, "RegexGuide", fail)
+    cached_guide = load_regex_guide(REGEX, tokenizer, cache_dir=str(tmp_path))
+
+    assert cached_guide.states_to_token_maps == guide.states_to_token_maps
+    assert cached_guide.final_states == guide.final_states
+    assert cached_guide.eos_token_id == guide.eos_token_id
+
+
+def test_cache_key_depends_on_regex_and_tokenizer(tiny_tokenizer):
+    tokenizer = TransformerTokenizer(tiny_tokenizer)
+    key = guide_cache_key(REGEX, tokenizer)
+
+    assert guide_cache_key(REGEX, tokenizer) == key
+    assert guide_cache_key(REGEX + "?", tokenizer) != key
+
+    tokenizer.vocabulary = {**tokenizer.vocabulary, "<extra>": len(tiny_tokenizer)}
+    assert guide_cache_key(REGEX, tokenizer) != key
+
+
+def test_cache_key_depends_on_outlines_version(tiny_tokenizer, monkeypatch):
+    tokenizer = TransformerTokenizer(tiny_tokenizer)
+    key = guide_cache_key(REGEX, tokenizer)
+
+    monkeypatch.setattr(guide_cache, "OUTLINES_VERSION", "0.0.1")
+    assert guide_cache_key(REGEX, tokenizer) != key
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        b"",
+        # Written by another outlines version, whose classes moved
+        b"cno_such_module\nRegexGuide\n.",
+    ],
+)
+def test_unreadable_cache_file_is_rebuilt(tiny_tokenizer, tmp_path, content):
+    tokenizer = TransformerTokenizer(tiny_tokenizer)
+    path = tmp_path / (guide_cache_key(REGEX, tokenizer) + ".pkl")
+    path.write_bytes(content)
+
+    guide = load_regex_guide(REGEX, tokenizer, cache_dir=str(tmp_path))
+    assert guide.states_to_token_maps
+    assert pickle.loads(path.read_bytes()).states_to_token_maps
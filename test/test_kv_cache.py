@@ -0,0 +1,239 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+import torch
+from outlines.models.transformers import Transformers
+
+from src import simple
+from src.backends import TransformersBackend
+from src.kv_cache import (
+    Episode,
+    PromptCache,
+    PromptCachedTransformers,
+    common_prefix_length,
+)
+from src.simple import extend_prompt_with_errors, get_base_prompt
+
+DB_SCHEMA = """Table: "users"
+Columns:
+  - id (INTEGER) [PRIMARY KEY]
+  - name (TEXT)
+  - age (INTEGER)
+"""
+
+
+def _generate(model, tokenizer, prompt, past_key_values=None):
+    model_inputs = tokenizer(prompt, return_tensors="pt")
+    with torch.inference_mode():
+        return model.generate(
+            **model_inputs,
+            past_key_values=past_key_values,
+            max_new_tokens=24,
+            do_sample=False,
+        )
+
+
+def test_common_prefix_length():
+    assert common_prefix_length([1, 2, 3], [1, 2, 4]) == 2
+    assert common_prefix_length([1, 2], [1, 2, 3]) == 2
+    assert common_prefix_length([], [1]) == 0
+
+
+def test_generate_identical_with_and_without_prompt_cache(tiny_model, tiny_tokenizer):
+    """Test that resuming from the cached schema prefix does not change outputs."""
+
+    prompt_cache = PromptCache(tiny_model)
+    prefix = get_base_prompt("sqlite3", DB_SCHEMA, "")
+    prompt_cache.prime(tiny_tokenizer(prefix)["input_ids"])
+
+    base_prompt = get_base_prompt("sqlite3", DB_SCHEMA, "Find all users older than 30")
+    errors = [{"sql_query": "Select * from ?;", "message": "Syntax error"}]
+    for prompt in [
+        extend_prompt_with_errors(base_prompt, []),
+        extend_prompt_with_errors(base_prompt, errors),
+    ]:
+        expected = _generate(tiny_model, tiny_tokenizer, prompt)
+
+        input_ids = tiny_tokenizer(prompt, return_tensors="pt")["input_ids"]
+        past_key_values, n_reused = prompt_cache.lookup(input_ids)
+        assert past_key_values is not None
+        assert n_reused > 0.9 * len(prompt_cache.token_ids)
+
+        result = _generate(tiny_model, tiny_tokenizer, prompt, past_key_values)
+        assert torch.equal(result, expected)
+
+    stats = prompt_cache.stats()
+    assert stats["hits"] == 2
+    assert stats["reused_tokens"] > stats["prefilled_tokens"]
+
+
+def test_prompt_cache_is_not_mutated_by_generation(tiny_model, tiny_tokenizer):
+    """Test that each lookup hands out a private copy of the prefix cache."""
+
+    prompt_cache = PromptCache(tiny_model)
+    prompt_cache.prime(tiny_tokenizer("You are an agent.")["input_ids"])
+    cached_length = prompt_cache.past_key_values.get_seq_length()
+
+    input_ids = tiny_tokenizer("You are an agent. Hello", return_tensors="pt")[
+        "input_ids"
+    ]
+    past_key_values, _ = prompt_cache.lookup(input_ids)
+    _generate(tiny_model, tiny_tokenizer, "You are an agent. Hello", past_key_values)
+
+    assert prompt_cache.past_key_values.get_seq_length() == cached_length
+
+
+def test_prompt_cache_miss_on_different_prefix(tiny_model, tiny_tokenizer):
+    prompt_cache = PromptCache(tiny_model)
+    prompt_cache.prime(tiny_tokenizer("You are an agent.")["input_ids"])
+
+    input_ids = tiny_tokenizer("Hello", return_tensors="pt")["input_ids"]
+    past_key_values, n_reused = prompt_cache.lookup(input_ids)
+    assert past_key_values is None
+    assert n_reused == 0
+
+
+def _greedy(model, prompt, steps=16):
+    """Greedy decoding loop driving the model like outlines' sequence_generator."""
+
+    token_ids, attention_mask = model.tokenizer.encode(prompt)
+    kv_cache = None
+    for _ in range(steps):
+        logits, kv_cache = model(token_ids, attention_mask, kv_cache)
+        next_token_ids = logits.argmax(dim=-1, keepdim=True)
+        token_ids = torch.cat([token_ids, next_token_ids], dim=-1)
+        attention_mask = torch.cat(
+            [attention_mask, torch.ones_like(next_token_ids)], dim=-1
+        )
+    return token_ids
+
+
+def test_outlines_model_identical_with_and_without_prompt_cache(
+    tiny_model, tiny_tokenizer
+):
+    """Test greedy decoding through the outlines model interface."""
+
+    cached_model = PromptCachedTransformers(tiny_model, tiny_tokenizer)
+    cached_model.prompt_cache.prime(tiny_tokenizer("<s>system\nYou are")["input_ids"])
+
+    prompt = "<s>system\nYou are a world class AI agent.\n<s>user\nHi</s>"
+    expected = _greedy(Transformers(tiny_model, tiny_tokenizer), prompt)
+    result = _greedy(cached_model, prompt)
+
+    assert torch.equal(result, expected)
+    assert cached_model.prompt_cache.hits == 1
+
+
+def test_episode_only_prefills_appended_blocks(tiny_model, tiny_tokenizer):
+    """Test that each ReAct step resumes from the transcript of the previous one."""
+
+    plain_model = Transformers(tiny_model, tiny_tokenizer)
+    cached_model = PromptCachedTransformers(tiny_model, tiny_tokenizer)
+    system = "<s>system\nYou are a world class AI agent.</s>\n\n"
+    cached_model.prompt_cache.prime(tiny_tokenizer(system)["input_ids"])
+
+    prompt = system + "<s>user\nHow many users?</s>\n\n<s>assistant"
+    observations = ["\nAction:\n    verify\nObservation:\n    Validity: True"] * 3
+
+    episode = Episode(tiny_model)
+    for observation in observations:
+        with cached_model.episode(episode):
+            result = _greedy(cached_model, prompt)
+        episode.end_step()
+
+        assert torch.equal(result, _greedy(plain_model, prompt))
+        prompt += observation
+
+    assert len(episode.steps) == 3
+    first, *others = episode.steps
+    assert first["reused_tokens"] == len(tiny_tokenizer(system)["input_ids"])
+    for step, observation in zip(others, observations):
+        # Only the appended observation (and no more) is prefilled
+        assert step["prefill_tokens"] == len(observation)
+        assert step["decode_tokens"] == 15
+
+
+def _greedy_stream(model, episode, prompt, steps=16):
+    """One streamed ReAct step: `_greedy` inside the episode, a token per `next`."""
+
+    with model.episode(episode):
+        token_ids, attention_mask = model.tokenizer.encode(prompt)
+        kv_cache = None
+        for _ in range(steps):
+            logits, kv_cache = model(token_ids, attention_mask, kv_cache)
+            next_token_ids = logits.argmax(dim=-1, keepdim=True)
+            token_ids = torch.cat([token_ids, next_token_ids], dim=-1)
+            attention_mask = torch.cat(
+                [attention_mask, torch.ones_like(next_token_ids)], dim=-1
+            )
+            yield next_token_ids
+    episode.end_step()
+
+
+def test_interleaved_streamed_episodes(tiny_model, tiny_tokenizer):
+    """Test that each streamed step accounts to its own episode, as in app_async."""
+
+    cached_model = PromptCachedTransformers(tiny_model, tiny_tokenizer)
+    prompts = ["<s>user\nHow many users?</s>", "<s>user\nOldest user?</s>"]
+    episodes = [Episode(tiny_model), Episode(tiny_model)]
+    streams = [
+        (copy_context(), _greedy_stream(cached_model, episode, prompt))
+        for episode, prompt in zip(episodes, prompts)
+    ]
+
+    # Both streams are advanced by the same thread, each in its own context
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = list(streams)
+        while pending:
+            for stream in list(pending):
+                context, generator = stream
+                if executor.submit(context.run, next, generator, None).result() is None:
+                    pending.remove(stream)
+
+    for episode, prompt in zip(episodes, prompts):
+        [step] = episode.steps
+        assert step["prefill_tokens"] == len(tiny_tokenizer(prompt)["input_ids"])
+        assert step["decode_tokens"] == 15
+
+
+def test_think_batch_with_prompt_cache(tiny_model, tiny_tokenizer, monkeypatch):
+    """Test that batched prompts of different lengths resume from the cache."""
+
+    backend = TransformersBackend(model=tiny_model, tokenizer=tiny_tokenizer)
+    monkeypatch.setattr(simple, "MAX_LENGTH", 1000)
+    prompts = [
+        get_base_prompt("sqlite3", "users (id)", "How many users?"),
+        get_base_prompt("sqlite3", "users (id)", "Find all users older than 30"),
+    ]
+
+    answers = []
+    for use_prompt_cache in [False, True]:
+        bot = simple.SimpleChatBot(
+            "sqlite3", "users (id)", 1, logging.getLogger(), use_prompt_cache, backend
+        )
+        answers.append(bot.think_batch(prompts))
+    assert answers[0] == answers[1]
+    stats = bot.prompt_cache.stats()
+    assert stats["hits"] == 1
+    assert stats["reused_tokens"] == 2 * len(bot.prompt_cache.token_ids)
+
+    # The padding between the cached prefix and the question is skipped: each
+    # row gets the logits of its prompt alone
+    def first_logits(model_inputs, past_key_values=None):
+        with torch.inference_mode():
+            output = tiny_model.generate(
+                **model_inputs,
+                past_key_values=past_key_values,
+                max_new_tokens=1,
+                output_logits=True,
+                return_dict_in_generate=True,
+            )
+        return output.logits[0]
+
+    model_inputs = tiny_tokenizer(prompts, return_tensors="pt", padding=True)
+    past_key_values, _ = bot._reuse_batch_prefix(model_inputs)
+    batched = first_logits(model_inputs, past_key_values)
+    for row, prompt in enumerate(prompts):
+        alone = first_logits(tiny_tokenizer(prompt, return_tensors="pt"))
+        assert torch.allclose(batched[row], alone[0], atol=1e-5)
@@ -0,0 +1,99 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from src.loader import LazyLoader
+
+
+def test_lazy_loader_builds_once():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        time.sleep(0.05)
+        return object()
+
+    loader = LazyLoader(factory)
+    assert loader.status()["state"] == "cold"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(loader.get())) for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len({id(result) for result in results}) == 1
+    status = loader.status()
+    assert status["ready"]
+    assert status["load_seconds"] >= 0.05
+
+
+def test_background_warm_up():
+    release = threading.Event()
+    loader = LazyLoader(lambda: release.wait() and "bot")
+    loader.start("background")
+
+    assert not loader.ready
+    assert loader.peek() is None
+    release.set()
+    assert loader.get() == "bot"
+    assert loader.status()["state"] == "ready"
+
+
+def test_failed_load_is_reported_and_retried():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise OSError("weights not found")
+        return "bot"
+
+    loader = LazyLoader(factory)
+    loader.warm_up().join()
+    status = loader.status()
+    assert status["state"] == "failed"
+    assert "weights not found" in status["error"]
+
+    assert loader.get() == "bot"
+    assert loader.status()["error"] is None
+
+
+def test_forked_process_loads_its_own():
+    parent = os.getpid()
+    release = threading.Event()
+    loader = LazyLoader(
+        lambda: (os.getpid() != parent or release.wait()) and os.getpid()
+    )
+    loader.warm_up()
+    while loader.status()["state"] != "loading":
+        time.sleep(0.01)
+
+    read, write = os.pipe()
+    child = os.fork()
+    if child == 0:
+        try:
+            # Killed if it waits for the load of the parent
+            signal.alarm(10)
+            os.write(write, str(loader.get()).encode())
+        finally:
+            os._exit(0)
+    os.close(write)
+    os.waitpid(child, 0)
+    assert os.read(read, 64).decode() == str(child)
+    os.close(read)
+
+    release.set()
+    assert loader.get() == parent
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        LazyLoader(object).start("eager")
@@ -0,0 +1,149 @@
+import os
+import signal
+import socket
+import threading
+import time
+
+import pytest
+
+from src.model_server import RemoteBot, RemoteBotLoader, start_model_server
+
+
+class StubEpisode:
+    def __init__(self):
+        self.steps = []
+
+    def stats(self):
+        return {"steps": len(self.steps)}
+
+
+class StubBot:
+    """Echoes prompts, in the model server process."""
+
+    attempts = 3
+
+    def think_batch(self, prompts):
+        if "boom" in prompts:
+            raise ValueError("boom")
+        return [f"SELECT '{prompt}' -- {os.getpid()}" for prompt in prompts]
+
+    def think_stream(self, prompt):
+        yield from prompt.split()
+        return prompt.upper()
+
+    def new_episode(self):
+        return StubEpisode()
+
+    def think(self, user_prompt, episode=None, db_schema=None):
+        episode.steps.append({"prompt": user_prompt, "db_schema": db_schema})
+        return '{"Decision": {}}'
+
+
+@pytest.fixture
+def model_server():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        address = s.getsockname()
+    authkey = os.urandom(16)
+
+    pid = start_model_server(StubBot, address, authkey, max_wait_ms=50)
+    yield address, authkey, pid
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+
+
+def test_calls_are_served_by_one_process(model_server):
+    address, authkey, pid = model_server
+    assert start_model_server(StubBot, address, authkey) is None
+
+    bot = RemoteBot(address, authkey)
+    assert bot.attempts == 3
+
+    results = {}
+
+    def ask(idx):
+        results[idx] = bot.think_batch([f"q{idx}"])
+
+    threads = [threading.Thread(target=ask, args=(idx,)) for idx in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == {idx: [f"SELECT 'q{idx}' -- {pid}"] for idx in range(4)}
+
+    with pytest.raises(ValueError, match="boom"):
+        bot.think_batch(["boom"])
+
+    stats = bot.server_stats()
+    assert stats["pid"] == pid
+    assert stats["batching"]["requests"] == 4
+    assert stats["batching"]["batches"] < 4
+    assert stats["batching"]["failed_batches"] == 1
+    assert stats["errors"] == 1
+
+
+def test_streams_and_episodes(model_server):
+    address, authkey, _ = model_server
+    bot = RemoteBot(address, authkey)
+
+    stream = bot.think_stream("select all rows")
+    tokens = []
+    while True:
+        try:
+            tokens.append(next(stream))
+        except StopIteration as stop:
+            assert stop.value == "SELECT ALL ROWS"
+            break
+    assert tokens == ["select", "all", "rows"]
+
+    episode = bot.new_episode()
+    assert bot("first step", episode, "schema") == '{"Decision": {}}'
+    bot("second step", episode, None)
+    assert [step["prompt"] for step in episode.steps] == ["first step", "second step"]
+    assert episode.stats() == {"steps": 2}
+
+
+def test_forked_worker_gets_its_own_connection(model_server):
+    address, authkey, pid = model_server
+    bot = RemoteBot(address, authkey)
+    read, write = os.pipe()
+
+    worker = os.fork()
+    if worker == 0:
+        try:
+            answer = bot.think_batch(["from the worker"])[0]
+            os.write(write, answer.encode())
+        finally:
+            os._exit(0)
+    os.close(write)
+    os.waitpid(worker, 0)
+    assert os.read(read, 1024).decode() == f"SELECT 'from the worker' -- {pid}"
+    os.close(read)
+
+    assert bot.think_batch(["from the parent"])
+
+
+def test_loader_reports_the_model_of_the_server(model_server):
+    address, authkey, _ = model_server
+    loader = RemoteBotLoader(address, authkey)
+
+    deadline = time.monotonic() + 10
+    while not loader.status()["ready"] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    status = loader.status()
+    assert status["ready"] and status["name"] == "model server"
+    # Nothing was loaded in this process to answer
+    assert loader.peek() is None
+
+    assert loader.get().attempts == 3
+    assert loader.status()["state"] == "ready"
+
+
+def test_loader_without_model_server():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        address = s.getsockname()
+
+    status = RemoteBotLoader(address, b"key").status()
+    assert not status["ready"]
+    assert "ConnectionRefusedError" in status["error"]
@@ -0,0 +1,121 @@
+import sqlite3
+import threading
+
+import pytest
+
+from src.pool import ConnectionPool, PoolClosedError, PoolTimeoutError
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "test.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.execute("INSERT INTO users (name) VALUES ('alice'), ('bob')")
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+def test_connections_are_reused(db_path):
+    """Test that released connections are handed out again."""
+
+    pool = ConnectionPool(db_path, size=2)
+    for _ in range(5):
+        with pool.connection() as conn:
+            assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 2
+
+    stats = pool.stats()
+    assert stats["created"] == 1
+    assert stats["acquired"] == 5
+    assert stats["reused"] == 4
+    assert stats["in_use"] == 0
+
+
+def test_connections_are_read_only(db_path):
+    """Test that pooled connections cannot write to the database."""
+
+    pool = ConnectionPool(db_path)
+    with pool.connection() as conn:
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("INSERT INTO users (name) VALUES ('eve')")
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("DROP TABLE users")
+
+
+def test_text_factory_is_reset(db_path):
+    """Test that a borrower changing text_factory does not leak to the next one."""
+
+    pool = ConnectionPool(db_path, size=1)
+    with pool.connection() as conn:
+        conn.text_factory = bytes
+        assert conn.execute("SELECT name FROM users").fetchone()[0] == b"alice"
+    with pool.connection() as conn:
+        assert conn.execute("SELECT name FROM users").fetchone()[0] == "alice"
+
+
+def test_bounded_pool_waits_then_times_out(db_path):
+    """Test that acquire blocks when the pool is exhausted."""
+
+    pool = ConnectionPool(db_path, size=1, timeout=0.05)
+    conn = pool.acquire()
+    with pytest.raises(PoolTimeoutError):
+        pool.acquire()
+
+    threading.Timer(0.01, pool.release, args=(conn,)).start()
+    pool.timeout = 5
+    with pool.connection():
+        pass
+
+    stats = pool.stats()
+    assert stats["created"] == 1
+    assert stats["waits"] == 1
+    assert stats["max_wait_ms"] > 0
+
+
+def test_connection_released_after_close_is_closed(db_path):
+    pool = ConnectionPool(db_path, size=2)
+    idle = pool.acquire()
+    busy = pool.acquire()
+    pool.release(idle)
+
+    pool.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        idle.execute("SELECT 1")
+    assert busy.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 2
+
+    pool.release(busy)
+    with pytest.raises(sqlite3.ProgrammingError):
+        busy.execute("SELECT 1")
+    stats = pool.stats()
+    assert stats["idle"] == 0
+    assert stats["created"] == 0
+
+
+def test_closed_pool_refuses_connections(db_path):
+    pool = ConnectionPool(db_path, size=2)
+    with pool.connection():
+        pass
+    pool.close()
+
+    with pytest.raises(PoolClosedError):
+        pool.acquire()
+    with pytest.raises(PoolClosedError), pool.connection():
+        pass
+    stats = pool.stats()
+    assert stats["created"] == stats["in_use"] == 0
+    assert stats["acquired"] == 1
+
+
+def test_pragmas_are_changed_on_idle_and_released_connections(db_path):
+    pool = ConnectionPool(db_path, size=2)
+    idle = pool.acquire()
+    busy = pool.acquire()
+    pool.release(idle)
+
+    pool.set_pragmas(cache_size=-1024)
+    assert idle.execute("PRAGMA cache_size").fetchone()[0] == -1024
+    assert busy.execute("PRAGMA cache_size").fetchone()[0] == -65536
+    pool.release(busy)
+    assert busy.execute("PRAGMA cache_size").fetchone()[0] == -1024
+    assert pool.stats()["idle"] == 2
@@ -0,0 +1,84 @@
+import time
+
+from src.question_cache import QuestionCache, normalize_question, schema_fingerprint
+
+DB_SCHEMA = "users (id, name, age)"
+
+
+def test_normalize_question():
+    assert normalize_question("  List all   Products. ") == "list all products"
+    assert normalize_question("List all products?") == "list all products"
+    # Quoted literals are case sensitive in SQL
+    assert normalize_question("Orders of customer 'ALFKI'") == (
+        "orders of customer 'ALFKI'"
+    )
+    assert normalize_question("Orders of customer 'ALFKI'") != normalize_question(
+        "Orders of customer 'alfki'"
+    )
+
+
+def test_schema_fingerprint():
+    assert schema_fingerprint(DB_SCHEMA) == schema_fingerprint(DB_SCHEMA)
+    assert schema_fingerprint(DB_SCHEMA) != schema_fingerprint(DB_SCHEMA + "\n")
+
+
+def test_hit_on_near_identical_question():
+    cache = QuestionCache(DB_SCHEMA)
+    assert cache.get("Find all users older than 30") is None
+
+    cache.put("Find all users older than 30", "SELECT * FROM users WHERE age > 30;")
+    assert cache.get("find all users  older than 30?") == (
+        "SELECT * FROM users WHERE age > 30;"
+    )
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_lru_eviction():
+    cache = QuestionCache(DB_SCHEMA, max_entries=2)
+    cache.put("a", "SELECT 1;")
+    cache.put("b", "SELECT 2;")
+    cache.get("a")
+    cache.put("c", "SELECT 3;")
+
+    assert cache.get("a") == "SELECT 1;"
+    assert cache.get("b") is None
+    assert cache.get("c") == "SELECT 3;"
+
+
+def test_ttl_expiration():
+    cache = QuestionCache(DB_SCHEMA, ttl=0.01)
+    cache.put("a", "SELECT 1;")
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_schema_change_invalidates():
+    cache = QuestionCache(DB_SCHEMA)
+    cache.put("a", "SELECT 1;")
+
+    assert not cache.set_schema(DB_SCHEMA)
+    assert cache.get("a") == "SELECT 1;"
+
+    assert cache.set_schema(DB_SCHEMA + ", email")
+    assert cache.get("a") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_persistence(tmp_path):
+    path = str(tmp_path / "question_cache.db")
+    cache = QuestionCache(DB_SCHEMA, path=path)
+    cache.put("a", "SELECT 1;")
+    cache.close()
+
+    cache = QuestionCache(DB_SCHEMA, path=path)
+    assert cache.get("a") == "SELECT 1;"
+    cache.close()
+
+    # Entries validated against another schema are dropped on load
+    cache = QuestionCache(DB_SCHEMA + ", email", path=path)
+    assert cache.get("a") is None
+    cache.close()
@@ -0,0 +1,104 @@
+import sqlite3
+
+import pytest
+
+from src.result_cache import DataVersion, ResultCache, canonical_sql
+
+
+def test_canonical_sql():
+    assert canonical_sql(
+        "SELECT  Name\nFROM Customers WHERE Age > 3;"
+    ) == canonical_sql("select Name -- the names\nfrom Customers where Age > 3")
+    # Literals and quoted names keep their case
+    assert canonical_sql("SELECT * FROM t WHERE c = 'ALFKI'") != canonical_sql(
+        "SELECT * FROM t WHERE c = 'alfki'"
+    )
+    assert canonical_sql('SELECT "Order Details".x') == 'select "Order Details" . x'
+
+
+def test_canonical_sql_keeps_result_column_names():
+    """Test that queries naming their columns differently get their own key."""
+
+    assert canonical_sql("select count(*) AS total from products") != canonical_sql(
+        "SELECT count(*) AS Total FROM products"
+    )
+    assert canonical_sql("SELECT Name FROM t") != canonical_sql("SELECT name FROM t")
+    # Only the outer result columns name the columns
+    assert canonical_sql(
+        "WITH c AS (SELECT 1 AS X) SELECT x FROM c UNION SELECT 2"
+    ) == canonical_sql("with c as (select 1 as X) SELECT x from c union select 2")
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "data.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (id INTEGER)")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_round_trip(db_path):
+    cache = ResultCache(DataVersion(db_path))
+    key = ResultCache.key("SELECT id, name FROM t", 0, 100)
+    assert cache.get(key) is None
+
+    assert cache.put(key, [[1, "a"], [2, None]], ["id", "name"], has_more=False)
+    page = cache.get(ResultCache.key("select id, name from t;", 0, 100))
+    assert page == {
+        "rows": [[1, "a"], [2, None]],
+        "columns": ["id", "name"],
+        "has_more": False,
+    }
+    assert cache.put(key, [], ["id", "name"])
+    assert cache.get(key)["rows"] == []
+    assert cache.stats()["hits"] == 2
+
+
+def test_write_invalidates(db_path):
+    cache = ResultCache(DataVersion(db_path))
+    key = ResultCache.key("SELECT id FROM t", 0, 100)
+    cache.put(key, [], ["id"])
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO t VALUES (1)")
+    conn.commit()
+    conn.close()
+
+    assert cache.get(key) is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_page_of_a_query_racing_a_write_is_dropped(db_path):
+    version = DataVersion(db_path)
+    cache = ResultCache(version)
+    started_on = version.current()
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO t VALUES (1)")
+    conn.commit()
+    conn.close()
+
+    key = ResultCache.key("SELECT id FROM t", 0, 100)
+    assert not cache.put(key, [], ["id"], data_version=started_on)
+    assert cache.get(key) is None
+
+
+def test_memory_cap_evicts_least_recently_used(db_path):
+    rows = [[str(i) * 50] for i in range(3)]
+    entry_size = len(ResultCache(DataVersion(db_path))._encode(rows, ["c"], {}))
+    cache = ResultCache(
+        DataVersion(db_path), max_bytes=3 * entry_size, max_entry_bytes=2 * entry_size
+    )
+    keys = [ResultCache.key(f"SELECT {i}", 0, 100) for i in range(4)]
+    for key in keys[:3]:
+        assert cache.put(key, rows, ["c"])
+    cache.get(keys[0])
+    cache.put(keys[3], rows, ["c"])
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.stats()["bytes"] <= 3 * entry_size
+    assert cache.stats()["evictions"] == 1
+    assert not cache.put(keys[1], rows + [["y" * 2 * entry_size]], ["c"])
@@ -0,0 +1,107 @@
+import sqlite3
+
+import pytest
+
+from src import schema as schema_module
+from src.schema import SchemaCache, introspect, render_schema
+
+
+@pytest.fixture
+def shop_db(tmp_path):
+    path = tmp_path / "shop.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE customers (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            country TEXT DEFAULT 'FR'
+        );
+        CREATE TABLE "Order Details" (
+            id INTEGER PRIMARY KEY,
+            customer_id INTEGER REFERENCES customers(id),
+            amount REAL
+        );
+        CREATE UNIQUE INDEX idx_customers_name ON customers(name, country);
+        INSERT INTO customers (name) VALUES ('a'), ('b'), ('c');
+        """
+    )
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_introspect(shop_db):
+    with sqlite3.connect(shop_db) as conn:
+        schema = introspect(conn)
+
+    assert [table.name for table in schema.tables] == ["customers", "Order Details"]
+
+    customers = schema.table("CUSTOMERS")
+    assert customers.primary_key == ["id"]
+    assert customers.column("name").not_null
+    assert customers.column("country").default == "'FR'"
+    assert customers.row_count == 3
+    assert [(idx.name, idx.columns, idx.unique) for idx in customers.indexes] == [
+        ("idx_customers_name", ["name", "country"], True)
+    ]
+
+    order_details = schema.table("order details")
+    assert order_details.row_count == 0
+    [fk] = order_details.foreign_keys
+    assert (fk.column, fk.ref_table, fk.ref_column) == (
+        "customer_id",
+        "customers",
+        "id",
+    )
+
+
+def test_render_schema(shop_db):
+    with sqlite3.connect(shop_db) as conn:
+        text = render_schema(introspect(conn))
+
+    assert text == (
+        'Table: "customers"\n'
+        "Columns:\n"
+        "  - id (INTEGER) [PRIMARY KEY]\n"
+        "  - name (TEXT) NOT NULL\n"
+        "  - country (TEXT) DEFAULT 'FR'\n"
+        "\n"
+        'Table: "Order Details"\n'
+        "Columns:\n"
+        "  - id (INTEGER) [PRIMARY KEY]\n"
+        "  - customer_id (INTEGER)\n"
+        "  - amount (REAL)\n"
+        "Foreign Keys:\n"
+        "  - FOREIGN KEY (customer_id) REFERENCES customers(id)\n"
+        "\n"
+    )
+
+
+def test_schema_cache_loads_from_disk(shop_db, tmp_path, monkeypatch):
+    cache_dir = tmp_path / "schema_cache"
+    with sqlite3.connect(shop_db) as conn:
+        expected = SchemaCache(str(shop_db), str(cache_dir)).get(conn)
+
+        def fail(conn):
+            raise AssertionError("schema should come from the disk cache")
+
+        monkeypatch.setattr(schema_module, "introspect", fail)
+        schema = SchemaCache(str(shop_db), str(cache_dir)).get(conn)
+
+    assert schema == expected
+
+
+def test_schema_cache_invalidated_by_ddl(shop_db, tmp_path):
+    cache = SchemaCache(str(shop_db), str(tmp_path / "schema_cache"))
+    conn = sqlite3.connect(shop_db)
+    first = cache.get(conn)
+    assert cache.get(conn) is first
+
+    conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, label TEXT)")
+    conn.commit()
+
+    schema = cache.get(conn)
+    assert schema.version > first.version
+    assert schema.table("products") is not None
+    conn.close()
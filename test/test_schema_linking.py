@@ -0,0 +1,64 @@
+from src.schema import Column, ForeignKey, Schema, Table, render_schema
+from src.schema_linking import SchemaLinker, approx_token_count, identifier_terms
+
+
+def _table(name, columns, foreign_keys=()):
+    return Table(
+        name,
+        [Column("id", "INTEGER", primary_key=True)]
+        + [Column(column, "TEXT") for column in columns],
+        list(foreign_keys),
+    )
+
+
+SCHEMA = Schema(
+    [
+        _table("Customers", ["CompanyName", "Country"]),
+        _table(
+            "Orders",
+            ["CustomerId", "ShipCity"],
+            [ForeignKey("CustomerId", "Customers", "id")],
+        ),
+        _table(
+            "Order Details",
+            ["OrderId", "ProductId", "Quantity"],
+            [
+                ForeignKey("OrderId", "Orders", "id"),
+                ForeignKey("ProductId", "Products", "id"),
+            ],
+        ),
+        _table("Products", ["ProductName", "UnitPrice"]),
+        _table("Employees", ["LastName", "Title", "Notes", "Photo"]),
+    ]
+)
+
+
+def test_identifier_terms():
+    assert identifier_terms("OrderDetails") == ["order", "detail"]
+    assert identifier_terms("Order Details") == ["order", "detail"]
+    assert identifier_terms("unit_price") == ["unit", "price"]
+    assert identifier_terms("Categories") == ["category"]
+
+
+def test_link_keeps_matches_and_foreign_key_neighbours():
+    linked = SchemaLinker(SCHEMA).link("Which products did customers order?")
+    names = [table.name for table in linked.tables]
+
+    # Original schema order is kept so the rendered prompt is stable
+    assert names == ["Customers", "Orders", "Order Details", "Products"]
+    assert "Employees" not in names
+
+
+def test_link_respects_token_budget():
+    linker = SchemaLinker(SCHEMA, max_tokens=60)
+    linked = linker.link("What is the unit price of each product?")
+
+    assert linked.tables[0].name == "Products"
+    assert approx_token_count(render_schema(linked)) <= 60
+    assert linker.stats()["token_reduction"] > 0.5
+
+
+def test_link_falls_back_to_full_schema():
+    linker = SchemaLinker(SCHEMA)
+    assert linker.link("Hello there") is SCHEMA
+    assert linker.stats()["fallbacks"] == 1
@@ -0,0 +1,86 @@
+import sqlite3
+
+import pytest
+
+from src import utils
+from src.blobs import BlobStore
+from src.databases import DatabaseRegistry
+from src.serving import DatabaseStates, blob_response, stats_sources
+from src.utils import use_database
+
+
+def _create(path, table):
+    conn = sqlite3.connect(path)
+    conn.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY)")
+    conn.commit()
+    conn.close()
+    return str(path)
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    registry = DatabaseRegistry(
+        {
+            "shop": _create(tmp_path / "shop.db", "orders"),
+            "zoo": _create(tmp_path / "zoo.db", "animals"),
+        },
+        pool_size=1,
+    )
+    monkeypatch.setattr(utils, "databases", registry)
+    monkeypatch.setattr(utils, "_blob_store", BlobStore(str(tmp_path / "blobs")))
+    yield registry
+    registry.close()
+
+
+def test_answers_are_cached_and_become_examples(registry):
+    states = DatabaseStates("sqlite3", fewshot_k=1)
+    state = states.current()
+    assert states.current() is state
+    assert "orders" in state.base_prompt_for("how many orders?")
+
+    def flow():
+        yield "sql", "SELECT COUNT(*) FROM orders"
+        yield "done", {"sql_query": "SELECT COUNT(*) FROM orders", "attempts": 1}
+
+    events = list(state.answer_events("how many orders?", "simple", flow))
+    assert events[-1] == (
+        "done",
+        {"sql_query": "SELECT COUNT(*) FROM orders", "attempts": 1},
+    )
+    assert state.example_store.stats()["examples"] == 1
+
+    def no_flow():
+        raise AssertionError("the cached answer is used")
+
+    assert list(state.answer_events("how many orders?", "simple", no_flow)) == [
+        ("done", {"sql_query": "SELECT COUNT(*) FROM orders", "cached": True})
+    ]
+
+    with use_database("zoo"):
+        zoo = states.current()
+    assert zoo is not state and "animals" in zoo.db_schema
+
+
+def test_failed_answers_are_not_cached(registry):
+    states = DatabaseStates("sqlite3", examples=False)
+    state = states.current()
+    assert state.example_store is None
+
+    def flow():
+        yield "failed", {"sql_query": "SELECT", "message": "syntax", "attempts": 5}
+
+    list(state.answer_events("how many orders?", "react", flow))
+    assert state.question_cache.get("how many orders?") is None
+    assert "fewshot" not in stats_sources(states, bot_loader=None)
+
+
+def test_blob_response(registry):
+    digest = utils.get_blob_store().put(b"\xff\xd8", "image/jpeg")
+
+    body, status, headers = blob_response(digest)
+    assert (body, status) == (b"\xff\xd8", 200)
+    assert headers["Content-Type"] == "image/jpeg"
+    assert headers["ETag"] == f'"{digest}"'
+
+    assert blob_response(digest, f'"{digest}"')[:2] == (b"", 304)
+    assert blob_response("0" * 32)[1] == 404
@@ -1,4 +1,4 @@
-from src.simple import get_base_prompt, extend_prompt_with_errors
+from src.simple import extend_prompt_with_errors, get_base_prompt
 
 
 def test_get_base_prompt():
@@ -0,0 +1,157 @@
+import sqlite3
+
+import pytest
+
+from src.schema import introspect
+from src.sql_check import SqlChecker, SqlSyntaxError, tokenize
+
+
+@pytest.fixture
+def checker(tmp_path):
+    conn = sqlite3.connect(tmp_path / "shop.db")
+    conn.executescript(
+        """
+        CREATE TABLE Customers (CustomerID TEXT PRIMARY KEY, CompanyName TEXT);
+        CREATE TABLE Orders (
+            OrderID INTEGER PRIMARY KEY,
+            CustomerID TEXT REFERENCES Customers(CustomerID)
+        );
+        CREATE TABLE "Order Details" (
+            OrderID INTEGER REFERENCES Orders(OrderID),
+            "Unit Price" REAL,
+            Quantity INTEGER
+        );
+        """
+    )
+    schema = introspect(conn)
+    conn.close()
+    return SqlChecker(schema)
+
+
+def test_tokenize():
+    tokens = tokenize("SELECT 'a;b', \"x y\" -- c\nFROM [t u];")
+    assert [(token.kind, token.value) for token in tokens] == [
+        ("word", "SELECT"),
+        ("string", "'a;b'"),
+        ("punct", ","),
+        ("quoted", '"x y"'),
+        ("word", "FROM"),
+        ("quoted", "[t u]"),
+        ("punct", ";"),
+    ]
+    with pytest.raises(SqlSyntaxError):
+        tokenize("SELECT 'unterminated")
+
+
+@pytest.mark.parametrize(
+    "sql_query",
+    [
+        "SELECT * FROM Order Details",
+        "SELECT * FROM order_details",
+        "SELECT * FROM OrderDetails",
+        'SELECT * FROM "Order Details"',
+    ],
+)
+def test_quotes_identifiers_with_spaces(checker, sql_query):
+    assert checker.quote_identifiers(sql_query) == 'SELECT * FROM "Order Details"'
+
+
+def test_quotes_columns_and_keeps_strings(checker):
+    sql_query = "SELECT od.unit_price FROM order_details od WHERE 'Order Details' = ''"
+    assert checker.quote_identifiers(sql_query) == (
+        "SELECT od.\"Unit Price\" FROM \"Order Details\" od WHERE 'Order Details' = ''"
+    )
+
+
+def test_check_valid(checker):
+    sql_query = (
+        "WITH recent AS (SELECT * FROM Orders) "
+        "SELECT c.CompanyName, SUM(od.Quantity), "
+        "CASE WHEN r.OrderID > 1 THEN 'a' ELSE 'b' END AS kind "
+        "FROM Customers c JOIN recent r ON r.CustomerID = c.CustomerID "
+        "JOIN Order_Details AS od ON od.OrderID = r.OrderID, "
+        "(SELECT 1 AS one) s, json_each('[1]') "
+        "WHERE replace(c.CompanyName, 'a', 'b') != '' GROUP BY c.CompanyName;"
+    )
+    rewritten, errors = checker.check(sql_query)
+    assert errors == []
+    assert 'JOIN "Order Details" AS od' in rewritten
+
+
+@pytest.mark.parametrize(
+    "sql_query",
+    [
+        "SELECT main.Orders.OrderID, o.CustomerID FROM main.Orders o",
+        "SELECT Orders.OrderID FROM main.Orders",
+        "SELECT other.t.x FROM other.t",
+        "SELECT json_each.value FROM Orders, json_each('[1, 2]')",
+        "SELECT j.key, j.value FROM Orders JOIN json_each('[1]') AS j",
+    ],
+)
+def test_check_qualified_names(checker, sql_query):
+    _, errors = checker.check(sql_query)
+    assert errors == []
+
+
+@pytest.mark.parametrize(
+    "sql_query",
+    [
+        (
+            "SELECT CustomerID, CompanyName FROM Customers "
+            "UNION SELECT CustomerID, OrderID FROM Orders"
+        ),
+        (
+            "SELECT CustomerID, OrderID FROM Orders o, Customers c "
+            "INTERSECT SELECT CustomerID, CompanyName FROM Customers "
+            "EXCEPT SELECT CustomerID, OrderID FROM Orders ORDER BY 1, 2"
+        ),
+        (
+            "SELECT * FROM (SELECT OrderID, CustomerID FROM Orders "
+            "UNION ALL SELECT Quantity, OrderID FROM Order_Details) u, Customers"
+        ),
+        "SELECT OrderID FROM Orders LIMIT 1, 2",
+    ],
+)
+def test_check_compound_queries(checker, sql_query):
+    """Test that the columns of the next SELECT are not taken for tables."""
+
+    _, errors = checker.check(sql_query)
+    assert errors == []
+
+
+def test_check_compound_query_tables(checker):
+    _, errors = checker.check(
+        "SELECT CustomerID FROM Customers UNION SELECT CustomerID FROM Customer, Orders"
+    )
+    assert errors == ['no such table: Customer (did you mean "Customers"?)']
+
+
+@pytest.mark.parametrize(
+    "sql_query, error",
+    [
+        ("", "incomplete input"),
+        ("SELECT 1; SELECT 2", "You can only execute one statement at a time."),
+        ("DELETE FROM Orders", "Only read-only SELECT queries are allowed"),
+        ("SELECT 1 FROM Orders; DROP TABLE Orders", "can only execute one"),
+        ("PRAGMA table_info(Orders)", "found PRAGMA"),
+        (
+            "SELECT * FROM Customer",
+            'no such table: Customer (did you mean "Customers"?)',
+        ),
+        ("SELECT * FROM OrderDetail", 'did you mean "Order Details"?'),
+        ("SELECT o.Total FROM Orders o", "no such column: o.Total"),
+        (
+            "SELECT Customers.CompanyNme FROM Customers",
+            'no such column: Customers.CompanyNme (did you mean "CompanyName"?)',
+        ),
+        (
+            "SELECT main.Orders.Total FROM Orders",
+            "no such column: Orders.Total",
+        ),
+        ("SELECT main.Order.OrderID FROM Orders", "no such table: main.Order"),
+    ],
+)
+def test_check_errors(checker, sql_query, error):
+    _, errors = checker.check(sql_query)
+    assert len(errors) == 1
+    assert error in errors[0]
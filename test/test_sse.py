@@ -0,0 +1,61 @@
+import logging
+
+import torch
+
+from src import simple
+from src.backends import TransformersBackend
+from src.sse import format_event, relay_tokens
+
+
+def test_format_event():
+    assert format_event("token", 'SELECT "a"') == (
+        'event: token\ndata: "SELECT \\"a\\""\n\n'
+    )
+
+
+def test_relay_tokens_returns_generator_value():
+    def generation():
+        yield "SELECT"
+        yield " 1"
+        return "SELECT 1"
+
+    def events():
+        result = yield from relay_tokens(generation())
+        yield "done", result
+
+    assert list(events()) == [
+        ("token", "SELECT"),
+        ("token", " 1"),
+        ("done", "SELECT 1"),
+    ]
+
+
+def test_think_stream_matches_generate(tiny_model, tiny_tokenizer, monkeypatch):
+    """Test that the streamed pieces add up to the regular completion."""
+
+    backend = TransformersBackend(model=tiny_model, tokenizer=tiny_tokenizer)
+    monkeypatch.setattr(simple, "MAX_LENGTH", 960)
+    bot = simple.SimpleChatBot(
+        "sqlite3", "users (id)", 1, logging.getLogger(), backend=backend
+    )
+
+    prompt = simple.get_base_prompt("sqlite3", "users (id)", "How many users?")
+    model_inputs = tiny_tokenizer(prompt, return_tensors="pt")
+    with torch.inference_mode():
+        generated_ids = tiny_model.generate(**model_inputs, max_length=960)
+    expected = tiny_tokenizer.decode(
+        generated_ids[0, model_inputs["input_ids"].shape[1] :],
+        skip_special_tokens=True,
+    )
+
+    stream = bot.think_stream(prompt)
+    pieces = []
+    while True:
+        try:
+            pieces.append(next(stream))
+        except StopIteration as stop:
+            sql_query = stop.value
+            break
+
+    assert "".join(pieces) == expected
+    assert sql_query == bot._extract_sql_from_output(expected)
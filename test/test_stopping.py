@@ -0,0 +1,65 @@
+import logging
+
+import torch
+
+from src.simple import SimpleChatBot
+from src.stopping import SqlBlockStoppingCriteria, StoppingStats
+
+PROMPT = "Return the SQL query between ```sql and ``` tags.\n**Generated SQL Query:**"
+COMPLETION = "Sure!\n```sql\nSELECT name FROM users;\n```\nThis query selects..."
+
+
+def _run(criteria, tokenizer, prompts):
+    """Feed the completions token by token like generate does."""
+    input_ids = tokenizer(prompts, return_tensors="pt", padding=True)["input_ids"]
+    completion_ids = [tokenizer(COMPLETION)["input_ids"]] * len(prompts)
+    for step in range(len(completion_ids[0])):
+        next_ids = torch.tensor([[ids[step]] for ids in completion_ids])
+        input_ids = torch.cat([input_ids, next_ids], dim=-1)
+        is_done = criteria(input_ids, None)
+        if is_done.all():
+            return input_ids
+    return input_ids
+
+
+def test_stops_at_closing_fence(tiny_tokenizer):
+    prompt_length = len(tiny_tokenizer(PROMPT)["input_ids"])
+    criteria = SqlBlockStoppingCriteria(tiny_tokenizer, prompt_length)
+
+    input_ids = _run(criteria, tiny_tokenizer, [PROMPT])
+
+    # The fences of the prompt are ignored, the prose after the block is not generated
+    completion = tiny_tokenizer.decode(input_ids[0, prompt_length:])
+    assert completion == "Sure!\n```sql\nSELECT name FROM users;\n```"
+    assert criteria.stopped_at == {0: len(completion)}
+
+
+def test_stops_each_row_of_a_batch(tiny_tokenizer):
+    prompts = [PROMPT, "Short prompt"]
+    prompt_length = tiny_tokenizer(prompts, return_tensors="pt", padding=True)[
+        "input_ids"
+    ].shape[1]
+    criteria = SqlBlockStoppingCriteria(tiny_tokenizer, prompt_length)
+
+    input_ids = _run(criteria, tiny_tokenizer, prompts)
+    assert set(criteria.stopped_at) == {0, 1}
+
+    stats = StoppingStats()
+    new_ids = input_ids[:, prompt_length:]
+    stats.record(criteria, new_ids, prompt_length + 100, tiny_tokenizer.pad_token_id)
+    generated = len("Sure!\n```sql\nSELECT name FROM users;\n```")
+    assert stats.stats()["stopped_early"] == 2
+    assert stats.stats()["avg_generated_tokens"] == generated
+    assert stats.stats()["tokens_saved"] == 2 * (100 - generated)
+
+
+def test_extract_sql_without_marker():
+    bot = SimpleChatBot.__new__(SimpleChatBot)
+    bot.logger = logging.getLogger(__name__)
+
+    assert bot._extract_sql_from_output(COMPLETION) == "SELECT name FROM users;"
+    assert (
+        bot._extract_sql_from_output("**Generated SQL Query:**\n" + COMPLETION)
+        == "SELECT name FROM users;"
+    )
+    assert bot._extract_sql_from_output("SELECT 1") == "SELECT 1"
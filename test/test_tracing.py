@@ -0,0 +1,86 @@
+import logging
+import threading
+from contextvars import copy_context
+
+import pytest
+
+from src.tracing import Tracer, tracer
+from src.utils import validate_sql
+
+
+def test_spans_join_the_current_trace():
+    traces = Tracer()
+    with traces.trace("question", flow="simple") as trace:
+        with traces.span("tokenize", tokens=12):
+            pass
+        with traces.span("decode") as decoding:
+            decoding.set(tokens=30)
+        # Threads started with a copy of the context report to the same trace
+        thread = threading.Thread(
+            target=copy_context().run,
+            args=(lambda: traces.record("validate_sql", 0.002),),
+        )
+        thread.start()
+        thread.join()
+    with traces.span("render"):
+        pass
+
+    assert [name for name, *_ in trace.spans] == ["tokenize", "decode", "validate_sql"]
+    recorded = traces.traces()[0]
+    assert recorded["flow"] == "simple"
+    assert recorded["spans"][1] == dict(recorded["spans"][1], name="decode", tokens=30)
+    assert traces.current_trace() is None
+
+
+def test_errors_are_recorded_but_not_generator_exit():
+    traces = Tracer()
+
+    def events():
+        with traces.trace("question"):
+            yield "done"
+            yield "unreachable"
+
+    stream = events()
+    next(stream)
+    stream.close()
+    with pytest.raises(KeyError), traces.trace("question"):
+        raise KeyError("oops")
+
+    assert [trace.get("error") for trace in traces.traces()] == ["KeyError", None]
+
+
+def test_prometheus_metrics():
+    traces = Tracer()
+    traces.record("prefill", 0.02, tokens=100)
+    traces.record("prefill", 3.0, tokens=50)
+    traces.count("questions", flow="simple", outcome="valid")
+    traces.count("questions", flow="simple", outcome="valid")
+
+    lines = traces.metrics().splitlines()
+    assert "# TYPE text_to_sql_span_seconds histogram" in lines
+    assert 'text_to_sql_span_seconds_bucket{span="prefill",le="0.01"} 0' in lines
+    assert 'text_to_sql_span_seconds_bucket{span="prefill",le="0.025"} 1' in lines
+    assert 'text_to_sql_span_seconds_bucket{span="prefill",le="+Inf"} 2' in lines
+    assert 'text_to_sql_span_seconds_count{span="prefill"} 2' in lines
+    assert 'text_to_sql_tokens_total{span="prefill"} 150' in lines
+    assert 'text_to_sql_questions_total{flow="simple",outcome="valid"} 2' in lines
+
+
+def test_prompt_sampling(caplog):
+    traces = Tracer(prompt_sample_rate=0.0)
+    with caplog.at_level(logging.INFO, logger="src.tracing"):
+        assert not traces.log_prompt("secret prompt")
+        traces.prompt_sample_rate = 1.0
+        with traces.trace("question") as trace:
+            assert traces.log_prompt("full prompt", attempt=2)
+    assert "full prompt" in caplog.text
+    assert "secret prompt" not in caplog.text
+    assert trace.attrs["prompt_logged"]
+
+
+def test_validation_is_traced():
+    with tracer.trace("question") as trace:
+        validate_sql('SELECT * FROM "Order Details"')
+        validate_sql("SELECT * FROM nope")
+    spans = [attrs for name, _, _, attrs in trace.spans if name == "validate_sql"]
+    assert spans == [{"valid": True}, {"valid": False, "stage": "static"}]
@@ -1,4 +1,18 @@
-from src.utils import validate_sql
+import sqlite3
+
+import pytest
+
+from src import utils
+from src.blobs import BlobStore
+from src.databases import DatabaseRegistry
+from src.governor import ExecutionGovernor, QueryBudgetExceeded
+from src.utils import (
+    ResultStream,
+    execute_sql,
+    preview_sql,
+    stream_sql,
+    validate_sql,
+)
 
 
 def test_valid_sql_query():
@@ -57,3 +71,125 @@ def test_order_details():
     sql_query = 'SELECT * FROM "Order details"'
     is_valid, error_message = validate_sql(sql_query)
     print(is_valid, error_message)
+
+
+@pytest.fixture
+def items_db(tmp_path, monkeypatch):
+    """Point the shared pool at a small database with 250 rows."""
+
+    path = tmp_path / "items.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT, Picture BLOB)")
+    conn.executemany(
+        "INSERT INTO items VALUES (?, ?, ?)",
+        [(i, f"item {i}", b"\xff\xd8") for i in range(250)],
+    )
+    conn.commit()
+    conn.close()
+
+    registry = DatabaseRegistry({"items": str(path)}, pool_size=1)
+    monkeypatch.setattr(utils, "databases", registry)
+    monkeypatch.setattr(utils, "_blob_store", BlobStore(str(tmp_path / "blobs")))
+    return registry.get().pool
+
+
+def test_execute_sql_processes_blobs(items_db):
+    """Test that picture blobs are returned as blob URLs and text as str."""
+
+    results, columns = execute_sql("SELECT * FROM items WHERE id = 1")
+    assert columns == ["id", "name", "Picture"]
+    assert results[0][:2] == [1, "item 1"]
+
+    digest = results[0][2].removeprefix(utils.BLOB_URL_PREFIX)
+    assert utils.get_blob_store().get(digest) == (b"\xff\xd8", "image/jpeg")
+
+
+def test_stream_sql_pages(items_db):
+    """Test that pages are fetched lazily and flag whether more rows exist."""
+
+    stream = stream_sql("SELECT id FROM items ORDER BY id", page=0, page_size=100)
+    assert stream.columns == ["id"]
+    assert [row[0] for row in stream] == list(range(100))
+    assert stream.has_more
+
+    stream = stream_sql("SELECT id FROM items ORDER BY id", page=2, page_size=100)
+    assert [row[0] for row in stream] == list(range(200, 250))
+    assert not stream.has_more
+
+    assert items_db.stats()["in_use"] == 0
+
+
+def test_stream_sql_byte_budget(items_db):
+    """Test that a page stops once it exceeds the byte budget."""
+
+    stream = ResultStream("SELECT name FROM items", limit=1000, max_bytes=100)
+    rows = list(stream)
+    assert 0 < len(rows) < 250
+    assert stream.truncated
+    assert stream.has_more
+
+
+def test_stream_sql_releases_connection_when_not_consumed(items_db):
+    stream = stream_sql("SELECT * FROM items")
+    assert items_db.stats()["in_use"] == 1
+    stream.close()
+    assert items_db.stats()["in_use"] == 0
+
+
+CARTESIAN = "SELECT COUNT(*) FROM items a, items b, items c"
+
+
+def test_stream_sql_step_budget(items_db):
+    """Test that a runaway query is interrupted and its connection released."""
+
+    governor = ExecutionGovernor(max_steps=100_000, interval=100)
+    stream = ResultStream(CARTESIAN, governor=governor)
+    assert list(stream) == []
+    assert "VM steps" in stream.budget_exceeded
+    assert governor.cost()["exceeded"] == "steps"
+    assert items_db.stats()["in_use"] == 0
+
+
+def test_execute_sql_time_budget(items_db, monkeypatch):
+    monkeypatch.setattr(utils, "QUERY_TIME_BUDGET", 0.01)
+    with pytest.raises(QueryBudgetExceeded, match="time budget"):
+        execute_sql(CARTESIAN)
+    assert items_db.stats()["in_use"] == 0
+
+
+def test_preview_sql(items_db):
+    """Test that previews only read a few rows and report their cost."""
+
+    rows, columns, cost = preview_sql("SELECT id FROM items ORDER BY id DESC;", 3)
+    assert columns == ["id"]
+    assert rows == [[249], [248], [247]]
+    assert cost["rows"] == 3
+    assert cost["limited"]
+    assert cost["exceeded"] is None
+    assert cost["elapsed_ms"] >= 0
+
+
+def test_result_cache(items_db):
+    """Test that a page read to its end is served from memory until a write."""
+
+    first = stream_sql("SELECT id, Picture FROM items ORDER BY id", page=1)
+    rows = list(first)
+    assert not first.cached
+
+    second = stream_sql("select id, Picture from items order by id;", page=1)
+    assert second.cached
+    assert list(second) == rows
+    assert (second.has_more, second.rows_read) == (True, 100)
+    assert execute_sql("SELECT id FROM items LIMIT 3") == execute_sql(
+        "SELECT id FROM items LIMIT 3"
+    )
+    assert utils.result_cache_stats()["hits"] == 2
+
+    conn = sqlite3.connect(items_db.db_path)
+    conn.execute("DELETE FROM items WHERE id >= 150")
+    conn.commit()
+    conn.close()
+
+    third = stream_sql("SELECT id, Picture FROM items ORDER BY id", page=1)
+    assert not third.cached
+    assert len(list(third)) == 50